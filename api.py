@@ -0,0 +1,339 @@
+import asyncio
+import base64
+import json
+import queue
+import time as t
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import db
+import market_stats
+import metrics
+
+# API JSON in sola lettura sopra annunci.db, per i dashboard:
+#   /api/searches                       le ricerche, con quanti annunci ha ognuna
+#   /api/searches/<nome>/listings       gli annunci di una ricerca, a pagine (keyset: ?after=<next>)
+#   /api/hits                           nuovi, ribassi e ripubblicati, dal più recente (?search=, ?kind=new|drop|repost, ?after=)
+#   /api/stats                          statistiche di mercato correnti per ricerca
+# Un event loop tiene le connessioni HTTP (keep-alive), le query girano in un pool di thread con
+# connessioni in sola lettura: con il WAL non disturbano mai il demone che scrive.
+# Le risposte restano in cache finché il demone non chiude un giro (tabella giri), al massimo max_age secondi,
+# e richieste uguali in contemporanea aspettano la stessa query.
+
+MAX_LIMIT = 200
+DEFAULT_LIMIT = 50
+CACHE_ENTRIES = 1024
+CHECK_EVERY = 1.0   # secondi tra un controllo dei giri e l'altro
+IDLE_TIMEOUT = 30   # secondi di keep-alive senza richieste
+KINDS = {"new": 0, "drop": 1, "repost": 3}
+
+
+class BadRequest(Exception):
+    pass
+
+
+class NotFound(Exception):
+    pass
+
+
+class ReadPool:
+    '''size connessioni in sola lettura: ogni thread ne prende una, la usa e la rimette'''
+
+    def __init__(self, path, size):
+        self.free = queue.Queue()
+        for _ in range(size):
+            self.free.put(db.open_reader(path, check_same_thread=False))
+
+    @contextmanager
+    def connection(self):
+        conn = self.free.get()
+        try:
+            yield conn
+        finally:
+            self.free.put(conn)
+
+    def close(self):
+        while not self.free.empty():
+            self.free.get().close()
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, size):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise BadRequest("cursore non valido")
+    if not isinstance(values, list) or len(values) != size:
+        raise BadRequest("cursore non valido")
+    return values
+
+
+def limit_of(query):
+    try:
+        limit = int(query.get("limit", DEFAULT_LIMIT))
+    except ValueError:
+        raise BadRequest("limit deve essere un numero")
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def page(rows, limit, key):
+    '''Abbiamo chiesto limit+1 righe: se c'è la riga in più esiste una pagina dopo, e il cursore è l'ultima restituita'''
+    items = [dict(r) for r in rows[:limit]]
+    return {"items": items, "next": encode_cursor(key(rows[limit - 1])) if len(rows) > limit else None}
+
+
+def searches(conn, query):
+    rows = conn.execute("""
+        SELECT r.nome, r.url, r.prezzo_min, r.prezzo_max, r.attiva, r.ultima_esecuzione, r.profondita_max,
+               r.tasso_novita, (SELECT COUNT(*) FROM annunci_ricerche m WHERE m.ricerca = r.nome) AS annunci
+        FROM ricerche r ORDER BY r.nome
+    """).fetchall()
+    return {"items": [dict(r) for r in rows]}
+
+
+def listings(conn, query, name):
+    '''Annunci di una ricerca dal più recente (order=new, chiave a.id) o dal più economico (order=price, chiave prezzo+id)'''
+    if conn.execute("SELECT 1 FROM ricerche WHERE nome = ?", (name,)).fetchone() is None:
+        raise NotFound(f"ricerca {name} inesistente")
+    limit = limit_of(query)
+    order = query.get("order", "new")
+    after = query.get("after")
+    columns = """a.id, m.link, a.titolo, m.prezzo, a.localita, a.data_scoperta, m.ultimo_aggiornamento
+        FROM annunci_ricerche m JOIN annunci a ON a.link = m.link WHERE m.ricerca = ?"""
+    if order == "new":
+        where, params = "", [name]
+        if after:
+            (last_id,) = decode_cursor(after, 1)
+            where, params = " AND a.id < ?", [name, last_id]
+        rows = conn.execute(f"SELECT {columns}{where} ORDER BY a.id DESC LIMIT ?", params + [limit + 1]).fetchall()
+        result = page(rows, limit, lambda r: [r["id"]])
+    elif order == "price":
+        where, params = " AND m.prezzo IS NOT NULL", [name]
+        if after:
+            last_price, last_id = decode_cursor(after, 2)
+            where, params = where + " AND (m.prezzo, a.id) > (?, ?)", [name, last_price, last_id]
+        rows = conn.execute(f"SELECT {columns}{where} ORDER BY m.prezzo, a.id LIMIT ?", params + [limit + 1]).fetchall()
+        result = page(rows, limit, lambda r: [r["prezzo"], r["id"]])
+    else:
+        raise BadRequest("order deve essere new o price")
+    result["search"] = name
+    return result
+
+
+def hits(conn, query):
+    '''Il feed delle novità, dal più recente'''
+    limit = limit_of(query)
+    where, params = [], []
+    if "search" in query:
+        where.append("ricerca = ?")
+        params.append(query["search"])
+    if "kind" in query:
+        if query["kind"] not in KINDS:
+            raise BadRequest("kind deve essere new, drop o repost")
+        where.append("tipo = ?")
+        params.append(KINDS[query["kind"]])
+    if query.get("after"):
+        (last_id,) = decode_cursor(query["after"], 1)
+        where.append("id < ?")
+        params.append(last_id)
+    sql = "SELECT id, ts, ricerca, link, titolo, prezzo, prezzo_vecchio, localita, tipo FROM novita"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    rows = conn.execute(sql + " ORDER BY id DESC LIMIT ?", params + [limit + 1]).fetchall()
+    result = page(rows, limit, lambda r: [r["id"]])
+    kinds = {v: k for k, v in KINDS.items()}
+    for item in result["items"]:
+        item["tipo"] = kinds.get(item["tipo"], item["tipo"])
+    return result
+
+
+def stats(conn, query):
+    '''mu/sigma/conteggio/soglia di ogni ricerca dagli aggregati incrementali (market_stats), come li vede il demone'''
+    buckets = {}
+    for cat, b, n, s, ss in conn.execute("SELECT categoria, bucket, n, somma, somma_q FROM mercato_bucket"):
+        buckets.setdefault(cat, {})[b] = [n, s, ss]
+    names = [r[0] for r in conn.execute("SELECT nome FROM ricerche ORDER BY nome")]
+    return {"items": [dict(search=name, **(market_stats.summarize(buckets.get(name, {})) or {})) for name in names]}
+
+
+def route(path):
+    '''(nome della rotta, funzione, argomenti in più) o NotFound'''
+    parts = [unquote(p) for p in path.strip("/").split("/")]
+    if parts[:1] != ["api"]:
+        raise NotFound(path)
+    parts = parts[1:]
+    if parts == ["searches"]:
+        return "searches", searches, ()
+    if len(parts) == 3 and parts[0] == "searches" and parts[2] == "listings":
+        return "listings", listings, (parts[1],)
+    if parts == ["hits"]:
+        return "hits", hits, ()
+    if parts == ["stats"]:
+        return "stats", stats, ()
+    raise NotFound(path)
+
+
+class Api:
+    '''Cache, single-flight e HTTP sopra un ReadPool'''
+
+    def __init__(self, pool, readers, max_age=60):
+        self.pool = pool
+        self.executor = ThreadPoolExecutor(readers, thread_name_prefix="api")
+        self.max_age = max_age
+        self.cache = OrderedDict()  # chiave -> (generazione, istante, status, corpo, etag)
+        self.inflight = {}          # chiave -> Future della query in corso
+        self.generation = None      # ultimo giro visto in giri
+        self.checked = 0.0
+
+    def run(self, fn, *args):
+        def job():
+            with self.pool.connection() as conn:
+                return fn(conn, *args)
+        return asyncio.get_running_loop().run_in_executor(self.executor, job)
+
+    async def current_generation(self):
+        '''L'id dell'ultimo giro, riletto al massimo ogni CHECK_EVERY secondi: se è cambiato la cache è vecchia'''
+        now = t.monotonic()
+        if self.generation is None or now - self.checked >= CHECK_EVERY:
+            self.checked = now
+            generation = await self.run(lambda conn: conn.execute("SELECT COALESCE(MAX(id), 0) FROM giri").fetchone()[0])
+            if generation != self.generation:
+                self.generation = generation
+                self.cache.clear()
+        return self.generation
+
+    async def respond(self, target):
+        '''(status, corpo, etag) per una GET'''
+        parts = urlsplit(target)
+        try:
+            name, fn, extra = route(parts.path)
+        except NotFound as e:
+            return 404, json.dumps({"error": f"non trovato: {e}"}).encode("utf-8"), None
+        query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        key = (parts.path, tuple(sorted(query.items())))
+
+        generation = await self.current_generation()
+        cached = self.cache.get(key)
+        if cached is not None and cached[0] == generation and t.monotonic() - cached[1] < self.max_age:
+            self.cache.move_to_end(key)
+            metrics.inc("api_requests_total", route=name, cache="hit")
+            return cached[2:]
+
+        # Chi chiede la stessa cosa mentre la query è in corso aspetta quella
+        if key in self.inflight:
+            metrics.inc("api_requests_total", route=name, cache="wait")
+            return await asyncio.shield(self.inflight[key])
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        metrics.inc("api_requests_total", route=name, cache="miss")
+        try:
+            with metrics.timed("api"):
+                try:
+                    result = 200, json.dumps(await self.run(fn, query, *extra), ensure_ascii=False).encode("utf-8")
+                except BadRequest as e:
+                    result = 400, json.dumps({"error": str(e)}).encode("utf-8")
+                except NotFound as e:
+                    result = 404, json.dumps({"error": str(e)}).encode("utf-8")
+            result += (f'"{generation}-{zlib.crc32(result[1]):08x}"',)
+            if result[0] == 200:
+                self.cache[key] = (generation, t.monotonic()) + result
+                if len(self.cache) > CACHE_ENTRIES:
+                    self.cache.popitem(last=False)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            del self.inflight[key]
+
+    async def handle(self, reader, writer):
+        '''Una connessione HTTP/1.1: richieste GET una dopo l'altra finché il client non chiude'''
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                if int(headers.get("content-length", 0) or 0):
+                    await reader.readexactly(int(headers["content-length"]))
+                keep_alive = (version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                              or headers.get("connection", "").lower() == "keep-alive")
+
+                if method not in ("GET", "HEAD"):
+                    status, body, etag = 405, b'{"error": "solo GET"}', None
+                else:
+                    try:
+                        status, body, etag = await self.respond(target)
+                    except Exception as e:
+                        print(f"❌ API {target}: {e}")
+                        status, body, etag = 500, b'{"error": "errore interno"}', None
+                if etag is not None and headers.get("if-none-match") == etag:
+                    status, body = 304, b""
+                writer.write(self.head(status, body, etag, keep_alive))
+                if method != "HEAD":
+                    writer.write(body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def head(status, body, etag, keep_alive):
+        reason = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                  500: "Internal Server Error"}[status]
+        lines = [f"HTTP/1.1 {status} {reason}", "Content-Type: application/json; charset=utf-8",
+                 f"Content-Length: {len(body)}", "Cache-Control: no-cache",
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        if etag is not None:
+            lines.append(f"ETag: {etag}")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def serve(path, host, port, readers=4, max_age=60, ready=None):
+    '''Serve l'API finché non viene fermata. ready(server), se c'è, viene chiamata appena si ascolta.'''
+    pool = ReadPool(path, readers)
+    api = Api(pool, readers, max_age)
+    server = await asyncio.start_server(api.handle, host, port)
+    port = server.sockets[0].getsockname()[1]
+    print(f"🌐 API su http://{host}:{port}/api/searches ({readers} connessioni in lettura)")
+    if ready is not None:
+        ready(server)
+    try:
+        async with server:
+            await server.serve_forever()
+    except asyncio.CancelledError:
+        pass # server.close() da un altro thread
+    finally:
+        api.executor.shutdown(wait=False)
+        pool.close()
+
+
+def serve_in_thread(path, host, port, readers=4, max_age=60):
+    '''Per --daemon --serve: l'API gira nel suo thread col suo event loop, il demone va avanti'''
+    import threading
+    thread = threading.Thread(target=asyncio.run, args=(serve(path, host, port, readers, max_age),), name="api", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,210 @@
+import gzip
+import itertools
+import json
+import os
+import sqlite3
+import time as t
+from collections import namedtuple
+from hashlib import blake2b
+
+import metrics
+from next_data import find_payload
+
+# Archivio delle pagine scaricate: il __NEXT_DATA__ di ogni pagina di risultati, compresso e messo in coda
+# a file segmento che ruotano oltre una certa dimensione. Ogni pagina è un frame gzip (o zstd) a sé:
+# dato offset e lunghezza si legge da sola, e `zcat segmento.gz` (o `zstdcat`) tira fuori tutti i payload,
+# uno per riga. L'indice (index.db, SQLite) dice dove sta ogni (ricerca, pagina, ts) e a che giro apparteneva:
+# serve a --replay per rimandare i giri dentro parse, scoring e scrittura senza rete.
+
+CODECS = ("gzip", "zstd")
+EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+SEGMENT_BYTES = 64 * 2**20 # oltre si apre un segmento nuovo
+KEEP_DAYS = 30 # come gli annunci: i segmenti più vecchi si cancellano
+PRUNE_EVERY = 3600 # secondi tra una pulizia e l'altra (è una GROUP BY su tutto l'indice)
+INDEX_FILE = "index.db"
+DAY = 86400
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pagine (
+    id INTEGER PRIMARY KEY,
+    giro REAL NOT NULL,          -- inizio del giro (epoch): le pagine di un giro si rigiocano insieme
+    ts REAL NOT NULL,
+    ricerca TEXT NOT NULL,       -- una riga per ogni ricerca che ha lavorato la pagina (stesso URL, stesso frame)
+    url TEXT NOT NULL,
+    pagina INTEGER NOT NULL,
+    segmento TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    lunghezza INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_pagine_ricerca ON pagine (ricerca, ts, pagina);
+CREATE INDEX IF NOT EXISTS idx_pagine_ts ON pagine (ts);
+CREATE INDEX IF NOT EXISTS idx_pagine_segmento ON pagine (segmento);
+"""
+
+ArchivedPage = namedtuple("ArchivedPage", "giro ts url page searches payload")
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError("l'archivio zstd vuole il pacchetto zstandard (pip install zstandard)") from e
+    return zstandard
+
+
+def compressor(codec):
+    if codec == "gzip":
+        return lambda data: gzip.compress(data, GZIP_LEVEL, mtime=0)
+    if codec == "zstd":
+        return _zstd().ZstdCompressor(level=ZSTD_LEVEL).compress
+    raise ValueError(f"codec deve essere uno tra {', '.join(CODECS)}")
+
+
+def decompressor(segment):
+    '''Il codec di un segmento si legge dall'estensione'''
+    if segment.endswith(EXTENSIONS["zstd"]):
+        return _zstd().ZstdDecompressor().decompress
+    return gzip.decompress
+
+
+def archived_payload(body, items_list):
+    '''Il testo del __NEXT_DATA__ come è arrivato; se l'ha trovato solo BeautifulSoup (markup diverso)
+    ricostruiamo il minimo che next_data.items_from_payload sa rileggere'''
+    payload = find_payload(body)
+    if payload is None:
+        payload = json.dumps({"props": {"pageProps": {"initialState": {"items": {"list": items_list}}}}})
+    return payload.encode("utf-8")
+
+
+class Archive:
+    '''Una cartella di segmenti più index.db. Scrive un processo per segmento (nel nome c'è il pid,
+    così i --workers non si pestano i piedi), l'indice lo condividono tutti.'''
+
+    def __init__(self, path, codec="gzip", segment_bytes=SEGMENT_BYTES, keep_days=KEEP_DAYS):
+        os.makedirs(path, exist_ok=True)
+        self.path, self.codec = path, codec
+        self.compress = compressor(codec)
+        self.segment_bytes, self.keep_days = segment_bytes, keep_days
+        self.index = sqlite3.connect(os.path.join(path, INDEX_FILE), timeout=30)
+        self.index.execute("PRAGMA journal_mode = WAL")
+        self.index.execute("PRAGMA synchronous = NORMAL")
+        self.index.executescript(INDEX_SCHEMA)
+        self.segment = self.file = None
+        self.segments = 0
+        self.last = {} # (url, pagina) -> (impronta del payload, offset, lunghezza) nel segmento corrente
+        self.giro = 0.0
+        self.pruned = 0.0
+        self.stored = self.duplicates = self.raw_bytes = self.written_bytes = 0
+
+    def begin_cycle(self, started):
+        '''Un giro nuovo (refresh): le pagine che arrivano da qui in poi sono sue. Già che ci siamo, pulizia.'''
+        self.giro = started
+        self.prune(started)
+
+    def _rotate(self):
+        if self.file is not None:
+            self.file.close()
+        self.segments += 1
+        stamp = t.strftime("%Y%m%d-%H%M%S")
+        self.segment = f"{stamp}-{os.getpid()}-{self.segments}{EXTENSIONS[self.codec]}"
+        self.file = open(os.path.join(self.path, self.segment), "ab")
+        self.last = {} # le pagine doppie puntano solo dentro il segmento: prune può cancellare i vecchi
+
+    def append(self, url, page, searches, body, items_list, now=None):
+        '''Archivia una pagina di risultati per le ricerche che la lavorano. Se è identica all'ultima
+        (url, pagina) dello stesso segmento scrive solo le righe d'indice. Ritorna i byte scritti.
+        Un errore (disco pieno...) non deve fermare lo scraping: si stampa e si va avanti.'''
+        now = now if now is not None else t.time()
+        try:
+            payload = archived_payload(body, items_list)
+            digest = blake2b(payload, digest_size=16).digest()
+            cached = self.last.get((url, page))
+            if self.file is not None and cached is not None and cached[0] == digest:
+                offset, length = cached[1], cached[2]
+                written = 0
+                self.duplicates += 1
+            else:
+                frame = self.compress(payload + b"\n")
+                if self.file is None or self.file.tell() + len(frame) > self.segment_bytes:
+                    self._rotate()
+                offset, length = self.file.tell(), len(frame)
+                self.file.write(frame)
+                self.file.flush() # il frame sta sul file prima che l'indice lo citi
+                self.last[(url, page)] = (digest, offset, length)
+                written = length
+                self.stored += 1
+                self.raw_bytes += len(payload)
+                self.written_bytes += length
+            if not self.giro:
+                self.giro = now # pagine fuori da un refresh (--add): un giro solo anche loro
+            with self.index:
+                self.index.executemany(
+                    "INSERT INTO pagine (giro, ts, ricerca, url, pagina, segmento, offset, lunghezza) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(self.giro, now, name, url, page, self.segment, offset, length) for name in searches])
+        except (OSError, sqlite3.Error) as e:
+            print(f"   ⚠️ Archivio: pagina {page} non salvata ({e})")
+            metrics.inc("archive_errors_total")
+            return 0
+        metrics.inc("archive_pages_total", kind="stored" if written else "duplicate")
+        metrics.inc("archive_bytes_total", written)
+        return written
+
+    def prune(self, now=None):
+        '''Via i segmenti la cui ultima pagina è più vecchia di keep_days, file e righe d'indice'''
+        now = now if now is not None else t.time()
+        if not self.keep_days or now - self.pruned < PRUNE_EVERY:
+            return 0
+        self.pruned = now
+        cutoff = now - self.keep_days * DAY
+        old = [r[0] for r in self.index.execute(
+            "SELECT segmento FROM pagine GROUP BY segmento HAVING MAX(ts) < ?", (cutoff,)) if r[0] != self.segment]
+        for segment in old:
+            with self.index:
+                self.index.execute("DELETE FROM pagine WHERE segmento = ?", (segment,))
+            try:
+                os.remove(os.path.join(self.path, segment))
+            except FileNotFoundError:
+                pass
+        if old:
+            print(f"🗄️ Archivio: rimossi {len(old)} segmenti più vecchi di {self.keep_days} giorni")
+        return len(old)
+
+    def pages(self, since=None, until=None, search=None):
+        '''Le pagine archiviate giro per giro e in ordine di arrivo dentro il giro (con più worker sullo stesso
+        index.db le pagine di giri diversi si alternano negli id), una alla volta (il payload si legge solo quando serve):
+        ArchivedPage(giro, ts, url, page, searches, payload). Filtri su ts (epoch) e su una ricerca.'''
+        where, params = ["ts >= ?", "ts < ?"], [since or 0, until or float("inf")]
+        if search is not None:
+            where.append("ricerca = ?")
+            params.append(search)
+        cursor = self.index.execute(f"""
+            SELECT id, giro, ts, url, pagina, ricerca, segmento, offset, lunghezza FROM pagine
+            WHERE {' AND '.join(where)} ORDER BY giro, id
+        """, params)
+        files = {}
+        try:
+            # Le righe di una stessa pagina (una per ricerca) sono di fila: stesso frame, stesso giro
+            for key, rows in itertools.groupby(cursor, key=lambda r: (r[1], r[3], r[4], r[6], r[7])):
+                rows = list(rows)
+                giro, url, page, segment, offset = key
+                if segment not in files:
+                    files[segment] = (open(os.path.join(self.path, segment), "rb"), decompressor(segment))
+                handle, decompress = files[segment]
+                handle.seek(offset)
+                payload = decompress(handle.read(rows[0][8])).decode("utf-8")
+                yield ArchivedPage(giro, rows[0][2], url, page, [r[5] for r in rows], payload)
+        finally:
+            for handle, _ in files.values():
+                handle.close()
+
+    def status(self):
+        ratio = f", {self.raw_bytes / self.written_bytes:.1f}x" if self.written_bytes else ""
+        return (f"🗄️ Archivio {self.path}: {self.stored} pagine salvate ({self.written_bytes / 2**20:.1f} MiB{ratio}), "
+                f"{self.duplicates} identiche non riscritte")
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        self.index.close()
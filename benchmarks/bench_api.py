@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+'''L'API in sola lettura (api.py) sotto carico: --clients dashboard che interrogano a raffica
+searches, listings (con pagine successive), hits e stats, mentre un "demone" scrive una pagina alla volta.
+
+Per ogni configurazione (cache accesa e spenta) riporta richieste/s, latenza p50/p99 dei client e la
+latenza dei commit dello scrittore, da confrontare con quella senza API accesa.
+API e scrittore girano in processi separati, come l'API e il demone veri: niente GIL in comune.
+
+Uso: python3 benchmarks/bench_api.py --searches 20 --history 50000 --clients 16 --seconds 5
+'''
+import argparse
+import asyncio
+import contextlib
+import http.client
+import io
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time as t
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import api
+import db
+import persistence
+from bench_e2e import create_db
+
+
+def fill_news(path, names, rows, seed):
+    '''Feed delle novità: nuovi e qualche ribasso sugli ultimi giorni'''
+    rnd = random.Random(seed)
+    conn = db.open_writer(path, verbose=False)
+    now = int(t.time())
+    with persistence.write_transaction(conn):
+        conn.executemany(persistence.NEWS_SQL, [
+            (now - (rows - i) * 30, rnd.choice(names), f"https://www.subito.it/annunci/{i}.htm", f"Annuncio {i}",
+             rnd.randint(50, 900), rnd.choice([None, None, rnd.randint(60, 1000)]), "Roma", rnd.choice([0, 0, 1]))
+            for i in range(rows)])
+    persistence.record_cycle(conn, now, len(names), 0)
+    conn.close()
+
+
+def writer(path, names, stop, results, cycle_every):
+    '''Una pagina per volta come il demone: touch di 30 annunci in una transazione, ogni tanto la fine di un giro'''
+    latencies = []
+    conn = db.open_writer(path, verbose=False)
+    links = {n: [r[0] for r in conn.execute("SELECT link FROM annunci_ricerche WHERE ricerca = ?", (n,))] for n in names}
+    rnd = random.Random(1)
+    last_cycle = t.monotonic()
+    while not stop.is_set():
+        name = rnd.choice(names)
+        start = t.perf_counter()
+        persistence.touch(conn, name, rnd.sample(links[name], min(30, len(links[name]))))
+        latencies.append(t.perf_counter() - start)
+        if cycle_every and t.monotonic() - last_cycle > cycle_every:
+            persistence.record_cycle(conn, t.time(), len(names), 0)
+            last_cycle = t.monotonic()
+        t.sleep(0.005)
+    conn.close()
+    results.put(latencies)
+
+
+def client(port, names, stop, latencies, errors, seed):
+    '''Un dashboard: un giro su tutti gli endpoint, seguendo il cursore delle listings per qualche pagina'''
+    rnd = random.Random(seed)
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    while not stop.is_set():
+        name = rnd.choice(names)
+        targets = ["/api/searches", "/api/stats", "/api/hits?limit=50", f"/api/hits?search={name}&kind=drop",
+                   f"/api/searches/{name}/listings?limit=50", f"/api/searches/{name}/listings?order=price&limit=20"]
+        for target in targets:
+            start = t.perf_counter()
+            conn.request("GET", target)
+            response = conn.getresponse()
+            body = response.read()
+            latencies.append(t.perf_counter() - start)
+            if response.status != 200:
+                errors.append(target)
+                continue
+            if "listings?limit=50" in target:
+                cursor = json.loads(body)["next"]
+                for _ in range(3):
+                    if cursor is None:
+                        break
+                    start = t.perf_counter()
+                    conn.request("GET", f"/api/searches/{name}/listings?limit=50&after={cursor}")
+                    response = conn.getresponse()
+                    cursor = json.loads(response.read())["next"]
+                    latencies.append(t.perf_counter() - start)
+    conn.close()
+
+
+def serve_process(path, readers, max_age, ports):
+    with contextlib.redirect_stdout(io.StringIO()):
+        asyncio.run(api.serve(path, "127.0.0.1", 0, readers, max_age, ready=lambda server: ports.put(server.sockets[0].getsockname()[1])))
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else float("nan")
+
+
+def run(label, path, names, opts, max_age=None):
+    stop, halt = multiprocessing.Event(), threading.Event()
+    results, ports = multiprocessing.Queue(), multiprocessing.Queue()
+    read_lat, errors, threads = [], [], []
+    server = None
+    if max_age is not None:
+        server = multiprocessing.Process(target=serve_process, args=(path, opts.readers, max_age, ports), daemon=True)
+        server.start()
+        port = ports.get()
+        threads = [threading.Thread(target=client, args=(port, names, halt, read_lat, errors, i)) for i in range(opts.clients)]
+    write = multiprocessing.Process(target=writer, args=(path, names, stop, results, opts.cycle_every))
+    write.start()
+    for th in threads:
+        th.start()
+    t.sleep(opts.seconds)
+    stop.set()
+    halt.set()
+    for th in threads:
+        th.join()
+    write_lat = results.get()
+    write.join()
+    if server is not None:
+        server.terminate()
+        server.join()
+
+    reads = f"{len(read_lat) / opts.seconds:8.0f} rich/s  p50 {percentile(read_lat, 0.5) * 1e3:6.2f} ms  p99 {percentile(read_lat, 0.99) * 1e3:6.2f} ms" \
+        if read_lat else f"{'-':>8}                                     "
+    print(f"{label:22s} {reads}   scrittore: {len(write_lat)} commit, p50 {statistics.median(write_lat) * 1e3:5.2f} ms  "
+          f"p99 {percentile(write_lat, 0.99) * 1e3:6.2f} ms" + (f"  ❌ {len(errors)} errori" if errors else ""))
+    return not errors
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--searches', type=int, default=20)
+    parser.add_argument('--history', type=int, default=50000)
+    parser.add_argument('--news', type=int, default=20000)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--cycle_every', type=float, default=2, help="secondi tra un giro finito e l'altro (svuota la cache)")
+    parser.add_argument('--seed', type=int, default=42)
+    opts = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="subito-api-")
+    path = os.path.join(workdir, "annunci.db")
+    names = [f"bench{i}" for i in range(opts.searches)]
+    create_db(path, names, opts.history, opts.seed)
+    fill_news(path, names, opts.news, opts.seed)
+    print(f"🧪 {opts.searches} ricerche, {opts.history} annunci, {opts.news} novità, {opts.clients} client, "
+          f"{opts.readers} lettori, un giro ogni {opts.cycle_every:g}s, DB in {workdir}")
+
+    ok = run("solo scrittore", path, names, opts)
+    ok = run("API senza cache", path, names, opts, max_age=0) and ok
+    ok = run("API con cache", path, names, opts, max_age=60) and ok
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+'''Archivio delle pagine (--archive) e --replay contro il Subito finto.
+
+1. --cycles giri di refresh con l'archivio acceso: quanto costa archiviare una pagina e quanto occupa
+2. gli stessi payload compressi con gzip e zstd (se c'è zstandard): rapporto, MB/s in scrittura e in lettura
+3. --replay dell'archivio su un DB nuovo con lo stesso storico: pagine/s senza rete, e se annunci,
+   annunci_ricerche e novita escono uguali a quelli del giro dal vivo
+
+Uso: python3 benchmarks/bench_archive.py --searches 10 --listings 150 --cycles 5 --codec gzip
+'''
+import argparse
+import contextlib
+import gzip
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+import time as t
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import archive
+from bench_e2e import create_db, load_searcher
+from fake_subito import FakeMarket, FakeSubito
+
+
+def setup(workdir, names, opts, argv, server=None):
+    '''Un searcher con il suo DB (stesso storico per tutti) in workdir'''
+    os.chdir(workdir)
+    create_db("annunci.db", names, opts.history, opts.seed)
+    searcher = load_searcher(["--delay", "0", "--rate", "1000", "--max_rate", "1000"] + argv)
+    with contextlib.redirect_stdout(io.StringIO()):
+        searcher.connect_database()
+        base = server.base_url if server else "http://127.0.0.1:9"
+        searcher.conn.executemany("UPDATE ricerche SET url = ? WHERE nome = ?", [(f"{base}/s/{n}/?q={n}", n) for n in names])
+        searcher.conn.commit()
+        searcher.load_link_index()
+        searcher.load_market_stats()
+    return searcher
+
+
+def live(names, opts, archive_dir):
+    server = FakeSubito(FakeMarket(names, opts.listings, opts.seed), seed=opts.seed).start()
+    searcher = setup(tempfile.mkdtemp(prefix="subito-live-"), names, opts,
+                     ["--archive", archive_dir, "--archive_codec", opts.codec], server)
+    with contextlib.redirect_stdout(io.StringIO()):
+        searcher.open_archive()
+    spent = []
+    append = searcher.archive.append
+
+    def timed_append(*a, **kw):
+        start = t.perf_counter()
+        written = append(*a, **kw)
+        spent.append(t.perf_counter() - start)
+        return written
+    searcher.archive.append = timed_append
+
+    start = t.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(opts.cycles):
+            searcher.refresh(False)
+    elapsed = t.perf_counter() - start
+    pages = server.counters["pages"]
+    print(f"dal vivo          {elapsed:7.2f}s  {pages:5d} pagine ({pages / elapsed:6.0f}/s)  "
+          f"archivio {sum(spent) / len(spent) * 1e3:.2f} ms/pagina ({sum(spent) / elapsed:.1%} del tempo)")
+    print("                  " + searcher.archive.status())
+    searcher.archive.close()
+    return searcher
+
+
+def codecs(archive_dir):
+    payloads = [p.payload.encode("utf-8") for p in archive.Archive(archive_dir).pages()]
+    raw = sum(len(p) for p in payloads)
+    available = ["gzip"]
+    try:
+        archive._zstd()
+        available.append("zstd")
+    except ImportError:
+        print("zstd: pacchetto zstandard non installato, salto")
+    for codec in available:
+        compress = archive.compressor(codec)
+        start = t.perf_counter()
+        frames = [compress(p) for p in payloads]
+        packed = t.perf_counter() - start
+        decompress = gzip.decompress if codec == "gzip" else archive._zstd().ZstdDecompressor().decompress
+        start = t.perf_counter()
+        for f in frames:
+            decompress(f)
+        unpacked = t.perf_counter() - start
+        size = sum(len(f) for f in frames)
+        print(f"{codec:5s} {len(payloads)} payload, {raw / 2**20:6.1f} MiB -> {size / 2**20:5.2f} MiB ({raw / size:4.1f}x)  "
+              f"scrittura {raw / packed / 2**20:6.0f} MB/s  lettura {raw / unpacked / 2**20:6.0f} MB/s")
+
+
+def snapshot(conn):
+    return (set(conn.execute("SELECT link, titolo, prezzo, localita FROM annunci")),
+            set(conn.execute("SELECT ricerca, link, prezzo FROM annunci_ricerche")),
+            sorted(conn.execute("SELECT ricerca, link, prezzo, prezzo_vecchio, tipo FROM novita")))
+
+
+def replay(names, opts, archive_dir, original):
+    searcher = setup(tempfile.mkdtemp(prefix="subito-replay-"), names, opts, [])
+    start = t.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        pages = searcher.replay(archive_dir)
+    elapsed = t.perf_counter() - start
+    print(f"replay            {elapsed:7.2f}s  {pages:5d} pagine ({pages / elapsed:6.0f}/s)")
+    plain = lambda c: sqlite3.connect(c.execute("PRAGMA database_list").fetchone()[2])
+    a, b = snapshot(plain(original.conn)), snapshot(plain(searcher.conn))
+    labels = ("annunci", "annunci_ricerche", "novita")
+    diff = [f"{label} ({len(x)} vs {len(y)} righe)" for label, x, y in zip(labels, a, b) if x != y]
+    print("❌ diversi: " + ", ".join(diff) if diff else
+          f"✅ stesso DB del giro dal vivo: {len(a[0])} annunci, {len(a[1])} abbinamenti, {len(a[2])} novità")
+    return not diff
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--searches', type=int, default=10)
+    parser.add_argument('--listings', type=int, default=150)
+    parser.add_argument('--history', type=int, default=10000)
+    parser.add_argument('--cycles', type=int, default=5)
+    parser.add_argument('--codec', choices=archive.CODECS, default="gzip")
+    parser.add_argument('--seed', type=int, default=42)
+    opts = parser.parse_args()
+
+    names = [f"bench{i}" for i in range(opts.searches)]
+    archive_dir = tempfile.mkdtemp(prefix="subito-archive-")
+    print(f"🧪 {opts.searches} ricerche x {opts.listings} annunci, {opts.cycles} giri, archivio {opts.codec} in {archive_dir}")
+    original = live(names, opts, archive_dir)
+    codecs(archive_dir)
+    sys.exit(0 if replay(names, opts, archive_dir, original) else 1)
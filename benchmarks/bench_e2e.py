@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+'''Benchmark end-to-end contro il Subito finto: run_query, refresh e il loop del demone.
+
+Riporta annunci/s, latenza per giro, righe scritte nel DB e picco di RSS.
+
+Uso: python3 benchmarks/bench_e2e.py --searches 20 --history 50000 --cycles 3 [--concurrent]
+'''
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import random
+import resource
+import sqlite3
+import sys
+import tempfile
+import time as t
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from fake_subito import FakeMarket, FakeSubito
+import migrations
+import notifier
+
+
+def create_db(path, names, history, seed):
+    '''DB nuovo con le ricerche e history annunci "vecchi" sparsi sugli ultimi 30 giorni'''
+    conn = sqlite3.connect(path)
+    migrations.migrate(conn, verbose=False)
+    rnd = random.Random(seed)
+    conn.executemany("INSERT INTO ricerche (nome, url) VALUES (?, ?)", [(n, "http://placeholder/") for n in names])
+    conn.executemany("""
+        INSERT INTO annunci (link, titolo, prezzo, categoria, localita, data_scoperta, ultimo_aggiornamento)
+        VALUES (?, ?, ?, ?, 'Roma', datetime('now', ?), datetime('now', ?))
+    """, [(f"https://www.subito.it/storico/{i}.htm", f"Storico {i}", rnd.randint(50, 900), rnd.choice(names),
+           f"-{rnd.randint(0, 40)} days", f"-{rnd.randint(0, 29)} days") for i in range(history)])
+    conn.execute("""
+        INSERT INTO annunci_ricerche (ricerca, link, prezzo, ultimo_aggiornamento)
+        SELECT categoria, link, prezzo, ultimo_aggiornamento FROM annunci
+    """)
+    conn.commit()
+    conn.close()
+
+
+def load_searcher(argv):
+    '''Importa subito-searcher.py come modulo (il blocco __main__ non parte)'''
+    sys.argv = ["subito-searcher.py"] + argv
+    spec = importlib.util.spec_from_file_location("subito_searcher", os.path.join(ROOT, "subito-searcher.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def peak_rss_mib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(label, searcher, server, fn, quiet):
+    pages, listings = server.counters["pages"], server.counters["listings"]
+    writes = searcher.conn.total_changes
+    start = t.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+        fn()
+    elapsed = t.perf_counter() - start
+    listings = server.counters["listings"] - listings
+    print(f"{label:<22} {elapsed:8.3f}s  {server.counters['pages'] - pages:5d} pag  "
+          f"{listings:7d} annunci  {listings / elapsed:9.0f} annunci/s  "
+          f"{searcher.conn.total_changes - writes:7d} righe DB  RSS {peak_rss_mib():7.1f} MiB")
+    return elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--searches', type=int, default=10)
+    parser.add_argument('--listings', type=int, default=150, help="annunci per ricerca sul server finto")
+    parser.add_argument('--history', type=int, default=10000, help="annunci già presenti nel DB")
+    parser.add_argument('--cycles', type=int, default=3)
+    parser.add_argument('--concurrent', action='store_true')
+    parser.add_argument('--twins', type=int, default=0, help="ricerche in più con lo stesso URL di una esistente e un tetto di prezzo")
+    parser.add_argument('--fail_rate', type=float, default=0.0, help="frazione di pagine risposte con 429")
+    parser.add_argument('--verbose', action='store_true', help="mostra l'output del bot")
+    parser.add_argument('--seed', type=int, default=42)
+    opts = parser.parse_args()
+
+    names = [f"bench{i}" for i in range(opts.searches)]
+    server = FakeSubito(FakeMarket(names, opts.listings, opts.seed), fail_rate=opts.fail_rate, seed=opts.seed).start()
+    notifier.TELEGRAM_API = server.base_url
+
+    workdir = tempfile.mkdtemp(prefix="subito-bench-")
+    os.chdir(workdir)
+    create_db("annunci.db", names, opts.history, opts.seed)
+    with open("telegram_api_credentials", "w") as f:
+        json.dump({"token": "bench", "chatid": ["@bench_a", "@bench_b"]}, f)
+    with open("ntfy_config", "w") as f:
+        json.dump({"ntfy_server": server.base_url, "ntfy_topic": "bench"}, f)
+
+    argv = ["--delay", "0", "--rate", "1000", "--max_rate", "1000"] + (["--concurrent", "--concurrency", "16", "--per_host", "16"] if opts.concurrent else [])
+    searcher = load_searcher(argv)
+    searcher.args.activeHour = searcher.args.pauseHour = "0"
+
+    quiet = not opts.verbose
+    with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+        searcher.load_api_credentials()
+        searcher.load_ntfy_config()
+        searcher.connect_database()
+        searcher.conn.executemany("UPDATE ricerche SET url = ? WHERE nome = ?",
+                                  [(f"{server.base_url}/s/{n}/?q={n}", n) for n in names])
+        # Gemelle: stesso URL, filtro prezzo diverso. Le pagine devono arrivare una volta sola.
+        searcher.conn.executemany("INSERT INTO ricerche (nome, url, prezzo_max) VALUES (?, ?, 400)",
+                                  [(f"{n}_budget", f"{server.base_url}/s/{n}/?q={n}") for n in names[:opts.twins]])
+        searcher.conn.commit()
+        searcher.load_link_index()
+        searcher.load_market_stats()
+
+    print(f"🧪 {opts.searches} ricerche (+{opts.twins} gemelle) x {opts.listings} annunci, storico {opts.history}, DB in {workdir}")
+    first = searcher.active_searches()[0]
+    measure("run_query (1 ricerca)", searcher, server,
+            lambda: searcher.run_query(first['url'], first['nome'], True, None, None), quiet)
+
+    if opts.concurrent:
+        import asyncio
+        one_cycle = lambda: asyncio.run(searcher.refresh_async(True))
+    else:
+        one_cycle = lambda: searcher.refresh(True)
+    latencies = [measure(f"refresh giro {c + 1}", searcher, server, one_cycle, quiet) for c in range(opts.cycles)]
+    measure(f"demone ({opts.cycles} giri)", searcher, server, lambda: searcher.daemon(cycles=opts.cycles), quiet)
+
+    latencies.sort()
+    print(f"latenza per giro: min {latencies[0]:.3f}s  mediana {latencies[len(latencies) // 2]:.3f}s  max {latencies[-1]:.3f}s")
+    if searcher.notifier is not None:
+        searcher.notifier.drain(timeout=30)
+    c = server.counters
+    print(f"server: {c['pages']} pagine ({c['throttled']} con 429), {c['telegram']} messaggi Telegram, {c['ntfy']} ntfy")
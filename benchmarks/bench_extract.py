@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+'''Tempo di parsing per pagina: BeautifulSoup su tutto l'HTML vs scansione diretta di __NEXT_DATA__.
+
+Uso: python3 benchmarks/bench_extract.py [--rounds 200] [pagina.html ...]
+'''
+import argparse
+import glob
+import os
+import sys
+import time as t
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import next_data
+
+
+def per_page(fn, body, rounds):
+    start = t.perf_counter()
+    for _ in range(rounds):
+        fn(body)
+    return (t.perf_counter() - start) / rounds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('pages', nargs='*')
+    parser.add_argument('--rounds', type=int, default=200)
+    opts = parser.parse_args()
+
+    pages = opts.pages or sorted(glob.glob(os.path.join(ROOT, "benchmarks", "samples", "*.html")))
+    try:
+        import bs4  # noqa: F401
+        have_soup = True
+    except ImportError:
+        have_soup = False
+        print("⚠️ bs4 non installato: misuro solo il percorso veloce")
+
+    for path in pages:
+        with open(path, 'rb') as f:
+            body = f.read()
+        fast_items = next_data.extract_items(body)
+        fast = per_page(next_data.extract_items, body, opts.rounds)
+        line = f"{os.path.basename(path):<28} {len(body) / 1024:7.1f} KiB  fast {fast * 1e3:8.3f} ms"
+        if have_soup:
+            soup_items = next_data.items_with_soup(body)
+            assert soup_items == fast_items, f"{path}: i due percorsi non danno la stessa lista"
+            soup = per_page(next_data.items_with_soup, body, max(1, opts.rounds // 10))
+            line += f"  soup {soup * 1e3:8.3f} ms  ({soup / fast:5.1f}x)"
+        n = "-" if fast_items is None else len(fast_items)
+        print(f"{line}  annunci: {n}")
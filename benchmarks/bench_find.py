@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+'''Ricerca nello storico e --list su un DB grande.
+
+- --find: LIKE '%parola%' su titolo e località (scansione di tutta la tabella) contro l'indice FTS5 annunci_fts
+- --list: la vecchia versione (una SELECT per ricerca, fetchall) contro la query unica letta dal cursore,
+  tempo e picco di memoria Python (tracemalloc), con l'output buttato
+- quanto costano i trigger FTS sugli inserimenti degli annunci nuovi
+
+Uso: python3 benchmarks/bench_find.py --searches 20 --history 200000 --queries 50 --limit 50
+'''
+import argparse
+import contextlib
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time as t
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from bench_e2e import create_db, load_searcher
+from synthetic import TOWNS, WORDS
+
+
+def realistic_titles(conn, seed):
+    '''create_db mette titoli "Storico N": qui diventano frasi vere, con in più un "modello" raro (tipo "sm5123")
+    come nei titoli veri, così l'indice ha parole comuni e parole rare da cercare'''
+    rnd = random.Random(seed)
+    ids = [r[0] for r in conn.execute("SELECT id FROM annunci")]
+    conn.executemany("UPDATE annunci SET titolo = ?, localita = ? WHERE id = ?",
+                     [(" ".join(rnd.choice(WORDS) for _ in range(5)).capitalize() + f" {model(rnd)}", rnd.choice(TOWNS), i)
+                      for i in ids])
+    conn.commit()
+
+
+def model(rnd):
+    return f"sm{rnd.randint(0, 9999)}"
+
+
+def old_list(conn):
+    '''print_queries prima: le ricerche, poi per ognuna tutti i suoi annunci in memoria'''
+    for nome, url in conn.execute("SELECT nome, url FROM ricerche").fetchall():
+        print(f"\nsearch: {nome}")
+        print(f"query url: {url}")
+        rows = conn.execute("""
+            SELECT a.titolo, m.prezzo, a.localita, a.link FROM annunci a
+            JOIN annunci_ricerche m ON m.link = a.link WHERE m.ricerca = ?
+        """, (nome,)).fetchall()
+        for titolo, prezzo, localita, link in rows:
+            print(f"\n {titolo} : {prezzo} --> {localita}")
+            print(f"  {link}")
+
+
+def measure(fn):
+    '''(secondi, picco tracemalloc in MiB) con l'output su /dev/null'''
+    tracemalloc.start()
+    start = t.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        fn()
+    elapsed = t.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def bench_text(label, conn, queries, limit):
+    '''Come --find "parola parola" --limit N: tutte le parole, in titolo o località'''
+    like = fts = 0.0
+    like_hits = fts_hits = 0
+    for words in queries:
+        where = " AND ".join("(titolo LIKE ? OR localita LIKE ?)" for _ in words)
+        params = [f"%{w}%" for w in words for _ in range(2)]
+        start = t.perf_counter()
+        like_hits += len(conn.execute(f"SELECT id FROM annunci WHERE {where} ORDER BY id DESC LIMIT ?", params + [limit]).fetchall())
+        like += t.perf_counter() - start
+        start = t.perf_counter()
+        fts_hits += len(conn.execute("SELECT rowid FROM annunci_fts WHERE annunci_fts MATCH ? ORDER BY rank LIMIT ?",
+                                     (" ".join(f'"{w}"' for w in words), limit)).fetchall())
+        fts += t.perf_counter() - start
+    n = len(queries)
+    print(f"{label:14s} LIKE '%parola%' {like / n * 1e3:8.2f} ms/query  ({like_hits} righe)")
+    print(f"{label:14s} FTS5 MATCH     {fts / n * 1e3:8.2f} ms/query  ({fts_hits} righe, solo parole intere)")
+
+
+def bench_inserts(path, rows, seed):
+    '''Inserimenti come quelli di persistence.flush, con e senza i trigger FTS'''
+    rnd = random.Random(seed)
+    batch = [(f"https://www.subito.it/nuovo/{seed}-{i}.htm", " ".join(rnd.choice(WORDS) for _ in range(5)),
+              rnd.randint(50, 900), "bench0", rnd.choice(TOWNS)) for i in range(rows)]
+    for label, drop in (("insert con i trigger FTS", False), ("insert senza trigger", True)):
+        conn = sqlite3.connect(path)
+        if drop:
+            conn.execute("BEGIN")
+            for name in ("trg_fts_insert", "trg_fts_delete", "trg_fts_update"):
+                conn.execute(f"DROP TRIGGER {name}")
+        start = t.perf_counter()
+        conn.executemany("INSERT INTO annunci (link, titolo, prezzo, categoria, localita) VALUES (?, ?, ?, ?, ?)", batch)
+        elapsed = t.perf_counter() - start
+        conn.rollback()
+        conn.close()
+        print(f"{label:26s} {elapsed / rows * 1e6:8.1f} µs/annuncio")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--searches', type=int, default=20)
+    parser.add_argument('--history', type=int, default=200000)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--inserts', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=42)
+    opts = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="subito-find-")
+    path = os.path.join(workdir, "annunci.db")
+    names = [f"bench{i}" for i in range(opts.searches)]
+    create_db(path, names, opts.history, opts.seed)
+    conn = sqlite3.connect(path)
+    realistic_titles(conn, opts.seed)
+    print(f"🧪 {opts.searches} ricerche, {opts.history} annunci, DB in {workdir}")
+
+    rnd = random.Random(opts.seed)
+    vocabulary = WORDS + [town.lower() for town in TOWNS]
+    bench_text("parole comuni", conn, [rnd.sample(vocabulary, 2) for _ in range(opts.queries)], opts.limit)
+    bench_text("modello", conn, [[model(rnd)] for _ in range(opts.queries)], opts.limit)
+    bench_text("modello+città", conn, [[model(rnd), rnd.choice(TOWNS).lower()] for _ in range(opts.queries)], opts.limit)
+
+    searcher = load_searcher(["--list"])
+    searcher.conn = searcher.db.open_reader(path)
+    for label, fn in (("--list prima (fetchall)", lambda: old_list(conn)), ("--list in streaming", searcher.print_queries)):
+        elapsed, peak = measure(fn)
+        print(f"{label:26s} {elapsed:8.2f} s  picco {peak:7.1f} MiB")
+    conn.close()
+
+    bench_inserts(path, opts.inserts, opts.seed)
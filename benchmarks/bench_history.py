@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+'''Analisi dello storico prezzi: price_history (NumPy, tutte le ricerche in un passaggio) contro
+le query SQL una categoria alla volta, su uno storico sintetico di --rows righe.
+
+Riporta il tempo di caricamento (completo e solo la coda), di analyze, dell'export .npz e delle query
+per categoria (con un indice su (ricerca, ts), che lo storico vero non ha), e controlla che
+annunci, venduti e tempi di vendita coincidano.
+
+Uso: python3 benchmarks/bench_history.py --rows 1000000 --searches 50
+'''
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time as t
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import db
+import persistence
+from link_index import text_key
+from persistence import EVENT_DROP, EVENT_NEW, EVENT_SOLD
+from price_history import DAY, PriceHistory
+
+WINDOW_DAYS = 21
+
+
+def synthetic_history(names, rows, now, seed):
+    '''Annunci che compaiono negli ultimi 60 giorni, qualche ribasso, una parte venduta'''
+    rnd = random.Random(seed)
+    out = []
+    i = 0
+    while len(out) < rows:
+        name = names[i % len(names)]
+        key, listing = text_key(name), text_key(f"https://www.subito.it/storico/{i}.htm")
+        ts = now - rnd.randint(0, 60 * DAY)
+        price = rnd.randint(50, 900) * 100
+        out.append((key, listing, ts, price, EVENT_NEW))
+        while rnd.random() < 0.3 and ts < now - DAY:
+            ts += rnd.randint(3600, 5 * DAY)
+            price = int(price * rnd.uniform(0.8, 0.97))
+            out.append((key, listing, min(ts, now), price, EVENT_DROP))
+        if rnd.random() < 0.25:
+            out.append((key, listing, min(ts + rnd.randint(3600, 20 * DAY), now), price, EVENT_SOLD))
+        i += 1
+    return out[:rows]
+
+
+def sql_report(conn, names, now):
+    '''Come si farebbe senza NumPy: qualche query per ogni categoria'''
+    since = now - WINDOW_DAYS * DAY
+    report = {}
+    for name in names:
+        key = text_key(name)
+        listings = conn.execute("""
+            SELECT COUNT(DISTINCT annuncio) FROM storico_prezzi WHERE ricerca = ? AND ts >= ? AND evento != ?
+        """, (key, since, EVENT_SOLD)).fetchone()[0]
+        asking = [r[0] / 100 for r in conn.execute("""
+            SELECT prezzo FROM storico_prezzi WHERE ricerca = ? AND ts > ? AND ts <= ? AND evento != ?
+        """, (key, now - 7 * DAY, now, EVENT_SOLD))]
+        days = [r[0] / DAY for r in conn.execute("""
+            SELECT MAX(CASE WHEN evento = ? THEN ts END) - MIN(ts) FROM storico_prezzi WHERE ricerca = ?
+            GROUP BY annuncio
+            HAVING MAX(CASE WHEN evento = ? THEN ts END) >= ?
+                AND MIN(ts) < MAX(CASE WHEN evento = ? THEN ts END)
+        """, (EVENT_SOLD, key, EVENT_SOLD, since, EVENT_SOLD))]
+        report[name] = {
+            "listings": listings,
+            "median_7d": statistics.median(asking) if asking else None,
+            "sold": len(days),
+            "median_days_to_sell": statistics.median(days) if days else None,
+        }
+    return report
+
+
+def timed(fn):
+    start = t.perf_counter()
+    result = fn()
+    return result, t.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--searches', type=int, default=50)
+    parser.add_argument('--tail', type=int, default=10000, help="righe aggiunte prima del caricamento incrementale")
+    parser.add_argument('--seed', type=int, default=42)
+    opts = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="subito-history-")
+    path = os.path.join(workdir, "annunci.db")
+    conn = db.open_writer(path, verbose=False)
+    names = [f"bench{i}" for i in range(opts.searches)]
+    conn.executemany("INSERT INTO ricerche (nome, url) VALUES (?, 'http://placeholder/')", [(n,) for n in names])
+    conn.commit()
+    now = int(t.time())
+    rows = synthetic_history(names, opts.rows + opts.tail, now, opts.seed)
+    with persistence.write_transaction(conn):
+        conn.executemany(persistence.HISTORY_SQL, rows[:opts.rows])
+
+    print(f"🧪 storico di {opts.rows} righe, {opts.searches} ricerche, DB in {workdir}")
+    history = PriceHistory(conn)
+    loaded, elapsed = timed(history.refresh)
+    print(f"caricamento completo      {elapsed * 1000:9.1f} ms  ({loaded} righe, {history.rows.nbytes / 2**20:.1f} MiB in memoria)")
+    with persistence.write_transaction(conn):
+        conn.executemany(persistence.HISTORY_SQL, rows[opts.rows:])
+    loaded, elapsed = timed(history.refresh)
+    print(f"caricamento della coda    {elapsed * 1000:9.1f} ms  ({loaded} righe)")
+
+    report, elapsed = timed(lambda: history.analyze(now=now, window_days=WINDOW_DAYS))
+    print(f"analyze (tutte insieme)   {elapsed * 1000:9.1f} ms  mediane mobili 30 giorni, ribassi, tempi di vendita")
+    npz = os.path.join(workdir, "storico.npz")
+    _, elapsed = timed(lambda: history.export(npz))
+    print(f"export .npz               {elapsed * 1000:9.1f} ms  ({os.path.getsize(npz) / 2**20:.1f} MiB, "
+          f"DB {os.path.getsize(path) / 2**20:.1f} MiB)")
+
+    conn.execute("CREATE INDEX idx_bench_storico ON storico_prezzi (ricerca, ts)")
+    expected, elapsed = timed(lambda: sql_report(conn, names, now))
+    print(f"SQL per categoria         {elapsed * 1000:9.1f} ms  (solo la mediana di oggi, niente serie né ribassi)")
+
+    mismatches = 0
+    for name in names:
+        fast, slow = report.get(name), expected[name]
+        ok = fast is not None and fast["listings"] == slow["listings"] and fast["sold"] == slow["sold"]
+        ok = ok and (slow["median_7d"] is None or abs(fast["rolling_median"][-1] - slow["median_7d"]) < 1e-6)
+        ok = ok and (slow["median_days_to_sell"] is None or abs(fast["median_days_to_sell"] - slow["median_days_to_sell"]) < 1e-6)
+        if not ok:
+            mismatches += 1
+            print(f"❌ {name}: NumPy {fast and {k: fast[k] for k in slow if k in fast}} | SQL {slow}")
+    print("✅ NumPy e SQL danno gli stessi numeri" if mismatches == 0 else f"❌ {mismatches} ricerche diverse")
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+'''Confronto annunci/secondo: vecchio percorso riga-per-riga vs pagina in una transazione.
+
+Uso: python3 benchmarks/bench_persistence.py --listings 3000 --page 30
+'''
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time as t
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import migrations
+import persistence
+
+
+def fresh_db(path):
+    conn = sqlite3.connect(path)
+    migrations.migrate(conn, verbose=False)
+    conn.execute("INSERT INTO ricerche (nome, url) VALUES ('bench', 'http://localhost/')")
+    conn.commit()
+    return conn
+
+
+def synthetic_pages(n_listings, page_size, seed):
+    '''Due giri sugli stessi annunci: il secondo con qualche ribasso e qualche venduto'''
+    rnd = random.Random(seed)
+    listings = [(f"https://www.subito.it/x/{i}.htm", f"Annuncio {i}", rnd.randint(10, 900), "Roma") for i in range(n_listings)]
+    first = [listings[i:i + page_size] for i in range(0, n_listings, page_size)]
+
+    second = []
+    for page in first:
+        changed = []
+        for link, title, price, loc in page:
+            roll = rnd.random()
+            if roll < 0.05:
+                changed.append((link, title, price, loc, True))
+            elif roll < 0.15:
+                changed.append((link, title, max(1, price - rnd.randint(1, 50)), loc, False))
+            else:
+                changed.append((link, title, price, loc, False))
+        second.append(changed)
+    return [[(l, ti, p, lo, False) for l, ti, p, lo in page] for page in first], second
+
+
+def per_row(conn, pages):
+    '''Il vecchio run_query: SELECT + scrittura + commit per ogni annuncio'''
+    cur = conn.cursor()
+    for page in pages:
+        for link, title, price, loc, sold in page:
+            if sold:
+                cur.execute("DELETE FROM annunci WHERE link = ?", (link,))
+                conn.commit()
+                continue
+            cur.execute("SELECT prezzo FROM annunci WHERE link = ?", (link,))
+            row = cur.fetchone()
+            if row is None:
+                cur.execute("""
+                    INSERT INTO annunci (link, titolo, prezzo, categoria, localita, data_scoperta, ultimo_aggiornamento)
+                    VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                """, (link, title, price, "bench", loc))
+                conn.commit()
+            else:
+                if price < row[0]:
+                    cur.execute("UPDATE annunci SET prezzo = ?, ultimo_aggiornamento = CURRENT_TIMESTAMP WHERE link = ?", (price, link))
+                else:
+                    cur.execute("UPDATE annunci SET ultimo_aggiornamento = CURRENT_TIMESTAMP WHERE link = ?", (link,))
+                conn.commit()
+
+
+def batched(conn, pages):
+    '''Il nuovo percorso: una query di lettura e una transazione per pagina'''
+    for page in pages:
+        batch = persistence.PageBatch("bench")
+        alive = []
+        for link, title, price, loc, sold in page:
+            if sold:
+                batch.sell(link)
+            else:
+                alive.append((link, title, price, loc))
+        prices = persistence.known_prices(conn, "bench", [a[0] for a in alive])
+        for link, title, price, loc in alive:
+            old = prices.get(link)
+            if old is None:
+                batch.insert(link, title, price, "bench", loc)
+            elif price < old:
+                batch.drop(link, title, price, "bench", loc, old)
+            else:
+                batch.touch(link)
+        persistence.flush(conn, batch)
+
+
+def run(label, fn, pages_a, pages_b):
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = fresh_db(os.path.join(tmp, "bench.db"))
+        n = sum(len(p) for p in pages_a) + sum(len(p) for p in pages_b)
+        start = t.perf_counter()
+        fn(conn, pages_a)
+        fn(conn, pages_b)
+        elapsed = t.perf_counter() - start
+        conn.close()
+    print(f"{label:<10} {n:>7} annunci in {elapsed:7.3f}s -> {n / elapsed:10.0f} annunci/s")
+    return n / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--listings', type=int, default=3000)
+    parser.add_argument('--page', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=42)
+    opts = parser.parse_args()
+
+    pages_a, pages_b = synthetic_pages(opts.listings, opts.page, opts.seed)
+    slow = run("per-row", per_row, pages_a, pages_b)
+    fast = run("batched", batched, pages_a, pages_b)
+    print(f"speedup: {fast / slow:.1f}x")
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+'''Indice delle ripubblicazioni (reposts.py): quanto ci azzecca e quanto costa al crescere dell'indice.
+
+Per ogni N di --sizes: N annunci finti in indice (titoli da synthetic.WORDS più un codice modello, una città),
+poi --queries ripubblicazioni ritoccate come fanno i venditori (prezzo giù, "vendo"/"ribasso" in più,
+parole in un altro ordine, un errore di battitura) e altrettanti annunci che NON devono agganciarsi
+(titoli nuovi, e lo stesso titolo con un altro modello). Riporta precisione e richiamo di reposts.find,
+e i ms per annuncio dell'LSH contro il confronto con tutte le firme (lettura + NumPy), che cresce con N.
+
+Uso: python3 benchmarks/bench_reposts.py --sizes 10000 50000 200000 --queries 300
+'''
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time as t
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import migrations
+import reposts
+from synthetic import TOWNS, WORDS
+
+NOW = 1_800_000_000
+
+
+def title(rnd):
+    return " ".join(rnd.choice(WORDS) for _ in range(5)).capitalize() + f" sm{rnd.randint(0, 99999)}"
+
+
+def typo(word, rnd):
+    i = rnd.randrange(len(word))
+    return word[:i] + rnd.choice("aeiou") + word[i + 1:]
+
+
+def mutate(listing, rnd):
+    '''La stessa cosa rimessa in vendita: qualche ritocco a caso sul titolo, prezzo uguale o un po' più basso'''
+    link, name, price, town = listing
+    words = name.split()
+    if rnd.random() < 0.5:
+        rnd.shuffle(words)
+    if rnd.random() < 0.5:
+        words.insert(rnd.randrange(len(words) + 1), rnd.choice(["vendo", "ribasso", "affare", "URGENTE"]))
+    if rnd.random() < 0.3:
+        plain = [i for i, w in enumerate(words) if w.isalpha() and len(w) > 4]
+        if plain:
+            i = rnd.choice(plain)
+            words[i] = typo(words[i], rnd)
+    return f"{link}-ripubblicato", " ".join(words), round(price * rnd.uniform(0.8, 1.0)), town
+
+
+def decoys(listing, rnd):
+    '''Annunci che non sono ripubblicazioni: un titolo qualunque, e lo stesso titolo per un altro modello'''
+    link, name, price, town = listing
+    other = name.rsplit(" ", 1)[0] + f" sm{rnd.randint(100000, 199999)}"
+    return [(f"{link}-altro", title(rnd), price, town), (f"{link}-modello", other, price, town)]
+
+
+def build(n, rnd):
+    path = os.path.join(tempfile.mkdtemp(prefix="subito-reposts-"), "annunci.db")
+    conn = sqlite3.connect(path, isolation_level=None)
+    migrations.migrate(conn, verbose=False)
+    listings = [(f"https://www.subito.it/annunci/{i}.htm", title(rnd), rnd.randint(50, 900), rnd.choice(TOWNS)) for i in range(n)]
+    start = t.perf_counter()
+    conn.execute("BEGIN")
+    for i in range(0, n, 5000):
+        reposts.add(conn, listings[i:i + 5000], NOW - 86400)
+    conn.execute("COMMIT")
+    return conn, listings, t.perf_counter() - start
+
+
+def brute_force(conn, listing):
+    '''Senza indice: tutte le firme dal DB, somiglianza con NumPy, stessi filtri di reposts.find'''
+    link, name, price, town = listing
+    found = reposts.features(name, town)
+    if found is None:
+        return None
+    firma, numbers, _keys = found
+    rows = conn.execute("SELECT link, prezzo, numeri, firma FROM firme").fetchall()
+    firme = np.frombuffer(b"".join(r[3] for r in rows), dtype=np.uint32).reshape(len(rows), reposts.NUM_HASHES)
+    sims = (firme == firma).mean(axis=1)
+    best = None
+    for i in np.flatnonzero(sims >= reposts.SIMILARITY):
+        other, other_price, other_numbers, _ = rows[i]
+        if other_numbers == numbers and reposts.same_price_band(price, other_price):
+            if best is None or sims[i] > best[1]:
+                best = (other, sims[i])
+    return best and best[0]
+
+
+def run(n, opts):
+    rnd = random.Random(opts.seed)
+    conn, listings, built = build(n, rnd)
+    originals = rnd.sample(listings, opts.queries)
+    copies = [mutate(l, rnd) for l in originals]
+    wrong = [d for l in originals for d in decoys(l, rnd)]
+    print(f"N={n:7d}  indice in {built:5.1f}s ({built / n * 1e6:4.0f} µs/annuncio)")
+
+    hits = misses = false = 0
+    lsh = []
+    for original, copy in zip(originals, copies):
+        start = t.perf_counter()
+        found, _ = reposts.find(conn, [copy])
+        lsh.append(t.perf_counter() - start)
+        match = found.get(copy[0])
+        if match is None:
+            misses += 1
+        elif match.original == original[0]:
+            hits += 1
+        else:
+            false += 1
+    for decoy in wrong:
+        start = t.perf_counter()
+        found, _ = reposts.find(conn, [decoy])
+        lsh.append(t.perf_counter() - start)
+        false += decoy[0] in found
+    precision = hits / (hits + false) if hits + false else 1.0
+    print(f"          LSH      {np.mean(lsh) * 1e3:7.3f} ms/annuncio  richiamo {hits / len(copies):6.1%}  "
+          f"precisione {precision:6.1%}  ({hits} trovate, {misses} perse, {false} sbagliate su {len(wrong)} esche)")
+
+    sample = copies[:opts.brute]
+    brute_hits = 0
+    start = t.perf_counter()
+    for original, copy in zip(originals, sample):
+        brute_hits += brute_force(conn, copy) == original[0]
+    brute = (t.perf_counter() - start) / len(sample)
+    print(f"          tutte    {brute * 1e3:7.3f} ms/annuncio  richiamo {brute_hits / len(sample):6.1%}  "
+          f"(su {len(sample)}, {brute / np.mean(lsh):.0f}x l'LSH)")
+    conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000, 200000])
+    parser.add_argument('--queries', type=int, default=300)
+    parser.add_argument('--brute', type=int, default=20, help="ripubblicazioni cercate anche a forza bruta")
+    parser.add_argument('--seed', type=int, default=42)
+    opts = parser.parse_args()
+
+    print(f"🧪 {opts.queries} ripubblicazioni e {2 * opts.queries} esche per dimensione, soglia {reposts.SIMILARITY}, "
+          f"{reposts.BANDS} bande x {reposts.ROWS}")
+    for n in opts.sizes:
+        run(n, opts)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+'''Schema v1 (trigger + nessun indice sul tempo) contro l'ultima versione delle migrazioni.
+
+Misura i "touch" di run_query (una transazione per pagina), la query del cleanup
+e quella di get_market_int, sullo stesso DB prima e dopo migrations.migrate().
+
+Uso: python3 benchmarks/bench_schema.py --history 200000 --categories 40
+'''
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time as t
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import migrations
+
+PAGE = 30
+
+
+def build_v1(path, history, categories, seed):
+    conn = sqlite3.connect(path)
+    with open(os.path.join(ROOT, "schema.sql")) as f:
+        conn.executescript(f.read())
+    rnd = random.Random(seed)
+    names = [f"cat{i}" for i in range(categories)]
+    conn.executemany("INSERT INTO ricerche (nome, url) VALUES (?, 'http://x/')", [(n,) for n in names])
+    conn.executemany("""
+        INSERT INTO annunci (link, titolo, prezzo, categoria, localita, data_scoperta, ultimo_aggiornamento)
+        VALUES (?, 'titolo', ?, ?, 'Roma', datetime('now', ?), datetime('now', ?))
+    """, [(f"https://www.subito.it/{i}.htm", rnd.randint(10, 900), rnd.choice(names),
+           f"-{rnd.randint(0, 45)} days", f"-{rnd.randint(0, 40)} days") for i in range(history)])
+    conn.commit()
+    conn.close()
+    return names
+
+
+def run(path, label, names, touches, rounds, seed, tuned):
+    conn = sqlite3.connect(path)
+    if tuned:
+        migrations.tune(conn)
+    rnd = random.Random(seed)
+    history = conn.execute("SELECT max(id) FROM annunci").fetchone()[0]
+    links = [f"https://www.subito.it/{rnd.randrange(history)}.htm" for _ in range(touches)]
+    # Dalla v4 ogni ricerca ha la sua riga per annuncio: il touch la rinfresca e le statistiche leggono da lì
+    membership = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'annunci_ricerche'").fetchone() is not None
+
+    before = conn.total_changes
+    start = t.perf_counter()
+    for i in range(0, touches, PAGE):
+        with conn:
+            conn.executemany("UPDATE annunci SET ultimo_aggiornamento = CURRENT_TIMESTAMP WHERE link = ?",
+                             [(l,) for l in links[i:i + PAGE]])
+            if membership:
+                conn.executemany("""UPDATE annunci_ricerche SET ultimo_aggiornamento = CURRENT_TIMESTAMP
+                                    WHERE ricerca = (SELECT categoria FROM annunci WHERE link = ?) AND link = ?""",
+                                 [(l, l) for l in links[i:i + PAGE]])
+    write_s = t.perf_counter() - start
+    per_touch = (conn.total_changes - before) / touches
+
+    cleanup_sql = "SELECT count(*) FROM annunci WHERE ultimo_aggiornamento < datetime('now', '-30 days')"
+    start = t.perf_counter()
+    for _ in range(rounds):
+        conn.execute(cleanup_sql).fetchone()
+    cleanup_ms = (t.perf_counter() - start) / rounds * 1e3
+
+    if membership:
+        market_sql = """SELECT prezzo FROM annunci_ricerche WHERE ricerca = ?
+                        AND ultimo_aggiornamento > datetime('now', '-21 days') ORDER BY ultimo_aggiornamento DESC"""
+    else:
+        market_sql = """SELECT prezzo FROM annunci WHERE categoria = ?
+                        AND ultimo_aggiornamento > datetime('now', '-21 days') ORDER BY ultimo_aggiornamento DESC"""
+    start = t.perf_counter()
+    for i in range(rounds):
+        conn.execute(market_sql, (names[i % len(names)],)).fetchall()
+    market_ms = (t.perf_counter() - start) / rounds * 1e3
+
+    plans = [" / ".join(r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + sql, params))
+             for sql, params in ((cleanup_sql, ()), (market_sql, (names[0],)))]
+    mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    conn.close()
+
+    print(f"\n== {label} (journal_mode={mode})")
+    print(f"touch:   {touches / write_s:9.0f} annunci/s, {per_touch:.1f} righe scritte per touch")
+    print(f"cleanup: {cleanup_ms:8.2f} ms/query   [{plans[0]}]")
+    print(f"mercato: {market_ms:8.2f} ms/query   [{plans[1]}]")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--history', type=int, default=100000)
+    parser.add_argument('--categories', type=int, default=40)
+    parser.add_argument('--touches', type=int, default=3000)
+    parser.add_argument('--rounds', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    opts = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        v1 = os.path.join(tmp, "v1.db")
+        names = build_v1(v1, opts.history, opts.categories, opts.seed)
+        latest = os.path.join(tmp, "latest.db")
+        shutil.copy(v1, latest)
+        conn = sqlite3.connect(latest)
+        migrations.migrate(conn, verbose=False)
+        conn.close()
+
+        run(v1, "schema v1", names, opts.touches, opts.rounds, opts.seed, tuned=False)
+        run(latest, f"schema v{migrations.LATEST}", names, opts.touches, opts.rounds, opts.seed, tuned=True)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+'''Punteggio di una pagina: il vecchio ciclo annuncio per annuncio contro scoring.score_page (NumPy),
+per pagine di varie dimensioni lette da --searches ricerche con filtri prezzo diversi.
+
+Misura solo la decisione (filtro prezzo, nuovo/ribasso/invariato, z-score, fascia), con i prezzi
+noti presi da un LinkIndex in memoria come nel demone, e controlla che le due strade decidano uguale.
+
+Uso: python3 benchmarks/bench_scoring.py --sizes 30 200 1000 5000 --searches 20
+'''
+import argparse
+import os
+import random
+import sys
+import time as t
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from link_index import LinkIndex
+from scoring import TIERS, PageColumns, score_page
+
+
+def make_page(size, rnd):
+    '''(link, titolo, venduto, località, prezzo) come parse_item, con qualche doppione (sponsorizzati)'''
+    rows = [(f"https://www.subito.it/annunci/{i}.htm", f"Annuncio {i}", rnd.random() < 0.05, "Roma", rnd.randint(20, 900))
+            for i in range(size)]
+    return rows + rnd.sample(rows, size // 30)
+
+
+def make_index(searches, page, rnd):
+    '''Metà degli annunci già noti a ogni ricerca, un decimo a un prezzo più alto (ribasso in arrivo)'''
+    index = LinkIndex()
+    for name in searches:
+        for link, _title, _sold, _loc, price in page:
+            if rnd.random() < 0.5:
+                index.set(name, link, price * 1.2 if rnd.random() < 0.2 else price)
+    return index
+
+
+def legacy_decisions(parsed, name, low_bound, high_bound, mu, sigma, index):
+    '''Il ciclo di process_items prima di scoring.py, senza scritture né stampe'''
+    sold, candidates = [], []
+    for link, title, is_sold, location, price in parsed:
+        if is_sold:
+            sold.append(link)
+            continue
+        if price < low_bound or price > high_bound:
+            continue
+        candidates.append((link, title, location, price))
+    prices = index.known_prices(name, [c[0] for c in candidates])
+    new, drops, touched = [], [], []
+    for link, title, location, price in candidates:
+        old_price = prices.get(link)
+        if old_price is None:
+            tag = None
+            if mu != 0:
+                z = (price - mu) / sigma if sigma > 0 else 0
+                if z <= -1.0:
+                    tag = TIERS[0][1] if z <= -2.0 else TIERS[1][1] if z <= -1.5 else TIERS[2][1]
+            new.append((link, tag))
+        elif price < old_price:
+            drops.append(link)
+        else:
+            touched.append(link)
+    return sold, new, drops, touched
+
+
+def columnar_decisions(cols, name, low_bound, high_bound, mu, sigma, index):
+    s = score_page(cols, low_bound, high_bound, lambda rows: index.prices_for_keys(name, cols.keys[rows]), mu, sigma)
+    return ([cols.links[i] for i in s.sold],
+            [(cols.links[i], TIERS[s.tier[i]][1] if s.tier[i] >= 0 else None) for i in s.new],
+            [cols.links[i] for i in s.drops],
+            [cols.links[i] for i in s.touched])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[30, 200, 1000, 5000])
+    parser.add_argument('--searches', type=int, default=20, help="ricerche che leggono la stessa pagina")
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    opts = parser.parse_args()
+
+    rnd = random.Random(opts.seed)
+    searches = [(f"bench{i}", rnd.choice([0, 50, 100]), rnd.choice([400, 700, float('inf')]), rnd.uniform(300, 500), rnd.uniform(50, 150))
+                for i in range(opts.searches)]
+    print(f"🧪 {opts.searches} ricerche per pagina, {opts.rounds} giri")
+    failed = False
+    for size in opts.sizes:
+        page = make_page(size, rnd)
+        index = make_index([s[0] for s in searches], page, rnd)
+
+        start = t.perf_counter()
+        for _ in range(opts.rounds):
+            legacy = [legacy_decisions(page, *s, index) for s in searches]
+        old = (t.perf_counter() - start) / opts.rounds
+
+        start = t.perf_counter()
+        for _ in range(opts.rounds):
+            cols = PageColumns(page)
+            fast = [columnar_decisions(cols, *s, index) for s in searches]
+        new = (t.perf_counter() - start) / opts.rounds
+
+        same = legacy == fast
+        failed = failed or not same
+        print(f"{'✅' if same else '❌'} {len(page):5d} annunci  ciclo {old * 1e3:8.2f} ms  colonne {new * 1e3:8.2f} ms  "
+              f"({old / new:4.1f}x)  per annuncio e ricerca {new / len(page) / len(searches) * 1e6:6.2f} µs")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+'''Sessioni curl_cffi contro il Subito finto: una sessione nuova per ogni pagina, la vecchia sessione unica
+e il pool di session_pool (keep-alive, un profilo per sessione), in sequenza e con richieste in parallelo.
+
+Riporta pagine/s, connessioni TCP aperte dal server e quanti User-Agent diversi ha visto.
+Il server finto parla HTTP: il costo dell'handshake TLS di Subito qui non c'è, le connessioni contano quello.
+
+Uso: python3 benchmarks/bench_sessions.py --pages 200 --sessions 4 --concurrency 8
+'''
+import argparse
+import asyncio
+import os
+import sys
+import time as t
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from curl_cffi import requests
+
+from fake_subito import FakeMarket, FakeSubito
+from session_pool import SessionPool
+
+SEARCHES = 10
+
+
+def page_urls(server, pages):
+    return [f"{server.base_url}/s/bench{i % SEARCHES}/?o={i // SEARCHES % 5 + 1}" for i in range(pages)]
+
+
+def snapshot(server):
+    return server.counters["connections"], dict(server.user_agents)
+
+
+def report(label, server, before, elapsed, pages):
+    connections = server.counters["connections"] - before[0]
+    agents = [a for a, n in server.user_agents.items() if n > before[1].get(a, 0)]
+    print(f"{label:28s} {pages / elapsed:8.1f} pagine/s  {connections:5d} connessioni  {len(agents)} User-Agent")
+
+
+def sequential(server, urls, label, get):
+    before = snapshot(server)
+    start = t.perf_counter()
+    for url in urls:
+        get(url).raise_for_status()
+    report(label, server, before, t.perf_counter() - start, len(urls))
+
+
+async def concurrent(server, urls, label, sessions, concurrency):
+    '''Come refresh_async: ogni "ricerca" prende una sessione e ci scarica le sue pagine'''
+    before = snapshot(server)
+    slots = asyncio.Semaphore(concurrency)
+
+    async def search(chunk):
+        entry = sessions.acquire()
+        for url in chunk:
+            async with slots:
+                response = await entry.session.get(url)
+            response.raise_for_status()
+            sessions.succeeded(entry)
+
+    chunks = [urls[i::SEARCHES] for i in range(SEARCHES)]
+    start = t.perf_counter()
+    await asyncio.gather(*(search(c) for c in chunks))
+    elapsed = t.perf_counter() - start
+    for session in sessions.drain():
+        await session.close()
+    report(label, server, before, elapsed, len(urls))
+
+
+def one_shot(url):
+    with requests.Session(impersonate="chrome110") as session:
+        return session.get(url)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--sessions', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=8)
+    opts = parser.parse_args()
+
+    server = FakeSubito(FakeMarket([f"bench{i}" for i in range(SEARCHES)], 150)).start()
+    urls = page_urls(server, opts.pages)
+    print(f"🧪 {opts.pages} pagine, pool di {opts.sessions} sessioni, {opts.concurrency} richieste in volo in async")
+
+    sequential(server, urls, "sessione nuova per pagina", one_shot)
+    single = requests.Session(impersonate="chrome110")
+    sequential(server, urls, "sessione unica (prima)", single.get)
+    pool = SessionPool(lambda profile, proxy: requests.Session(impersonate=profile, proxy=proxy), opts.sessions,
+                       close=lambda session: session.close())
+    sequential(server, urls, "pool round_robin", lambda url: pool.acquire().session.get(url))
+
+    def async_pool(pick):
+        return SessionPool(lambda profile, proxy: requests.AsyncSession(impersonate=profile, proxy=proxy), opts.sessions, pick=pick)
+
+    async def single_async():
+        session = requests.AsyncSession(impersonate="chrome110")
+        sessions = SessionPool(lambda profile, proxy: session, 1)
+        await concurrent(server, urls, "async, sessione unica", sessions, opts.concurrency)
+
+    asyncio.run(single_async())
+    asyncio.run(concurrent(server, urls, "async, pool round_robin", async_pool("round_robin"), opts.concurrency))
+    asyncio.run(concurrent(server, urls, "async, pool lru", async_pool("lru"), opts.concurrency))
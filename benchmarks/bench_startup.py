@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+'''Tempo di avvio di ogni comando di gestione (--short_list, --list, --delete...) e moduli pesanti caricati.
+
+I comandi di gestione non devono importare lo stack di scraping e statistiche: se ne trova uno
+(o se la mediana supera --max_ms) esce con codice 1, così si può usare come controllo di regressione.
+
+Uso: python3 benchmarks/bench_startup.py --runs 10 [--max_ms 300]
+'''
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time as t
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, "subito-searcher.py")
+sys.path.insert(0, ROOT)
+
+import db
+
+HEAVY = ("numpy", "curl_cffi", "bs4", "requests", "asyncio", "http.server")
+COMMANDS = [
+    ("--help", ["--help"]),
+    ("--short_list", ["--short_list"]),
+    ("--list", ["--list"]),
+    ("--delete", ["--delete", "inesistente"]),
+    ("--addtoken", ["--addtoken", "123:abc", "--addchatid", "@prova"]),
+]
+
+
+def heavy_imports(args, cwd):
+    '''Moduli pesanti importati da un comando, letti dall'output di -X importtime'''
+    out = subprocess.run([sys.executable, "-X", "importtime", SCRIPT] + args, cwd=cwd,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True).stderr
+    loaded = {line.rsplit("|", 1)[-1].strip() for line in out.splitlines() if line.startswith("import time:")}
+    return sorted(m for m in loaded if m in HEAVY)
+
+
+def wall_times(cmd, cwd, runs):
+    times = []
+    for _ in range(runs):
+        start = t.perf_counter()
+        subprocess.run(cmd, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append((t.perf_counter() - start) * 1e3)
+    return times
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--searches', type=int, default=20)
+    parser.add_argument('--max_ms', type=float, help="fallisce se la mediana di un comando supera questa soglia")
+    opts = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="subito-startup-")
+    conn = db.open_writer(os.path.join(workdir, "annunci.db"), verbose=False)
+    conn.executemany("INSERT INTO ricerche (nome, url) VALUES (?, 'https://www.subito.it/annunci-italia/?q=x')",
+                     [(f"ricerca{i}",) for i in range(opts.searches)])
+    conn.commit()
+    conn.close()
+
+    base = statistics.median(wall_times([sys.executable, "-c", "pass"], workdir, opts.runs))
+    print(f"🧪 {opts.runs} avvii per comando, interprete vuoto {base:.0f} ms")
+    failed = False
+    for label, args in COMMANDS:
+        times = wall_times([sys.executable, SCRIPT] + args, workdir, opts.runs)
+        median = statistics.median(times)
+        heavy = heavy_imports(args, workdir)
+        too_slow = opts.max_ms is not None and median > opts.max_ms
+        failed = failed or bool(heavy) or too_slow
+        print(f"{'❌' if heavy or too_slow else '✅'} {label:<13} mediana {median:7.1f} ms  min {min(times):7.1f} ms"
+              f"  pesanti: {', '.join(heavy) or 'nessuno'}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+'''Throttle adattivo contro il vecchio ritmo fisso (2-4 s tra le pagine), su un orologio simulato.
+
+Il server finto regge --limit richieste al secondo (token bucket con raffica --burst): oltre risponde 429
+con Retry-After, e se i 429 in un minuto superano --ban_after banna il client per --ban secondi (403).
+Riporta pagine servite, 429, secondi di ban e la velocità a cui si è assestato il throttle.
+Prima controlla che ogni esito della richiesta di prova (interruttore "di prova") lo chiuda o lo riapra:
+se uno lo lascia appeso esce con codice 1.
+
+Uso: python3 benchmarks/bench_throttle.py --hours 2 --limit 0.8 --max_rate 2
+'''
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from throttle import CLOSED, OPEN, TRIP_AFTER, CircuitOpen, HostPacer, Throttle
+
+
+class RateLimitedHost:
+    '''Il lato server: token bucket, Retry-After e ban per chi insiste'''
+
+    def __init__(self, limit, burst, ban_after, ban, retry_after=5):
+        self.limit, self.burst, self.ban_after, self.ban = limit, burst, ban_after, ban
+        self.retry_after = retry_after
+        self.tokens, self.last = burst, 0.0
+        self.recent_429 = []
+        self.banned_until = 0.0
+        self.served = self.throttled = self.forbidden = 0
+        self.banned_seconds = 0.0
+
+    def request(self, now):
+        '''(status, Retry-After)'''
+        if now < self.banned_until:
+            self.forbidden += 1
+            return 403, None
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.limit)
+        self.last = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            self.served += 1
+            return 200, None
+        self.throttled += 1
+        self.recent_429 = [x for x in self.recent_429 if x > now - 60] + [now]
+        if len(self.recent_429) > self.ban_after:
+            self.banned_until = now + self.ban
+            self.banned_seconds += self.ban
+            self.recent_429 = []
+        return 429, self.retry_after
+
+
+def fixed_pacing(server, seconds, rnd):
+    '''Il vecchio run_query: 2-4 s di sleep prima di ogni pagina, un errore e si riprova al giro dopo'''
+    now = 0.0
+    while now < seconds:
+        now += rnd.uniform(2, 4)
+        server.request(now)
+    return None
+
+
+def adaptive(server, seconds, rnd, rate, max_rate, latency=0.3):
+    pacer = HostPacer("subito", rate, 0.05, max_rate)
+    # Il secchio parte da time.monotonic(): l'orologio simulato parte da lì, il server conta da zero
+    start = now = pacer.refilled
+    while now - start < seconds:
+        try:
+            now += pacer.reserve(max_wait=60, now=now)
+        except CircuitOpen as e:
+            now += max(e.seconds, 1)
+            continue
+        sent = now
+        status, wait = server.request(now - start)
+        now += latency * rnd.uniform(0.8, 1.2)
+        if status == 200:
+            pacer.healthy(now - sent, sent)
+        else:
+            pacer.blocked(str(status), wait, sent, now)
+    return pacer
+
+
+def probe_outcomes():
+    '''Interruttore aperto da TRIP_AFTER blocchi, pausa finita, una richiesta di prova: per ogni esito lo stato
+    subito dopo e se la richiesta seguente, a pausa finita, parte. Passa da Throttle come fetch_page e record_error.'''
+    url = "https://www.subito.it/annunci-italia/"
+    outcomes = (
+        ("200", CLOSED, lambda th, sent: th.record(url, sent, 200)),
+        ("429", OPEN, lambda th, sent: th.record(url, sent, 429)),
+        ("503", OPEN, lambda th, sent: th.record(url, sent, 503)),
+        ("connessione caduta", OPEN, lambda th, sent: th.failed(url, sent, "connessione")),
+        ("timeout", OPEN, lambda th, sent: th.record(url, sent, error="timeout")),
+    )
+    ok = True
+    for label, expected, outcome in outcomes:
+        throttle = Throttle(1.0, 0.05, 1.0)
+        pacer = throttle.pacer(url)
+        with contextlib.redirect_stdout(io.StringIO()):
+            # Throttle legge time.monotonic: l'orologio simulato parte da lì e va avanti
+            now = pacer.refilled
+            for _ in range(TRIP_AFTER):
+                now += 1
+                pacer.blocked("429", now=now)
+            now = pacer.open_until + 1
+            pacer.reserve(max_wait=60, now=now) # la prova
+            outcome(throttle, now)
+            state = pacer.state
+            try:
+                pacer.reserve(max_wait=3600, now=max(pacer.open_until, now) + 1)
+                retried = True
+            except CircuitOpen:
+                retried = False
+        good = state == expected and not pacer.probing if state == CLOSED else state == expected
+        good = good and retried
+        ok &= good
+        print(f"{'✅' if good else '❌'} prova -> {label:20s} interruttore {state}, la richiesta dopo la pausa "
+              f"{'parte' if retried else 'resta bloccata'}")
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hours', type=float, default=2)
+    parser.add_argument('--limit', type=float, default=0.8, help="richieste al secondo che il server regge")
+    parser.add_argument('--burst', type=float, default=5)
+    parser.add_argument('--ban_after', type=int, default=20, help="429 in un minuto prima del ban")
+    parser.add_argument('--ban', type=float, default=900, help="secondi di ban")
+    parser.add_argument('--rate', type=float, default=0.33)
+    parser.add_argument('--max_rate', type=float, default=2.0)
+    parser.add_argument('--seed', type=int, default=42)
+    opts = parser.parse_args()
+
+    if not probe_outcomes():
+        sys.exit(1)
+    seconds = opts.hours * 3600
+    print(f"🧪 {opts.hours:g} ore simulate, il server regge {opts.limit} req/s (raffica {opts.burst:g}), "
+          f"ban di {opts.ban:g}s dopo {opts.ban_after} 429 in un minuto")
+    for label, run in (("ritmo fisso 2-4s", lambda s, r: fixed_pacing(s, seconds, r)),
+                       (f"adattivo {opts.rate}->{opts.max_rate}", lambda s, r: adaptive(s, seconds, r, opts.rate, opts.max_rate))):
+        server = RateLimitedHost(opts.limit, opts.burst, opts.ban_after, opts.ban)
+        with contextlib.redirect_stdout(io.StringIO()):
+            pacer = run(server, random.Random(opts.seed))
+        settled = f"  velocità finale {pacer.rate:.2f} req/s, interruttore {pacer.state}" if pacer else ""
+        print(f"{label:24s} {server.served:6d} pagine ({server.served / seconds:.2f}/s)  {server.throttled:5d} x 429  "
+              f"{server.forbidden:5d} x 403  ban {server.banned_seconds:6.0f}s{settled}")
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+'''Benchmark del demone con più worker (--workers N) contro il Subito finto.
+
+Per ogni N lancia il vero subito-searcher.py --daemon --workers N per --seconds secondi e conta
+pagine e annunci serviti al secondo. Con i lease ogni ricerca ha un solo worker, quindi
+i giri per ricerca (richieste della pagina 1) devono restare quelli di un worker solo, non N volte tanti.
+Il ritmo verso l'host (--max_rate) si divide tra i worker: coi valori di default le pagine/s non devono crescere con N.
+Con --max_rate alto il throttle non frena e si misura quanto scalano DB e lease.
+
+Uso: python3 benchmarks/bench_workers.py --searches 12 --workers 1 2 4 --seconds 60 [--max_rate 100]
+'''
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time as t
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from fake_subito import FakeMarket, FakeSubito
+import db
+
+
+def create_db(path, names, base_url):
+    conn = db.open_writer(path, verbose=False)
+    conn.executemany("INSERT INTO ricerche (nome, url, profondita_max) VALUES (?, ?, ?)",
+                     [(n, f"{base_url}/s/{n}/?q={n}", 2) for n in names])
+    conn.commit()
+    conn.close()
+
+
+def run(workers, opts):
+    names = [f"bench{i}" for i in range(opts.searches)]
+    server = FakeSubito(FakeMarket(names, opts.listings, opts.seed), seed=opts.seed).start()
+    workdir = tempfile.mkdtemp(prefix="subito-workers-")
+    create_db(os.path.join(workdir, "annunci.db"), names, server.base_url)
+
+    cmd = [sys.executable, os.path.join(ROOT, "subito-searcher.py"), "--daemon", "--delay", "1",
+           "--workers", str(workers), "--lease_ttl", str(opts.lease_ttl)]
+    if opts.max_rate is not None:
+        cmd += ["--rate", str(opts.max_rate), "--max_rate", str(opts.max_rate)]
+    # Nuovo gruppo di processi: alla fine il SIGINT arriva al padre e a tutti i worker
+    proc = subprocess.Popen(cmd, cwd=workdir, stdout=subprocess.DEVNULL, start_new_session=True)
+    t.sleep(opts.seconds)
+    os.killpg(proc.pid, signal.SIGINT)
+    proc.wait()
+    server.shutdown()
+
+    c = server.counters
+    cycles = [server.first_pages.get(n, 0) for n in names]
+    print(f"{workers:2d} worker  {c['pages'] / opts.seconds:7.2f} pagine/s  {c['listings'] / opts.seconds:8.1f} annunci/s  "
+          f"giri per ricerca min {min(cycles)} max {max(cycles)}")
+    return c['pages'] / opts.seconds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--searches', type=int, default=12)
+    parser.add_argument('--listings', type=int, default=90, help="annunci per ricerca sul server finto")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--seconds', type=float, default=60)
+    parser.add_argument('--lease_ttl', type=int, default=30)
+    parser.add_argument('--max_rate', type=float, default=None, help="richieste/s verso l'host per tutti i worker insieme (default quello del demone)")
+    parser.add_argument('--seed', type=int, default=42)
+    opts = parser.parse_args()
+
+    print(f"🧪 {opts.searches} ricerche x 2 pagine, {opts.seconds:.0f}s per prova")
+    base = None
+    for n in opts.workers:
+        rate = run(n, opts)
+        base = base or rate
+        print(f"           scala x{rate / base:.2f} rispetto a {opts.workers[0]} worker")
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+'''Server locale che fa finta di essere Subito (più Telegram e ntfy) per i benchmark.
+
+Ogni ricerca è un elenco di annunci dal più nuovo al più vecchio, paginato con o=.
+A ogni richiesta della pagina 1 il "mercato" della ricerca va avanti di un giro:
+arrivano annunci nuovi in cima, qualcuno ribassa e qualcuno viene venduto
+(compare una volta con sold=true e poi sparisce).
+
+Uso standalone: python3 benchmarks/fake_subito.py --port 8765 --searches 5
+poi ad es. --add Prova --url http://127.0.0.1:8765/s/prova0/
+'''
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import make_item, render_page
+
+PAGE_SIZE = 30
+
+
+class FakeMarket:
+    '''Lo stato degli annunci di ogni ricerca finta'''
+
+    def __init__(self, searches, listings_per_search, seed=1, new_rate=0.03, drop_rate=0.03, sold_rate=0.02):
+        self.rnd = random.Random(seed)
+        self.lock = threading.Lock()
+        self.next_id = 1
+        self.new_rate, self.drop_rate, self.sold_rate = new_rate, drop_rate, sold_rate
+        self.listings = {name: [self.new_listing() for _ in range(listings_per_search)] for name in searches}
+
+    def new_listing(self):
+        listing = {"id": self.next_id, "price": self.rnd.randint(50, 900), "sold": False,
+                   "title": f"Annuncio {self.next_id}", "town": self.rnd.choice(["Roma", "Milano", "Napoli"])}
+        self.next_id += 1
+        return listing
+
+    def advance(self, name):
+        '''Un giro di mercato per la ricerca name'''
+        listings = [l for l in self.listings[name] if not l["sold"]]
+        size = len(listings)
+        for l in listings:
+            roll = self.rnd.random()
+            if roll < self.sold_rate:
+                l["sold"] = True
+            elif roll < self.sold_rate + self.drop_rate:
+                l["price"] = max(1, int(l["price"] * self.rnd.uniform(0.7, 0.95)))
+        fresh = [self.new_listing() for _ in range(int(size * self.new_rate))]
+        self.listings[name] = (fresh + listings)[:size]
+
+    def page(self, name, page):
+        with self.lock:
+            if name not in self.listings:
+                return None
+            if page == 1:
+                self.advance(name)
+            chunk = self.listings[name][(page - 1) * PAGE_SIZE:page * PAGE_SIZE]
+            return [make_item(l["id"], l["price"], l["sold"], l["title"], l["town"], self.rnd) for l in chunk]
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Intestazioni e corpo partono in due write: con Nagle, sulle connessioni keep-alive il corpo
+    # aspetterebbe l'ACK ritardato del client (~40 ms a pagina)
+    disable_nagle_algorithm = True
+
+    def log_message(self, *_args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.count("connections") # una per connessione TCP: con il keep-alive molte meno delle pagine
+
+    def reply(self, status, body, content_type="application/json", headers=None):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        server = self.server
+        parts = urlsplit(self.path)
+        segments = [p for p in parts.path.split("/") if p]
+        if len(segments) != 2 or segments[0] != "s":
+            return self.reply(404, "{}")
+        server.count("pages")
+        server.count_agent(self.headers.get("User-Agent", ""))
+        if server.rnd.random() < server.fail_rate:
+            server.count("throttled")
+            return self.reply(429, "Too Many Requests", "text/plain", {"Retry-After": "1"})
+        page = int(parse_qs(parts.query).get("o", ["1"])[0])
+        items = server.market.page(segments[1], page)
+        if items is None:
+            return self.reply(404, "{}")
+        server.count("listings", len(items))
+        if page == 1:
+            server.count_search(segments[1])
+        self.reply(200, render_page(items, page, filler=40, rnd=server.rnd), "text/html; charset=utf-8")
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        if self.path.endswith("/sendMessage"):
+            server.count("telegram")
+            return self.reply(200, json.dumps({"ok": True, "result": {}}))
+        server.count("ntfy")
+        self.reply(200, json.dumps({"id": "bench", "event": "message"}))
+
+
+class FakeSubito(ThreadingHTTPServer):
+    '''Subito + Telegram + ntfy finti su 127.0.0.1, in un thread in background'''
+    daemon_threads = True
+
+    def __init__(self, market, port=0, fail_rate=0.0, seed=1):
+        super().__init__(("127.0.0.1", port), Handler)
+        self.market = market
+        self.fail_rate = fail_rate
+        self.rnd = random.Random(seed)
+        self.counters = {"pages": 0, "listings": 0, "throttled": 0, "telegram": 0, "ntfy": 0, "connections": 0}
+        self.user_agents = {} # User-Agent -> pagine chieste
+        self.first_pages = {} # ricerca -> quante volte è stata chiesta la pagina 1 (un giro)
+        self.counter_lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, key, n=1):
+        with self.counter_lock:
+            self.counters[key] += n
+
+    def count_agent(self, agent):
+        with self.counter_lock:
+            self.user_agents[agent] = self.user_agents.get(agent, 0) + 1
+
+    def count_search(self, name):
+        with self.counter_lock:
+            self.first_pages[name] = self.first_pages.get(name, 0) + 1
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="fake-subito", daemon=True).start()
+        return self
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--searches', type=int, default=5)
+    parser.add_argument('--listings', type=int, default=150)
+    parser.add_argument('--fail_rate', type=float, default=0.0)
+    opts = parser.parse_args()
+
+    names = [f"prova{i}" for i in range(opts.searches)]
+    server = FakeSubito(FakeMarket(names, opts.listings), opts.port, opts.fail_rate)
+    print(f"🧪 Subito finto su {server.base_url}: ricerche {', '.join(f'/s/{n}/' for n in names)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
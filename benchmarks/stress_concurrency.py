@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+'''Stress test dell'accesso concorrente al DB: un "demone" che scrive pagine di annunci senza sosta,
+N lettori tipo --list e qualche comando tipo --add/--delete, tutti in processi separati sullo stesso file.
+
+Conta letture e scritture andate a buon fine, gli errori "database is locked" e la latenza peggiore.
+Con --legacy rifà la stessa cosa come prima: rollback journal, connessioni normali e BEGIN implicito.
+
+Uso: python3 benchmarks/stress_concurrency.py --seconds 10 --readers 4 --cli 2 [--legacy]
+'''
+import argparse
+import multiprocessing as mp
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time as t
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import db
+import persistence
+
+SEARCHES = 20
+
+
+def legacy_connect(path, timeout):
+    conn = sqlite3.connect(path, timeout=timeout)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def create_db(path, history, legacy):
+    conn = db.open_writer(path, verbose=False)
+    names = [f"stress{i}" for i in range(SEARCHES)]
+    conn.executemany("INSERT INTO ricerche (nome, url) VALUES (?, 'http://placeholder/')", [(n,) for n in names])
+    conn.executemany("""
+        INSERT INTO annunci (link, titolo, prezzo, categoria, localita)
+        VALUES (?, ?, ?, ?, 'Roma')
+    """, [(f"https://www.subito.it/storico/{i}.htm", f"Storico {i}", 100 + i % 500, names[i % SEARCHES]) for i in range(history)])
+    conn.execute("INSERT INTO annunci_ricerche (ricerca, link, prezzo) SELECT categoria, link, prezzo FROM annunci")
+    conn.commit()
+    if legacy:
+        conn.execute("PRAGMA journal_mode = DELETE")
+    conn.close()
+    return names
+
+
+def daemon_worker(path, names, opts, until, results):
+    '''Pagine da 30 annunci una dietro l'altra, ognuna nella sua transazione'''
+    conn = legacy_connect(path, opts.timeout) if opts.legacy else db.open_writer(path, opts.timeout, verbose=False)
+    rnd = random.Random(1)
+    done = errors = 0
+    worst = 0.0
+    next_id = 0
+    while t.time() < until:
+        name = rnd.choice(names)
+        batch = persistence.PageBatch(name)
+        for _ in range(30):
+            if rnd.random() < 0.2:
+                next_id += 1
+                batch.insert(f"https://www.subito.it/nuovo/{next_id}.htm", f"Nuovo {next_id}", rnd.randint(50, 900), name, "Roma")
+            else:
+                batch.touch(f"https://www.subito.it/storico/{rnd.randrange(opts.history)}.htm")
+        start = t.perf_counter()
+        try:
+            if opts.legacy:
+                # come prima: un commit per annuncio
+                for row in batch.new:
+                    conn.execute(persistence.UPSERT_SQL, row)
+                    conn.commit()
+                for link in batch.touched:
+                    conn.execute(persistence.TOUCH_SQL.format("?"), (link,))
+                    conn.commit()
+            else:
+                persistence.flush(conn, batch)
+            done += 1
+        except sqlite3.OperationalError:
+            conn.rollback()
+            errors += 1
+        worst = max(worst, t.perf_counter() - start)
+        t.sleep(opts.fetch_ms / 1000) # la "richiesta HTTP" tra una pagina e l'altra
+    results.put(("demone", done, errors, worst))
+
+
+def reader_worker(path, opts, until, results):
+    '''Quello che fa --list: tutte le ricerche e tutti i loro annunci'''
+    done = errors = 0
+    worst = 0.0
+    while t.time() < until:
+        start = t.perf_counter()
+        try:
+            conn = legacy_connect(path, opts.timeout) if opts.legacy else db.open_reader(path, opts.timeout)
+            for r in conn.execute("SELECT nome FROM ricerche").fetchall():
+                conn.execute("""
+                    SELECT a.titolo, m.prezzo, a.localita, a.link
+                    FROM annunci_ricerche m JOIN annunci a ON a.link = m.link WHERE m.ricerca = ?
+                """, (r['nome'],)).fetchall()
+            conn.close()
+            done += 1
+        except sqlite3.OperationalError:
+            errors += 1
+        worst = max(worst, t.perf_counter() - start)
+    results.put(("lettore", done, errors, worst))
+
+
+def cli_worker(path, opts, until, results, seed):
+    '''--add e --delete di una ricerca usa e getta, ognuno con la sua connessione come da terminale'''
+    rnd = random.Random(seed)
+    done = errors = 0
+    worst = 0.0
+    while t.time() < until:
+        name = f"cli{seed}"
+        start = t.perf_counter()
+        try:
+            conn = legacy_connect(path, opts.timeout) if opts.legacy else db.open_writer(path, opts.timeout, verbose=False)
+            if opts.legacy:
+                with conn:
+                    conn.execute("INSERT OR REPLACE INTO ricerche (nome, url) VALUES (?, 'http://placeholder/')", (name,))
+                with conn:
+                    conn.execute("DELETE FROM ricerche WHERE nome = ?", (name,))
+            else:
+                with persistence.write_transaction(conn):
+                    conn.execute("INSERT OR REPLACE INTO ricerche (nome, url) VALUES (?, 'http://placeholder/')", (name,))
+                with persistence.write_transaction(conn):
+                    conn.execute("DELETE FROM ricerche WHERE nome = ?", (name,))
+            conn.close()
+            done += 1
+        except sqlite3.OperationalError:
+            errors += 1
+        worst = max(worst, t.perf_counter() - start)
+        t.sleep(rnd.uniform(0.05, 0.2))
+    results.put(("cli", done, errors, worst))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--cli', type=int, default=2, help="processi che fanno --add/--delete in loop")
+    parser.add_argument('--history', type=int, default=20000, help="annunci già presenti nel DB")
+    parser.add_argument('--fetch_ms', type=float, default=5, help="pausa del demone tra una pagina e l'altra")
+    parser.add_argument('--timeout', type=float, default=db.BUSY_TIMEOUT, help="busy timeout delle connessioni (secondi)")
+    parser.add_argument('--legacy', action='store_true', help="rollback journal e transazioni implicite, come prima")
+    opts = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="subito-stress-"), "annunci.db")
+    names = create_db(path, opts.history, opts.legacy)
+    until = t.time() + opts.seconds
+    results = mp.Queue()
+    procs = [mp.Process(target=daemon_worker, args=(path, names, opts, until, results))]
+    procs += [mp.Process(target=reader_worker, args=(path, opts, until, results)) for _ in range(opts.readers)]
+    procs += [mp.Process(target=cli_worker, args=(path, opts, until, results, i)) for i in range(opts.cli)]
+    for p in procs:
+        p.start()
+    rows = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+
+    mode = "legacy (rollback journal)" if opts.legacy else "WAL + lettori in sola lettura"
+    print(f"🧪 {mode}: {opts.seconds:.0f}s, 1 demone, {opts.readers} lettori, {opts.cli} comandi, storico {opts.history}")
+    totals = {}
+    for role, done, errors, worst in rows:
+        tot = totals.setdefault(role, [0, 0, 0.0, 0])
+        tot[0] += done
+        tot[1] += errors
+        tot[2] = max(tot[2], worst)
+        tot[3] += 1
+    for role, (done, errors, worst, n) in totals.items():
+        print(f"{role:<8} x{n}  {done:7d} ok ({done / opts.seconds:8.1f}/s)  {errors:5d} 'database is locked'  peggiore {worst * 1000:8.1f} ms")
+    failed = sum(v[1] for v in totals.values())
+    print("✅ nessun errore di lock" if failed == 0 else f"❌ {failed} operazioni fallite per lock")
+    sys.exit(1 if failed else 0)
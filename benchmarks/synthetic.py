@@ -0,0 +1,62 @@
+'''Pagine di risultati finte ma con la stessa forma di quelle di Subito (usate da benchmark e server locale)'''
+import json
+import random
+
+TOWNS = ["Roma", "Milano", "Napoli", "Torino", "Bologna", "Firenze", "Bari", "Palermo", "Genova", "Verona"]
+WORDS = ["iphone", "13", "pro", "128gb", "usato", "perfetto", "garanzia", "scatola", "originale", "rtx",
+         "3080", "bici", "corsa", "carbonio", "divano", "letto", "auto", "gomme", "invernali", "xbox"]
+
+
+def make_item(listing_id, price, sold=False, title=None, town=None, rnd=random):
+    '''Un annuncio con i campi che run_query legge, più un po' della zavorra che Subito ci mette intorno'''
+    title = title or " ".join(rnd.choice(WORDS) for _ in range(5)).capitalize()
+    town = town or rnd.choice(TOWNS)
+    return {
+        "item": {
+            "urn": f"id:ad:{listing_id}:list:{listing_id * 7}",
+            "subject": title,
+            "body": " ".join(rnd.choice(WORDS) for _ in range(40)),
+            "date": "2026-10-18 10:00:00",
+            "sold": sold,
+            "urls": {"default": f"https://www.subito.it/annunci/{listing_id}.htm", "mobile": f"https://m.subito.it/{listing_id}.htm"},
+            "geo": {"region": {"value": "Lazio"}, "city": {"value": town}, "town": {"value": town}},
+            "features": {
+                "/price": {"values": [{"key": str(price), "value": f"{price} €"}]},
+                "/item_condition": {"values": [{"key": "20", "value": "Usato - Come nuovo"}]},
+            },
+            "images": [{"cdnBaseUrl": f"https://images.sbito.it/api/v1/sbt-ads-images-pro/images/{listing_id}-{n}"} for n in range(4)],
+            "advertiser": {"userId": str(listing_id % 997), "name": "Privato", "type": 0},
+        }
+    }
+
+
+def render_page(items, page=1, filler=200, rnd=random):
+    '''HTML completo: head, un po' di markup e lo script __NEXT_DATA__ come lo serve Next.js'''
+    state = {
+        "props": {
+            "pageProps": {
+                "initialState": {
+                    "search": {"query": "iphone", "page": page, "filters": {f"f{n}": n for n in range(50)}},
+                    "items": {"list": items, "total": 1200, "pagination": {"page": page, "size": len(items)}},
+                    "categories": [{"id": n, "label": f"Categoria {n}", "friendly": f"cat-{n}"} for n in range(60)],
+                },
+                "config": {"labels": {f"label_{n}": "testo " * 5 for n in range(filler)}},
+            }
+        },
+        "page": "/[...slug]",
+        "query": {"o": str(page)},
+        "buildId": "b" * 20,
+    }
+    cards = "\n".join(
+        f'<div class="item-card"><a href="/x/{n}"><h2 class="title">Annuncio {n}</h2></a>'
+        f'<p class="price">{rnd.randint(1, 900)} €</p><span class="town">{rnd.choice(TOWNS)}</span></div>'
+        for n in range(filler)
+    )
+    return (
+        '<!DOCTYPE html><html lang="it"><head><meta charset="utf-8"><title>Subito</title>'
+        + "".join(f'<link rel="preload" href="/_next/static/chunk{n}.js" as="script"/>' for n in range(30))
+        + '</head><body><div id="__next">' + cards + '</div>'
+        + '<script id="__NEXT_DATA__" type="application/json">' + json.dumps(state) + '</script>'
+        + "".join(f'<script src="/_next/static/chunk{n}.js" async=""></script>' for n in range(30))
+        + '</body></html>'
+    )
@@ -0,0 +1,44 @@
+import os
+import sqlite3
+from urllib.parse import quote
+
+import migrations
+
+# Connessioni al DB condiviso tra il demone e i comandi da terminale.
+# Con il WAL (migrazione 2) chi legge non blocca chi scrive e viceversa: --list e --short_list
+# usano una connessione in sola lettura, mentre chi scrive si mette in fila sul lock
+# (busy timeout) e lo tiene il meno possibile (persistence.write_transaction).
+
+DB_FILE = "annunci.db"
+BUSY_TIMEOUT = 30 # secondi di attesa del lock di scrittura prima di "database is locked"
+
+
+def _connect(target, uri=False, timeout=BUSY_TIMEOUT, check_same_thread=True):
+    conn = sqlite3.connect(target, timeout=timeout, uri=uri, check_same_thread=check_same_thread)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def open_writer(path=DB_FILE, timeout=BUSY_TIMEOUT, verbose=True):
+    '''Connessione di scrittura: porta lo schema all'ultima versione e imposta i PRAGMA per connessione'''
+    conn = _connect(path, timeout=timeout)
+    conn.execute("PRAGMA foreign_keys = ON")
+    migrations.migrate(conn, verbose)
+    migrations.tune(conn)
+    return conn
+
+
+def open_reader(path=DB_FILE, timeout=BUSY_TIMEOUT, check_same_thread=True):
+    '''Connessione in sola lettura (mode=ro + query_only): non chiede mai il lock di scrittura.
+    Se il DB non esiste ancora o è indietro di versione lo sistema prima una connessione di scrittura.
+    check_same_thread=False per i pool che la passano da un thread all'altro (una alla volta).'''
+    target = f"file:{quote(os.path.abspath(path))}?mode=ro"
+    if not os.path.exists(path):
+        open_writer(path, timeout).close()
+    conn = _connect(target, uri=True, timeout=timeout, check_same_thread=check_same_thread)
+    if migrations.current_version(conn) < migrations.LATEST:
+        conn.close()
+        open_writer(path, timeout).close()
+        conn = _connect(target, uri=True, timeout=timeout, check_same_thread=check_same_thread)
+    conn.execute("PRAGMA query_only = ON")
+    return conn
@@ -1,33 +1,34 @@
 import sqlite3
 import os
 
+import migrations
+
 def crea_database():
     db_name = "annunci.db"
-    schema_file = "schema.sql"
-    
-    # Se er DB esiste già, non famo casini
-    if os.path.exists(db_name):
-        print(f"⚠️ Er database '{db_name}' esiste già. Lo salto.")
-        return
 
+    # Se er DB esiste già non lo ricreamo: lo portamo all'ultima versione dello schema
+    esiste = os.path.exists(db_name)
+
+    conn = None
     try:
         # Connessione (crea er file se non c'è)
         conn = sqlite3.connect(db_name)
-        cursor = conn.cursor()
 
-        # Legge lo schema SQL
-        with open(schema_file, 'r') as f:
-            sql_script = f.read()
+        versione = migrations.current_version(conn)
+        applicate = migrations.migrate(conn)
 
-        # Esegue lo schema
-        cursor.executescript(sql_script)
-        conn.commit()
-        print(f"✅ Database '{db_name}' creato e tabelle pronte!")
+        if not esiste:
+            print(f"✅ Database '{db_name}' creato e tabelle pronte! (schema v{migrations.LATEST})")
+        elif applicate:
+            print(f"✅ Database '{db_name}' aggiornato: v{versione} -> v{migrations.LATEST}")
+        else:
+            print(f"⚠️ Er database '{db_name}' è già all'ultima versione (v{versione}). Lo salto.")
         
     except Exception as e:
         print(f"❌ Errore: {e}")
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
 
 if __name__ == "__main__":
     crea_database()
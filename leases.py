@@ -0,0 +1,130 @@
+import atexit
+import math
+import os
+import socket
+import sqlite3
+import threading
+import time as t
+
+import db
+from persistence import write_transaction
+
+# Più demoni (--daemon --shard, o --workers N) sullo stesso DB si dividono le ricerche attive.
+# Ogni ricerca ha al massimo un proprietario in assegnazioni, che la tiene finché rinnova la scadenza:
+# così nessuna ricerca viene scaricata due volte nello stesso giro.
+# Se un worker muore smette di rinnovare: dopo ttl secondi le sue ricerche passano agli altri.
+
+DEFAULT_TTL = 300
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def beat(conn, worker, ttl, now=None):
+    '''Rinnova il battito del worker e la scadenza di tutti i suoi lease (dentro la transazione del chiamante).
+    Ritorna quanti lease ha ancora.'''
+    now = int(now if now is not None else t.time())
+    conn.execute("""
+        INSERT INTO lavoratori (id, battito) VALUES (?, ?)
+        ON CONFLICT(id) DO UPDATE SET battito = excluded.battito
+    """, (worker, now))
+    return conn.execute("UPDATE assegnazioni SET scadenza = ? WHERE lavoratore = ?", (now + ttl, worker)).rowcount
+
+
+class Heartbeat(threading.Thread):
+    '''Rinnova i lease ogni ttl/3 anche mentre il giro è a metà (un giro lungo non deve perderli)'''
+
+    def __init__(self, path, worker, ttl):
+        super().__init__(name="lease-heartbeat", daemon=True)
+        self.path, self.worker, self.ttl = path, worker, ttl
+        self.stopped = threading.Event()
+
+    def run(self):
+        # Connessione sua: quelle sqlite3 non si passano tra thread
+        conn = db.open_writer(self.path, verbose=False)
+        while not self.stopped.wait(self.ttl / 3):
+            try:
+                with write_transaction(conn):
+                    beat(conn, self.worker, self.ttl)
+            except sqlite3.Error as e:
+                print(f"⚠️ Lease: battito non registrato ({e}), riprovo tra {self.ttl / 3:.0f}s")
+        conn.close()
+
+
+class Leases:
+    '''Le ricerche assegnate a questo worker'''
+
+    def __init__(self, path=db.DB_FILE, ttl=DEFAULT_TTL, worker=None):
+        self.path = path
+        self.conn = db.open_writer(path, verbose=False)
+        self.worker = worker or worker_id()
+        self.ttl = ttl
+        self.owned = set()
+        self.heartbeat = None
+
+    def start(self):
+        '''Si presenta subito agli altri worker (così contano anche lui nella quota), poi battito in
+        background e rilascio dei lease all'uscita'''
+        with write_transaction(self.conn):
+            beat(self.conn, self.worker, self.ttl)
+        self.heartbeat = Heartbeat(self.path, self.worker, self.ttl)
+        self.heartbeat.start()
+        atexit.register(self.release)
+        return self
+
+    def claim(self, now=None):
+        '''Rinnova i propri lease e prende (o cede) ricerche fino alla quota equa, ceil(attive / worker vivi).
+        Tutto in una transazione IMMEDIATE: due worker non possono prendere la stessa ricerca.
+        Ritorna (ricerche di questo worker, prese ora, cedute ora).'''
+        now = int(now if now is not None else t.time())
+        c = self.conn
+        with write_transaction(c):
+            beat(c, self.worker, self.ttl, now)
+            # Worker zitti da più di ttl e i loro lease scaduti: roba di processi morti
+            c.execute("DELETE FROM lavoratori WHERE battito <= ?", (now - self.ttl,))
+            c.execute("DELETE FROM assegnazioni WHERE scadenza <= ?", (now,))
+            c.execute("""
+                DELETE FROM assegnazioni WHERE lavoratore = ?
+                    AND nome IN (SELECT nome FROM ricerche WHERE attiva = 0)
+            """, (self.worker,))
+
+            active = c.execute("SELECT COUNT(*) FROM ricerche WHERE attiva = 1").fetchone()[0]
+            live = c.execute("SELECT COUNT(*) FROM lavoratori").fetchone()[0]
+            share = math.ceil(active / max(live, 1))
+            mine = [r[0] for r in c.execute(
+                "SELECT nome FROM assegnazioni WHERE lavoratore = ? ORDER BY nome", (self.worker,))]
+
+            if len(mine) > share:
+                # È arrivato qualcun altro: lasciamo le ricerche in più
+                c.executemany("DELETE FROM assegnazioni WHERE nome = ?", [(n,) for n in mine[share:]])
+                mine = mine[:share]
+            elif len(mine) < share:
+                # Prima quelle ferme da più tempo (mai eseguite in testa)
+                free = [r[0] for r in c.execute("""
+                    SELECT nome FROM ricerche
+                    WHERE attiva = 1 AND nome NOT IN (SELECT nome FROM assegnazioni)
+                    ORDER BY ultima_esecuzione LIMIT ?
+                """, (share - len(mine),))]
+                c.executemany("INSERT INTO assegnazioni (nome, lavoratore, scadenza) VALUES (?, ?, ?)",
+                              [(n, self.worker, now + self.ttl) for n in free])
+                mine += free
+
+        mine = set(mine)
+        gained, lost = mine - self.owned, self.owned - mine
+        self.owned = mine
+        return mine, gained, lost
+
+    def release(self):
+        '''Uscita pulita: le ricerche tornano libere subito invece che dopo ttl'''
+        if self.heartbeat is not None:
+            self.heartbeat.stopped.set()
+            self.heartbeat.join(timeout=5)
+        try:
+            with write_transaction(self.conn):
+                self.conn.execute("DELETE FROM assegnazioni WHERE lavoratore = ?", (self.worker,))
+                self.conn.execute("DELETE FROM lavoratori WHERE id = ?", (self.worker,))
+            self.conn.close()
+        except sqlite3.Error:
+            pass # connessione già chiusa o DB non raggiungibile: scadranno da soli
+        self.owned = set()
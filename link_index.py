@@ -0,0 +1,85 @@
+from functools import lru_cache
+from hashlib import blake2b
+
+
+def text_key(text):
+    '''Hash a 64 bit (con segno, come gli INTEGER di SQLite) di un nome di ricerca o di un link'''
+    return int.from_bytes(blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+
+@lru_cache(maxsize=4096)
+def search_key(search):
+    return text_key(search)
+
+
+def link_key(search, link):
+    '''Chiave a 64 bit di (ricerca, link): pesa molto meno dell'URL intero.
+    È lo XOR dei due hash, così una pagina si hasha una volta sola e vale per tutte le ricerche (prices_for_keys).
+    Con un milione di annunci la probabilità di una collisione è ~1e-8, la accettiamo.'''
+    return search_key(search) ^ text_key(link)
+
+
+class LinkIndex:
+    '''Indice in memoria (ricerca, link) -> ultimo prezzo visto da quella ricerca, così run_query decide
+    nuovo/ribasso/invariato senza SQLite. Va tenuto allineato a mano ogni volta che annunci_ricerche
+    cambia (flush, cleanup, delete).'''
+
+    def __init__(self):
+        self.prices = {}
+
+    @classmethod
+    def load(cls, conn):
+        '''Carica tutto annunci_ricerche una volta sola, all'avvio del demone'''
+        index = cls()
+        for search, link, prezzo in conn.execute("SELECT ricerca, link, prezzo FROM annunci_ricerche"):
+            index.set(search, link, prezzo)
+        return index
+
+    def load_categories(self, conn, categories):
+        '''Aggiunge i link di alcune ricerche (passate a questo worker da un altro processo)'''
+        categories = list(categories)
+        for i in range(0, len(categories), 900):
+            part = categories[i:i + 900]
+            placeholders = ",".join("?" * len(part))
+            for search, link, prezzo in conn.execute(
+                    f"SELECT ricerca, link, prezzo FROM annunci_ricerche WHERE ricerca IN ({placeholders})", part):
+                self.set(search, link, prezzo)
+
+    def __len__(self):
+        return len(self.prices)
+
+    def get(self, search, link):
+        return self.prices.get(link_key(search, link))
+
+    def set(self, search, link, price):
+        # I prezzi interi occupano meno dei float e sono quasi tutti interi
+        if price is not None and float(price).is_integer():
+            price = int(price)
+        self.prices[link_key(search, link)] = price
+
+    def discard(self, search, link):
+        self.prices.pop(link_key(search, link), None)
+
+    def known_prices(self, search, links):
+        '''Stessa interfaccia di persistence.known_prices, ma senza toccare il DB'''
+        prices = {}
+        for link in links:
+            price = self.prices.get(link_key(search, link))
+            if price is not None:
+                prices[link] = price
+        return prices
+
+    def prices_for_keys(self, search, keys):
+        '''Prezzi visti da search per dei link già passati da text_key (array NumPy int64), None se non li conosce.
+        Lo XOR con la ricerca si fa su tutto l'array, restano solo le get sul dict.'''
+        get = self.prices.get
+        return [get(k) for k in (keys ^ search_key(search)).tolist()]
+
+    def apply(self, batch):
+        '''Riporta sull'indice una PageBatch già committata'''
+        for search, link in batch.unlinked:
+            self.discard(search, link)
+        for link in batch.lost:
+            self.discard(batch.search, link)
+        for link, _title, price, *_rest in batch.new + batch.drops:
+            self.set(batch.search, link, price)
@@ -0,0 +1,259 @@
+import math
+
+import persistence
+
+# Statistiche di mercato mantenute in modo incrementale.
+# Per ogni categoria teniamo un istogramma a secchielli logaritmici (passo del 2%):
+# ogni secchiello ha conteggio, somma e somma dei quadrati dei prezzi che contiene.
+# Dai secchielli ricaviamo Q1/Q3 (sketch dei quantili, errore ~2%) e media/sigma
+# filtrate con l'IQR senza rileggere i prezzi da annunci.
+# La finestra è la stessa di get_market_int: annunci aggiornati negli ultimi 21 giorni.
+# La categoria è la ricerca, e i suoi annunci sono quelli in annunci_ricerche: un annuncio
+# trovato da due ricerche conta nelle statistiche di tutte e due.
+
+WINDOW = '-21 days'
+LOG_STEP = math.log(1.02)
+MIN_SAMPLES = 20
+MIN_CLEANED = 10
+
+# Le tabelle le crea la migrazione 1 (migrations.py)
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS mercato_bucket (
+    categoria TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    somma REAL NOT NULL,
+    somma_q REAL NOT NULL,
+    PRIMARY KEY (categoria, bucket)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS mercato_meta (
+    chiave TEXT PRIMARY KEY,
+    valore TEXT
+);
+"""
+
+BUCKET_UPSERT_SQL = """
+    INSERT INTO mercato_bucket (categoria, bucket, n, somma, somma_q) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(categoria, bucket) DO UPDATE SET
+        n = n + excluded.n, somma = somma + excluded.somma, somma_q = somma_q + excluded.somma_q
+"""
+
+
+def bucket_of(price):
+    return int(math.log1p(max(price, 0)) / LOG_STEP)
+
+
+def summarize(buckets):
+    '''mu/sigma/min_alert da un istogramma {bucket: [n, somma, somma_q]}, stesse soglie di get_market_int'''
+    rows = sorted((b, v) for b, v in buckets.items() if v[0] > 0)
+    total = sum(v[0] for _, v in rows)
+    if total < MIN_SAMPLES:
+        return None
+
+    def quantile(q):
+        # Come np.percentile: posizione (N-1)*q, il valore è la media del secchiello che la contiene
+        rank = (total - 1) * q
+        seen = 0
+        for _, (n, s, _ss) in rows:
+            seen += n
+            if seen > rank:
+                return s / n
+        return rows[-1][1][1] / rows[-1][1][0]
+
+    q1, q3 = quantile(0.25), quantile(0.75)
+    iqr = q3 - q1
+    low_bound = q1 - 1.5 * iqr
+    up_bound = q3 + 1.5 * iqr
+
+    n = s = ss = 0
+    for _, (bn, bs, bss) in rows:
+        if low_bound <= bs / bn <= up_bound:
+            n += bn
+            s += bs
+            ss += bss
+    if n < MIN_CLEANED:
+        return None
+
+    mu = s / n
+    return {
+        "mu": mu,
+        "sigma": math.sqrt(max(ss / n - mu * mu, 0.0)),
+        "count": n,
+        "min_alert": q1,
+    }
+
+
+def exact_market(conn, category):
+    '''Il calcolo esatto di una volta (tutti i prezzi + NumPy), per il controllo di coerenza'''
+    import numpy as np
+    rows = conn.execute("""
+        SELECT prezzo FROM annunci_ricerche
+        WHERE ricerca = ?
+            AND ultimo_aggiornamento > datetime('now', '-21 days')
+    """, (category,)).fetchall()
+    if len(rows) < MIN_SAMPLES:
+        return None
+    prezzi = np.sort(np.array([r[0] for r in rows]))
+    q1, q3 = np.percentile(prezzi, [25, 75])
+    iqr = q3 - q1
+    prezzi_cleaned = prezzi[(prezzi >= q1 - 1.5 * iqr) & (prezzi <= q3 + 1.5 * iqr)]
+    if len(prezzi_cleaned) < MIN_CLEANED:
+        return None
+    return {
+        "mu": float(np.mean(prezzi_cleaned)),
+        "sigma": float(np.std(prezzi_cleaned)),
+        "count": len(prezzi_cleaned),
+        "min_alert": float(q1),
+    }
+
+
+def forget_category(conn, category):
+    '''Da chiamare nella stessa transazione che elimina la ricerca (gli annunci spariscono in cascata)'''
+    conn.execute("DELETE FROM mercato_bucket WHERE categoria = ?", (category,))
+
+
+class MarketStats:
+    '''Aggregati per categoria tenuti aggiornati a ogni flush: la lettura di mu/sigma è O(1)'''
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.buckets = {}   # categoria -> {bucket: [n, somma, somma_q]}
+        self.cache = {}     # categoria -> risultato di summarize
+        if self.meta('finestra_da') is None:
+            self.rebuild()
+        else:
+            for cat, b, n, s, ss in conn.execute("SELECT categoria, bucket, n, somma, somma_q FROM mercato_bucket"):
+                self.buckets.setdefault(cat, {})[b] = [n, s, ss]
+
+    def meta(self, key):
+        row = self.conn.execute("SELECT valore FROM mercato_meta WHERE chiave = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def cutoff(self):
+        '''Gli annunci con ultimo_aggiornamento >= cutoff sono quelli contati negli aggregati'''
+        return self.meta('finestra_da')
+
+    def rebuild(self):
+        '''Ricalcola tutto da annunci (prima esecuzione o dopo un controllo andato male)'''
+        self.buckets = {}
+        self.cache = {}
+        with persistence.write_transaction(self.conn):
+            cutoff = self.conn.execute(f"SELECT datetime('now', '{WINDOW}')").fetchone()[0]
+            self.conn.execute("DELETE FROM mercato_bucket")
+            for cat, prezzo in self.conn.execute(
+                    "SELECT ricerca, prezzo FROM annunci_ricerche WHERE ultimo_aggiornamento >= ? AND prezzo IS NOT NULL", (cutoff,)):
+                self._bump(cat, prezzo, 1)
+            self.conn.executemany(
+                "INSERT INTO mercato_bucket (categoria, bucket, n, somma, somma_q) VALUES (?, ?, ?, ?, ?)",
+                [(cat, b, *v) for cat, bs in self.buckets.items() for b, v in bs.items()])
+            self.conn.execute("INSERT OR REPLACE INTO mercato_meta (chiave, valore) VALUES ('finestra_da', ?)", (cutoff,))
+
+    def get(self, category):
+        if category not in self.cache:
+            self.cache[category] = summarize(self.buckets.get(category, {}))
+        return self.cache[category]
+
+    def _bump(self, category, price, sign):
+        v = self.buckets.setdefault(category, {}).setdefault(bucket_of(price), [0, 0.0, 0.0])
+        v[0] += sign
+        v[1] += sign * price
+        v[2] += sign * price * price
+        self.cache.pop(category, None)
+
+    def _old_rows(self, conn, where, params, links):
+        '''(ricerca, link) -> (prezzo, dentro la finestra) delle righe di annunci_ricerche che stiamo per cambiare'''
+        cutoff = self.cutoff()
+        old = {}
+        for part in persistence.chunks(links):
+            placeholders = ",".join("?" * len(part))
+            for cat, link, prezzo, counted in conn.execute(
+                    f"SELECT ricerca, link, prezzo, ultimo_aggiornamento >= ? FROM annunci_ricerche WHERE {where} link IN ({placeholders})",
+                    [cutoff] + params + part):
+                old[(cat, link)] = (prezzo, counted)
+        return old
+
+    def stage(self, conn, batch):
+        '''Calcola i delta (categoria, prezzo, ±1) di una PageBatch. Va chiamata dentro la
+        transazione del flush, prima delle scritture, perché legge lo stato vecchio delle righe.'''
+        search = batch.search
+        deltas = [(search, price, 1) for _link, _title, price, _cat, _loc in batch.new]
+
+        own_links = [d[0] for d in batch.drops] + batch.touched
+        if own_links:
+            old = self._old_rows(conn, "ricerca = ? AND", [search], own_links)
+            for link, _title, price, _cat, _loc, _old_price in batch.drops:
+                prezzo, counted = old.get((search, link), (None, False))
+                if counted and prezzo is not None:
+                    deltas.append((search, prezzo, -1))
+                # Se era sparito nel frattempo l'upsert lo rimette: conta comunque col prezzo nuovo
+                deltas.append((search, price, 1))
+            for link in batch.touched:
+                # Un annuncio uscito dalla finestra che ricompare ci rientra
+                if (search, link) in old:
+                    prezzo, counted = old[(search, link)]
+                    if not counted and prezzo is not None:
+                        deltas.append((search, prezzo, 1))
+
+        if batch.sold or batch.retired:
+            # Un venduto (o la copia vecchia di una ripubblicazione) esce dalle statistiche di tutte le ricerche che lo avevano
+            for (cat, _link), (prezzo, counted) in self._old_rows(conn, "", [], batch.sold + batch.retired).items():
+                if counted and prezzo is not None:
+                    deltas.append((cat, prezzo, -1))
+        return deltas
+
+    def write(self, conn, deltas):
+        '''Scrive i delta sui secchielli (dentro la transazione del chiamante)'''
+        if not deltas:
+            return
+        conn.executemany(BUCKET_UPSERT_SQL, [
+            (cat, bucket_of(price), sign, sign * price, sign * price * price) for cat, price, sign in deltas])
+        conn.execute("DELETE FROM mercato_bucket WHERE n <= 0")
+
+    def apply(self, deltas):
+        '''Riporta i delta in memoria, solo dopo il commit'''
+        for cat, price, sign in deltas:
+            self._bump(cat, price, sign)
+        for cat in {d[0] for d in deltas}:
+            bs = self.buckets.get(cat, {})
+            for b in [b for b, v in bs.items() if v[0] <= 0]:
+                del bs[b]
+
+    def expire(self):
+        '''Toglie dagli aggregati gli annunci non visti da 21 giorni. Va chiamata prima del
+        cleanup dei 30 giorni, altrimenti le righe cancellate non verrebbero mai sottratte.'''
+        with persistence.write_transaction(self.conn):
+            old_cutoff = self.cutoff()
+            new_cutoff = self.conn.execute(f"SELECT datetime('now', '{WINDOW}')").fetchone()[0]
+            deltas = [(cat, prezzo, -1) for cat, prezzo in self.conn.execute("""
+                SELECT ricerca, prezzo FROM annunci_ricerche
+                WHERE ultimo_aggiornamento >= ? AND ultimo_aggiornamento < ? AND prezzo IS NOT NULL
+            """, (old_cutoff, new_cutoff))]
+            self.write(self.conn, deltas)
+            self.conn.execute("UPDATE mercato_meta SET valore = ? WHERE chiave = 'finestra_da'", (new_cutoff,))
+        self.apply(deltas)
+        return len(deltas)
+
+    def reload(self, categories):
+        '''Rilegge dal DB i secchielli di alcune categorie: con più worker anche gli altri processi
+        li aggiornano (expire del cleanup, ricerche passate di mano)'''
+        categories = list(categories)
+        for cat in categories:
+            self.forget(cat)
+        for part in persistence.chunks(categories):
+            placeholders = ",".join("?" * len(part))
+            for cat, b, n, s, ss in self.conn.execute(
+                    f"SELECT categoria, bucket, n, somma, somma_q FROM mercato_bucket WHERE categoria IN ({placeholders})", part):
+                self.buckets.setdefault(cat, {})[b] = [n, s, ss]
+
+    def forget(self, category):
+        self.buckets.pop(category, None)
+        self.cache.pop(category, None)
+
+    def check(self, category, tolerance=0.05):
+        '''Confronta gli aggregati con il calcolo esatto: ritorna (ok, incrementale, esatto)'''
+        fast, exact = self.get(category), exact_market(self.conn, category)
+        if fast is None or exact is None:
+            return fast is None and exact is None, fast, exact
+        scale = max(abs(exact["mu"]), 1.0)
+        ok = all(abs(fast[k] - exact[k]) <= tolerance * scale for k in ("mu", "sigma", "min_alert"))
+        return ok, fast, exact
@@ -0,0 +1,185 @@
+import functools
+import json
+import sys
+import threading
+import time as t
+from contextlib import nullcontext
+
+# Strumentazione del percorso caldo: istogrammi di latenza per fase e contatori.
+# Spenta di default: timed() ritorna un nullcontext condiviso e inc() esce alla prima riga,
+# quindi senza --metrics_port / --log_json il costo è una chiamata a funzione.
+
+PREFIX = "subito"
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+enabled = False
+json_log = None # file aperto da enable(), una riga JSON per evento
+
+_lock = threading.Lock()
+_counters = {}    # (nome, etichette) -> valore
+_gauges = {}      # (nome, etichette) -> ultimo valore
+_histograms = {}  # fase -> [conteggi per bucket..., +Inf], somma, numero
+_NULL = nullcontext()
+_CO_COROUTINE = 0x80 # inspect.CO_COROUTINE: inspect da solo costa più di tutto questo modulo all'avvio
+
+
+def enable(log_path=None):
+    '''Accende la raccolta; con log_path ("-" per stdout) scrive anche gli eventi come JSON lines'''
+    global enabled, json_log
+    enabled = True
+    if log_path == "-":
+        json_log = sys.stdout
+    elif log_path:
+        json_log = open(log_path, "a", buffering=1)
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def inc(name, n=1, **labels):
+    if not enabled:
+        return
+    key = (name, _key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + n
+
+
+def gauge(name, value, **labels):
+    '''Un valore che sale e scende (velocità corrente, stato dell'interruttore...)'''
+    if not enabled:
+        return
+    with _lock:
+        _gauges[(name, _key(labels))] = value
+
+
+def observe(phase, seconds):
+    if not enabled:
+        return
+    with _lock:
+        h = _histograms.get(phase)
+        if h is None:
+            h = _histograms[phase] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                h[0][i] += 1
+                break
+        else:
+            h[0][-1] += 1
+        h[1] += seconds
+        h[2] += 1
+
+
+class _Timer:
+    __slots__ = ("phase", "start")
+
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = t.perf_counter()
+        return self
+
+    def __exit__(self, *_exc):
+        observe(self.phase, t.perf_counter() - self.start)
+        return False
+
+
+def timed(phase):
+    '''with metrics.timed("fetch"): ... -> finisce nell'istogramma subito_phase_seconds{phase="fetch"}'''
+    return _Timer(phase) if enabled else _NULL
+
+
+def instrument(phase):
+    '''Decoratore: misura tutta la funzione (anche async) sotto la fase phase'''
+    def decorate(fn):
+        if fn.__code__.co_flags & _CO_COROUTINE:
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if not enabled:
+                    return await fn(*args, **kwargs)
+                with _Timer(phase):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            with _Timer(phase):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def event(kind, **fields):
+    '''Un evento strutturato (fine ricerca, fine giro...) nel log JSON, se attivo'''
+    if json_log is None:
+        return
+    record = {"ts": round(t.time(), 3), "event": kind}
+    record.update(fields)
+    with _lock:
+        json_log.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+def render():
+    '''Tutto nel formato testo di Prometheus'''
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+        histograms = {k: (list(v[0]), v[1], v[2]) for k, v in _histograms.items()}
+
+    seen = set()
+    for kind, values in (("counter", counters), ("gauge", gauges)):
+        for (name, labels), value in values:
+            metric = f"{PREFIX}_{name}"
+            if metric not in seen:
+                lines.append(f"# TYPE {metric} {kind}")
+                seen.add(metric)
+            lines.append(f"{metric}{_labels(labels)} {value}")
+
+    if histograms:
+        metric = f"{PREFIX}_phase_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        for phase, (counts, total, n) in sorted(histograms.items()):
+            cumulative = 0
+            for bound, c in zip(BUCKETS + ("+Inf",), counts):
+                cumulative += c
+                lines.append(f'{metric}_bucket{{phase="{phase}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{phase="{phase}"}} {total}')
+            lines.append(f'{metric}_count{{phase="{phase}"}} {n}')
+    return "\n".join(lines) + "\n"
+
+
+def serve(port, host="127.0.0.1"):
+    '''Endpoint /metrics in un thread di background (solo in locale di default)'''
+    # http.server si porta dietro mezzo stdlib: lo importa solo chi usa --metrics_port
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *_args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -0,0 +1,313 @@
+import os
+import sqlite3
+
+import market_stats
+from link_index import text_key
+from persistence import EVENT_NEW, HISTORY_SQL, cents, write_transaction
+
+# Migrazioni dello schema, tracciate con PRAGMA user_version.
+# La versione 1 è schema.sql (più le colonne e le tabelle arrivate dopo, per i DB creati
+# prima del runner); da lì in avanti ogni modifica è una funzione qui sotto.
+# Per aggiungerne una: nuova funzione + riga in MIGRATIONS, mai modificare quelle già uscite.
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema.sql")
+
+
+def already_applied(conn, number):
+    '''Da chiamare appena preso il lock (BEGIN IMMEDIATE): se più processi aprono insieme un DB vecchio,
+    la versione letta da migrate è già vecchia per chi arriva secondo, e i passi che copiano dati
+    (storico_prezzi, novita...) non si possono fare due volte'''
+    return current_version(conn) >= number
+
+
+def columns(conn, table):
+    return {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def statements(script):
+    '''Le istruzioni di uno script SQL una per una (i trigger con BEGIN...END restano interi):
+    executescript fa COMMIT prima di partire, quindi non può stare dentro il lock di una migrazione'''
+    buffer = ""
+    for line in script.splitlines(keepends=True):
+        buffer += line
+        if sqlite3.complete_statement(buffer):
+            yield buffer
+            buffer = ""
+
+
+def v1_baseline(conn):
+    '''Schema base. Idempotente: i DB creati prima del runner hanno già (quasi) tutto.
+    Lo script gira solo dopo il controllo della versione: su un DB già migrato rimetterebbe
+    il trigger e l'indice che la 2 ha tolto.'''
+    with open(SCHEMA_FILE) as f:
+        script = f.read()
+    with write_transaction(conn):
+        if already_applied(conn, 1):
+            return False
+        for statement in statements(script + market_stats.SCHEMA):
+            conn.execute(statement)
+        colonne = columns(conn, "ricerche")
+        if 'profondita_max' not in colonne:
+            conn.execute("ALTER TABLE ricerche ADD COLUMN profondita_max INTEGER DEFAULT 5")
+        if 'tasso_novita' not in colonne:
+            conn.execute("ALTER TABLE ricerche ADD COLUMN tasso_novita REAL DEFAULT 0")
+        conn.execute("PRAGMA user_version = 1")
+
+
+def v2_write_amplification(conn):
+    '''Via il trigger che riscriveva ogni UPDATE (run_query mette già ultimo_aggiornamento da sé),
+    indici su ultimo_aggiornamento per il cleanup e su (categoria, ultimo_aggiornamento, prezzo)
+    che copre la query di get_market_int. L'indice (categoria, prezzo) è un suo prefisso: lo togliamo.'''
+    with write_transaction(conn):
+        if already_applied(conn, 2):
+            return False
+        conn.execute("DROP TRIGGER IF EXISTS trg_update_timestamp")
+        conn.execute("DROP INDEX IF EXISTS idx_stats_prezzo")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_annunci_aggiornamento ON annunci (ultimo_aggiornamento)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_annunci_mercato ON annunci (categoria, ultimo_aggiornamento, prezzo)")
+        conn.execute("PRAGMA user_version = 2")
+    # WAL resta scritto nel file del DB; non si può attivare dentro una transazione
+    conn.execute("PRAGMA journal_mode = WAL")
+
+
+def v3_leases(conn):
+    '''Tabelle per dividere le ricerche tra più demoni (leases.py): chi è vivo e chi tiene cosa'''
+    with write_transaction(conn):
+        if already_applied(conn, 3):
+            return False
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS lavoratori (
+                id TEXT PRIMARY KEY,         -- host:pid
+                battito INTEGER NOT NULL     -- epoch dell'ultimo segno di vita
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS assegnazioni (
+                nome TEXT PRIMARY KEY REFERENCES ricerche (nome) ON DELETE CASCADE,
+                lavoratore TEXT NOT NULL,
+                scadenza INTEGER NOT NULL    -- epoch: dopo questo istante la ricerca è di nuovo libera
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_assegnazioni_lavoratore ON assegnazioni (lavoratore)")
+        conn.execute("PRAGMA user_version = 3")
+
+
+def v4_membership(conn):
+    '''Un annuncio può stare in più ricerche (es. "iphone" e "iphone 13"): annunci_ricerche tiene per
+    ogni (ricerca, annuncio) il prezzo visto da quella ricerca e quando l'ha visto l'ultima volta.
+    annunci.categoria resta la ricerca che l'ha trovato per prima.'''
+    with write_transaction(conn):
+        if already_applied(conn, 4):
+            return False
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS annunci_ricerche (
+                ricerca TEXT NOT NULL REFERENCES ricerche (nome) ON DELETE CASCADE,
+                link TEXT NOT NULL REFERENCES annunci (link) ON DELETE CASCADE,
+                prezzo REAL,
+                ultimo_aggiornamento DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (ricerca, link)
+            ) WITHOUT ROWID
+        """)
+        # link: venduti e cascate; (ricerca, ultimo_aggiornamento, prezzo): statistiche; ultimo_aggiornamento: cleanup
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_membri_link ON annunci_ricerche (link)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_membri_mercato ON annunci_ricerche (ricerca, ultimo_aggiornamento, prezzo)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_membri_aggiornamento ON annunci_ricerche (ultimo_aggiornamento)")
+        conn.execute("""
+            INSERT OR IGNORE INTO annunci_ricerche (ricerca, link, prezzo, ultimo_aggiornamento)
+            SELECT categoria, link, prezzo, ultimo_aggiornamento FROM annunci
+            WHERE categoria IN (SELECT nome FROM ricerche)
+        """)
+        # Le statistiche adesso si leggono da qui: idx_annunci_mercato non serve più
+        conn.execute("DROP INDEX IF EXISTS idx_annunci_mercato")
+        conn.execute("PRAGMA user_version = 4")
+
+
+def v5_price_history(conn):
+    '''storico_prezzi: una riga per ogni prezzo osservato, mai aggiornata (price_history.py la legge a colonne).
+    Niente indici né chiavi esterne: gli append costano il minimo e la storia resta anche dopo la vendita.
+    Si parte da quello che c'è già: un "nuovo" per ogni annuncio di ogni ricerca, col prezzo attuale
+    alla data di scoperta (lo storico di prima non l'avevamo).'''
+    with write_transaction(conn):
+        if already_applied(conn, 5):
+            return False
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS storico_prezzi (
+                ricerca INTEGER NOT NULL,    -- hash a 64 bit del nome della ricerca
+                annuncio INTEGER NOT NULL,   -- hash a 64 bit del link
+                ts INTEGER NOT NULL,         -- epoch
+                prezzo INTEGER NOT NULL,     -- centesimi
+                evento INTEGER NOT NULL      -- 0 nuovo, 1 ribasso, 2 venduto
+            )
+        """)
+        conn.executemany(HISTORY_SQL, (
+            (text_key(ricerca), text_key(link), int(ts or 0), cents(prezzo), EVENT_NEW)
+            for ricerca, link, ts, prezzo in conn.execute("""
+                SELECT m.ricerca, m.link, strftime('%s', a.data_scoperta), m.prezzo
+                FROM annunci_ricerche m JOIN annunci a ON a.link = m.link
+                WHERE m.prezzo IS NOT NULL
+                ORDER BY a.data_scoperta
+            """).fetchall()))
+        conn.execute("PRAGMA user_version = 5")
+
+
+def v6_news_feed(conn):
+    '''Per l'API in sola lettura (api.py): novita è il feed di nuovi e ribassi con link e titolo in chiaro
+    (lo storico ha solo hash), paginabile per id; giri segna la fine di ogni refresh, e chi legge svuota
+    la cache quando ne trova uno nuovo. Il feed parte con i nuovi degli ultimi 30 giorni (i ribassi
+    di prima non li avevamo salvati).'''
+    with write_transaction(conn):
+        if already_applied(conn, 6):
+            return False
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS novita (
+                id INTEGER PRIMARY KEY,
+                ts INTEGER NOT NULL,                  -- epoch
+                ricerca TEXT NOT NULL REFERENCES ricerche (nome) ON DELETE CASCADE,
+                link TEXT NOT NULL,
+                titolo TEXT,
+                prezzo REAL,
+                prezzo_vecchio REAL,                  -- solo per i ribassi
+                localita TEXT,
+                tipo INTEGER NOT NULL                 -- 0 nuovo, 1 ribasso (come storico_prezzi)
+            )
+        """)
+        # (ricerca, id): feed di una ricerca e cascata alla cancellazione; ts: cleanup
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_novita_ricerca ON novita (ricerca, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_novita_ts ON novita (ts)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS giri (
+                id INTEGER PRIMARY KEY,
+                inizio INTEGER NOT NULL,
+                fine INTEGER NOT NULL,
+                ricerche INTEGER NOT NULL,
+                novita INTEGER NOT NULL
+            )
+        """)
+        conn.execute("""
+            INSERT INTO novita (ts, ricerca, link, titolo, prezzo, localita, tipo)
+            SELECT CAST(strftime('%s', a.data_scoperta) AS INTEGER), m.ricerca, m.link, a.titolo, m.prezzo, a.localita, ?
+            FROM annunci_ricerche m JOIN annunci a ON a.link = m.link
+            WHERE a.data_scoperta >= datetime('now', '-30 days')
+            ORDER BY a.data_scoperta
+        """, (EVENT_NEW,))
+        conn.execute("PRAGMA user_version = 6")
+
+
+def v7_full_text(conn):
+    '''annunci_fts: indice FTS5 su titolo e località di annunci (external content: il testo sta solo in annunci).
+    Lo tengono allineato tre trigger che scattano solo quando un annuncio entra, esce o cambia titolo/località:
+    i touch (ultimo_aggiornamento) e i cambi di prezzo non li toccano. Così restano allineati anche i venduti,
+    il cleanup e le cascate di --delete, che non passano da flush.'''
+    with write_transaction(conn):
+        if already_applied(conn, 7):
+            return False
+        conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS annunci_fts USING fts5(
+                titolo, localita, content='annunci', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+            )
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_fts_insert AFTER INSERT ON annunci BEGIN
+                INSERT INTO annunci_fts (rowid, titolo, localita) VALUES (new.id, new.titolo, new.localita);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_fts_delete AFTER DELETE ON annunci BEGIN
+                INSERT INTO annunci_fts (annunci_fts, rowid, titolo, localita) VALUES ('delete', old.id, old.titolo, old.localita);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_fts_update AFTER UPDATE OF titolo, localita ON annunci BEGIN
+                INSERT INTO annunci_fts (annunci_fts, rowid, titolo, localita) VALUES ('delete', old.id, old.titolo, old.localita);
+                INSERT INTO annunci_fts (rowid, titolo, localita) VALUES (new.id, new.titolo, new.localita);
+            END
+        """)
+        conn.execute("INSERT INTO annunci_fts (annunci_fts) VALUES ('rebuild')")
+        conn.execute("PRAGMA user_version = 7")
+
+
+def v8_reposts(conn):
+    '''Indice delle ripubblicazioni (reposts.py): firme MinHash dei titoli, secchielli LSH e i collegamenti
+    copia -> originale. Stanno fuori da annunci e senza cascate: l'originale sparisce (venduto, cancellato,
+    ritirato) ma la sua firma deve restare per riconoscere la copia. Si parte con gli annunci degli ultimi 30 giorni.'''
+    import reposts
+    with write_transaction(conn):
+        if already_applied(conn, 8):
+            return False
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS firme (
+                chiave INTEGER PRIMARY KEY,           -- text_key(link)
+                link TEXT NOT NULL,
+                ts INTEGER NOT NULL,                  -- primo avvistamento (epoch)
+                prezzo REAL,
+                numeri INTEGER NOT NULL,              -- text_key delle parole con cifre del titolo
+                firma BLOB NOT NULL,                  -- NUM_HASHES uint32
+                secchielli BLOB NOT NULL              -- BANDS int64, per cancellarli senza un altro indice
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_firme_link ON firme (link)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_firme_ts ON firme (ts)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS lsh_secchielli (
+                secchiello INTEGER NOT NULL,
+                chiave INTEGER NOT NULL,
+                PRIMARY KEY (secchiello, chiave)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS ripubblicati (
+                link TEXT PRIMARY KEY,                -- la copia
+                originale TEXT NOT NULL,              -- il primo della catena
+                precedente TEXT NOT NULL,             -- la copia prima di questa (ritirata dal mercato)
+                prezzo_precedente REAL,
+                somiglianza REAL,
+                ts INTEGER NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_ripubblicati_precedente ON ripubblicati (precedente)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_ripubblicati_ts ON ripubblicati (ts)")
+        reposts.add(conn, conn.execute("""
+            SELECT link, titolo, prezzo, localita, CAST(strftime('%s', COALESCE(data_scoperta, 'now')) AS INTEGER) FROM annunci
+            WHERE data_scoperta >= datetime('now', '-30 days') ORDER BY data_scoperta
+        """).fetchall())
+        conn.execute("PRAGMA user_version = 8")
+
+
+MIGRATIONS = [
+    (1, "schema base", v1_baseline),
+    (2, "niente trigger doppio, indici per cleanup e statistiche, WAL", v2_write_amplification),
+    (3, "lease per dividere le ricerche tra più worker", v3_leases),
+    (4, "annunci condivisi tra più ricerche", v4_membership),
+    (5, "storico dei prezzi", v5_price_history),
+    (6, "feed delle novità e giri per l'API", v6_news_feed),
+    (7, "ricerca full-text su titolo e località", v7_full_text),
+    (8, "indice delle ripubblicazioni", v8_reposts),
+]
+LATEST = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, verbose=True):
+    '''Porta il DB all'ultima versione. Ritorna la lista delle migrazioni applicate.'''
+    applied = []
+    version = current_version(conn)
+    if version > LATEST:
+        raise sqlite3.DatabaseError(f"database alla versione {version}, questo bot conosce fino alla {LATEST}")
+    for number, description, step in MIGRATIONS:
+        if number <= version:
+            continue
+        if verbose:
+            print(f"🔧 Migrazione {number}: {description}")
+        if step(conn) is not False: # False: l'ha fatta un altro processo nel frattempo
+            applied.append(number)
+    return applied
+
+
+def tune(conn):
+    '''Impostazioni per connessione: con WAL basta synchronous=NORMAL (niente fsync a ogni commit)'''
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA cache_size = -16000")  # ~16 MB
+    conn.execute("PRAGMA temp_store = MEMORY")
@@ -0,0 +1,84 @@
+import json
+
+# Estrattore veloce del blob Next.js: invece di far parsare tutto l'HTML a BeautifulSoup
+# cerchiamo direttamente lo <script id="__NEXT_DATA__"> nei byte della risposta
+# e decodifichiamo solo props.pageProps.initialState.items.list.
+
+MARKER = b'id="__NEXT_DATA__"'
+SCRIPT_END = b'</script>'
+ITEMS_PATH = ('props', 'pageProps', 'initialState', 'items', 'list')
+
+_decoder = json.JSONDecoder()
+
+
+def find_payload(body):
+    '''Il testo JSON dentro lo script __NEXT_DATA__, o None se la scansione diretta non lo trova'''
+    pos = body.find(MARKER)
+    if pos < 0:
+        return None
+    start = body.find(b'>', pos)
+    if start < 0:
+        return None
+    end = body.find(SCRIPT_END, start)
+    if end < 0:
+        return None
+    return body[start + 1:end].decode('utf-8')
+
+
+def looks_like_items(value):
+    '''Controllo di sanità sulla lista trovata a colpo d'occhio'''
+    return isinstance(value, list) and all(isinstance(v, dict) for v in value) and (not value or 'item' in value[0])
+
+
+def items_from_payload(payload):
+    '''Va dritto alla chiave "list" dentro initialState.items e decodifica solo quella.
+    Se qualcosa non torna (lista vuota compresa) rifà il giro lungo con json.loads.'''
+    pos = payload.find('"initialState"')
+    if pos >= 0:
+        pos = payload.find('"items"', pos)
+    if pos >= 0:
+        pos = payload.find('"list"', pos)
+    if pos >= 0:
+        pos = payload.find(':', pos)
+    if pos >= 0:
+        start = pos + 1
+        while start < len(payload) and payload[start] in ' \t\r\n':
+            start += 1
+        try:
+            value, _end = _decoder.raw_decode(payload, start)
+        except ValueError:
+            value = None
+        if value and looks_like_items(value):
+            return value
+
+    data = json.loads(payload)
+    for key in ITEMS_PATH:
+        data = data[key]
+    return data
+
+
+def items_with_soup(body):
+    '''Vecchio percorso: BeautifulSoup su tutta la pagina. Lo teniamo come paracadute.'''
+    from bs4 import BeautifulSoup
+    script_tag = BeautifulSoup(body, 'html.parser').find('script', id='__NEXT_DATA__')
+    if not script_tag:
+        return None
+    data = json.loads(script_tag.string)
+    for key in ITEMS_PATH:
+        data = data[key]
+    return data
+
+
+def extract_items(body):
+    '''Lista annunci di una pagina di risultati (None se la pagina non ha __NEXT_DATA__).
+    body può essere bytes (response.content, il caso veloce) o str.'''
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    payload = find_payload(body)
+    if payload is None:
+        if b'__NEXT_DATA__' not in body:
+            # Pagina senza stato Next.js (fine risultati): inutile scomodare BeautifulSoup
+            return None
+        # Markup diverso da quello che ci aspettiamo (apici singoli, attributi riordinati...)
+        return items_with_soup(body)
+    return items_from_payload(payload)
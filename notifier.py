@@ -0,0 +1,183 @@
+import queue
+import threading
+import time as t
+from abc import ABC, abstractmethod
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+# Invio notifiche in background: ogni destinazione (Telegram, ntfy) ha la sua coda e
+# i suoi worker, tutti sopra una sessione HTTP persistente con pool di connessioni.
+# Lo scraping mette i messaggi in coda e riparte subito.
+
+TELEGRAM_API = "https://api.telegram.org"
+MAX_ATTEMPTS = 5
+
+
+class RateLimiter:
+    '''Token bucket thread-safe: rate token al secondo, al massimo burst accumulati'''
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = t.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = t.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            t.sleep(wait)
+
+
+def pooled_session(workers):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(workers, 4))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class Sink(ABC):
+    '''Una destinazione con la sua coda e il suo pool di worker. Le sottoclassi dicono come si spedisce (deliver).'''
+    name = "sink"
+
+    def __init__(self, session, workers):
+        self.session = session
+        self.jobs = queue.Queue()
+        self.threads = [threading.Thread(target=self.work, name=f"{self.name}-{i}", daemon=True) for i in range(workers)]
+        for th in self.threads:
+            th.start()
+
+    def submit(self, messages):
+        for job in self.jobs_for(messages):
+            self.jobs.put(job)
+
+    def jobs_for(self, messages):
+        return [(None, msg) for msg in messages]
+
+    def work(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                self.deliver(*job)
+            except Exception as e:
+                print(f"  ❌ [{self.name}] Critical failure: {str(e)}")
+            finally:
+                self.jobs.task_done()
+
+    @abstractmethod
+    def deliver(self, target, msg):
+        '''Spedisce un messaggio a target (None se la destinazione non ne ha) dentro un worker'''
+
+
+class TelegramSink(Sink):
+    '''Rispetta i limiti di Telegram: ~1 messaggio/s per chat, ~30/s in totale, e i 429 con retry_after'''
+    name = "telegram"
+
+    def __init__(self, session, workers, token, chat_ids, api=None):
+        # api letto a runtime: i benchmark lo puntano al server finto
+        self.url = f"{api or TELEGRAM_API}/bot{token}/sendMessage"
+        self.chat_ids = [chat_ids] if isinstance(chat_ids, str) else list(chat_ids)
+        self.global_limit = RateLimiter(30, 30)
+        self.chat_limits = {cid: RateLimiter(1, 1) for cid in self.chat_ids}
+        super().__init__(session, workers)
+
+    def jobs_for(self, messages):
+        return [(cid, msg) for msg in messages for cid in self.chat_ids]
+
+    def deliver(self, cid, msg):
+        payload = {
+            "chat_id": cid,
+            "text": msg,
+            "parse_mode": "Markdown",
+            "disable_web_page_preview": False
+        }
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            self.chat_limits[cid].acquire()
+            self.global_limit.acquire()
+            with metrics.timed("notify_telegram"):
+                response = self.session.post(self.url, json=payload, timeout=10)
+
+            if response.status_code == 200:
+                metrics.inc("notifications_total", sink="telegram", outcome="sent")
+                print(f"  📨 Sent to {cid}")
+                return
+            if response.status_code == 429:
+                metrics.inc("notifications_total", sink="telegram", outcome="throttled")
+                try:
+                    retry_after = response.json().get("parameters", {}).get("retry_after", 1)
+                except ValueError:
+                    retry_after = 1
+                print(f"  ⏳ Telegram flood limit for {cid}: retry in {retry_after}s ({attempt}/{MAX_ATTEMPTS})")
+                t.sleep(retry_after)
+                continue
+            metrics.inc("notifications_total", sink="telegram", outcome="error")
+            print(f"  ⚠️ Error for ID {cid} ({response.status_code}): {response.text}")
+            return
+        metrics.inc("notifications_total", sink="telegram", outcome="dropped")
+        print(f"  ❌ Giving up on {cid} after {MAX_ATTEMPTS} attempts")
+
+
+class NtfySink(Sink):
+    '''ntfy.sh di default concede una raffica di 60 messaggi e poi uno ogni 5 secondi'''
+    name = "ntfy"
+
+    def __init__(self, session, workers, server, topic):
+        self.url = f"{server.rstrip('/')}/{topic}"
+        self.limit = RateLimiter(0.2, 60)
+        super().__init__(session, workers)
+
+    def deliver(self, _target, msg):
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            self.limit.acquire()
+            with metrics.timed("notify_ntfy"):
+                response = self.session.post(self.url, data=msg.encode('utf-8'), timeout=10)
+            if response.status_code == 429:
+                metrics.inc("notifications_total", sink="ntfy", outcome="throttled")
+                backoff = 2 ** attempt
+                print(f"  ⏳ ntfy rate limit: retry in {backoff}s ({attempt}/{MAX_ATTEMPTS})")
+                t.sleep(backoff)
+                continue
+            if response.status_code >= 400:
+                metrics.inc("notifications_total", sink="ntfy", outcome="error")
+                print(f"Failed to send ntfy notification ({response.status_code}): {response.text}")
+            else:
+                metrics.inc("notifications_total", sink="ntfy", outcome="sent")
+            return
+        metrics.inc("notifications_total", sink="ntfy", outcome="dropped")
+        print(f"Failed to send ntfy notification after {MAX_ATTEMPTS} attempts")
+
+
+class Notifier:
+    '''Smista ogni messaggio a tutte le destinazioni configurate, senza bloccare chi chiama'''
+
+    def __init__(self, sinks):
+        self.sinks = sinks
+
+    def submit(self, messages):
+        if not messages:
+            return
+        if self.sinks:
+            print(f"\n📡 Queued {len(messages)} notifications for {', '.join(s.name for s in self.sinks)}")
+        for sink in self.sinks:
+            sink.submit(messages)
+
+    def pending(self):
+        return sum(s.jobs.unfinished_tasks for s in self.sinks)
+
+    def drain(self, timeout=60):
+        '''Aspetta che le code si svuotino (per --refresh e --add, che poi escono)'''
+        deadline = t.monotonic() + timeout
+        while self.pending() and t.monotonic() < deadline:
+            t.sleep(0.1)
+        return self.pending() == 0
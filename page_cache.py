@@ -0,0 +1,42 @@
+from hashlib import blake2b
+
+
+def page_content(items_list):
+    '''Impronta del contenuto di una pagina: id, prezzo e venduto di ogni annuncio.
+    Il &t= dell'URL cambia sempre, il contenuto spesso no. Si calcola una volta per pagina scaricata.'''
+    h = blake2b(digest_size=16)
+    for item_wrapper in items_list:
+        product = item_wrapper.get('item') or {}
+        try:
+            price = product.get('features', {}).get('/price', {}).get('values', [{}])[0].get('key')
+        except Exception:
+            price = None
+        h.update(f"\n{product.get('urn')}|{price}|{product.get('sold', False)}".encode('utf-8'))
+    return h.digest()
+
+
+def page_fingerprint(content, low_bound, high_bound):
+    '''Impronta della pagina per una ricerca: il contenuto più il suo filtro prezzo'''
+    return blake2b(f"{low_bound}|{high_bound}|".encode('utf-8') + content, digest_size=16).digest()
+
+
+class PageFingerprints:
+    '''Per ogni (ricerca, pagina) l'impronta dell'ultimo contenuto e i link che quella pagina tiene vivi nel DB'''
+
+    def __init__(self):
+        self.pages = {}
+
+    def unchanged(self, name, page, fingerprint):
+        '''I link da rinfrescare se la pagina è identica all'ultimo giro, altrimenti None'''
+        cached = self.pages.get((name, page))
+        if cached is None or cached[0] != fingerprint:
+            return None
+        return cached[1]
+
+    def store(self, name, page, fingerprint, batch):
+        links = [n[0] for n in batch.new] + [d[0] for d in batch.drops] + list(batch.touched)
+        self.pages[(name, page)] = (fingerprint, links)
+
+    def forget(self, name):
+        for key in [k for k in self.pages if k[0] == name]:
+            del self.pages[key]
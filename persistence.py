@@ -0,0 +1,243 @@
+from contextlib import contextmanager
+import time as t
+
+from link_index import text_key
+import metrics
+
+# SQLite accetta al massimo 999 parametri per query sulle build vecchie
+MAX_PARAMS = 900
+
+UPSERT_SQL = """
+    INSERT INTO annunci (link, titolo, prezzo, categoria, localita, data_scoperta, ultimo_aggiornamento)
+    VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+    ON CONFLICT(link) DO UPDATE SET prezzo = excluded.prezzo, ultimo_aggiornamento = CURRENT_TIMESTAMP
+"""
+# annunci_fts (ricerca full-text) lo aggiornano i trigger della migrazione 7, solo su inserimenti e cancellazioni
+TOUCH_SQL = "UPDATE annunci SET ultimo_aggiornamento = CURRENT_TIMESTAMP WHERE link IN ({})"
+SOLD_SQL = "DELETE FROM annunci WHERE link = ?" # le righe di annunci_ricerche vanno via in cascata
+
+# Lo stesso annuncio visto da una ricerca: prezzo e ultimo avvistamento per quella ricerca
+MEMBER_UPSERT_SQL = """
+    INSERT INTO annunci_ricerche (ricerca, link, prezzo, ultimo_aggiornamento)
+    VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(ricerca, link) DO UPDATE SET prezzo = excluded.prezzo, ultimo_aggiornamento = CURRENT_TIMESTAMP
+"""
+MEMBER_TOUCH_SQL = "UPDATE annunci_ricerche SET ultimo_aggiornamento = CURRENT_TIMESTAMP WHERE ricerca = ? AND link IN ({})"
+
+# Storico dei prezzi, solo in append: una riga per ogni prezzo nuovo (primo avvistamento, ribasso, vendita).
+# Tutto intero per stare compatto: ricerca e annuncio sono hash a 64 bit, ts in epoch, prezzo in centesimi.
+HISTORY_SQL = "INSERT INTO storico_prezzi (ricerca, annuncio, ts, prezzo, evento) VALUES (?, ?, ?, ?, ?)"
+EVENT_NEW, EVENT_DROP, EVENT_SOLD = 0, 1, 2
+EVENT_REPOST = 3 # solo in novita: un annuncio nuovo che è la copia di uno già visto (reposts.py)
+
+# Le novità (nuovi e ribassi) per chi legge dall'API, in chiaro e in ordine di id: è il feed dei dashboard
+NEWS_SQL = """
+    INSERT INTO novita (ts, ricerca, link, titolo, prezzo, prezzo_vecchio, localita, tipo)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+# Un giro di refresh finito: chi legge (api.py) butta la cache quando ne compare uno nuovo
+CYCLE_SQL = "INSERT INTO giri (inizio, fine, ricerche, novita) VALUES (?, ?, ?, ?)"
+
+
+def cents(price):
+    return int(round(price * 100))
+
+
+class PageBatch:
+    '''Raccoglie nuovi, ribassi, venduti e "visti" di una pagina di una ricerca per scriverli in un colpo solo.
+    "Nuovo" vuol dire nuovo per questa ricerca: l'annuncio può essere già in annunci per un'altra.'''
+
+    def __init__(self, search):
+        self.search = search
+        self.new = []        # (link, titolo, prezzo, categoria, localita)
+        self.drops = []      # (link, titolo, prezzo, categoria, localita, vecchio prezzo)
+        self.touched = []    # link
+        self.touched_rows = {} # link -> riga come in new, per rimetterlo se intanto è sparito dal DB
+        self.lost = []       # toccati spariti dal DB (cancellati da un altro processo) senza i dati per rimetterli
+        self.sold = []       # link
+        self.messages = []   # notifiche da spedire solo dopo il commit
+        self.unlinked = []   # (ricerca, link) spariti col flush (venduti e ritirati, di qualsiasi ricerca)
+        self.reposts = {}    # link nuovo -> reposts.Repost
+        self.retired = []    # link delle copie precedenti di una ripubblicazione: escono dal mercato senza essere venduti
+        self.fresh = []      # (link, titolo, prezzo, localita) da mettere nell'indice delle ripubblicazioni
+        self.seen = set()
+
+    def _first_time(self, link):
+        # Lo stesso annuncio può comparire due volte nella stessa pagina (sponsorizzati)
+        if link in self.seen:
+            return False
+        self.seen.add(link)
+        return True
+
+    def insert(self, link, title, price, category, location):
+        '''True se la riga entra nel batch (False per un doppione della pagina: niente print né notifica)'''
+        if not self._first_time(link):
+            return False
+        self.new.append((link, title, price, category, location))
+        return True
+
+    def drop(self, link, title, price, category, location, old_price):
+        if not self._first_time(link):
+            return False
+        self.drops.append((link, title, price, category, location, old_price))
+        return True
+
+    def repost(self, link, title, price, category, location, repost):
+        '''Un nuovo che è la copia di repost.previous: entra come nuovo e si collega all'originale.
+        L'originale esce dal mercato solo a fine giro (reposts.settle), se nessuno l'ha più visto.'''
+        if not self._first_time(link):
+            return False
+        self.new.append((link, title, price, category, location))
+        self.reposts[link] = repost
+        return True
+
+    def retire(self, link):
+        '''L'originale di una ripubblicazione confermata: via da annunci e dalle statistiche, ma non è un venduto'''
+        if link not in self.retired:
+            self.retired.append(link)
+
+    def touch(self, link, row=None):
+        if self._first_time(link):
+            self.touched.append(link)
+            if row is not None:
+                self.touched_rows[link] = row
+
+    def relink(self, missing):
+        '''I toccati che non sono più in annunci_ricerche (cleanup di un altro worker, --delete e --add...)
+        ma che l'indice in memoria dava per noti: tornano nuovi se abbiamo la riga, altrimenti finiscono in lost.
+        Ritorna le righe tornate nuove.'''
+        if not missing:
+            return []
+        self.touched = [link for link in self.touched if link not in missing]
+        relinked = []
+        for link in missing:
+            if link in self.touched_rows:
+                relinked.append(self.touched_rows[link])
+            else:
+                self.lost.append(link)
+        self.new += relinked
+        return relinked
+
+    def sell(self, link):
+        if self._first_time(link):
+            self.sold.append(link)
+
+    def rows(self):
+        '''Quanti annunci toccherà il flush'''
+        return len(self.new) + len(self.drops) + len(self.touched) + len(self.sold) + len(self.retired)
+
+
+@contextmanager
+def write_transaction(conn):
+    '''Transazione di scrittura corta con BEGIN IMMEDIATE: il lock si prende subito, aspettando
+    al massimo il busy timeout della connessione se un altro processo sta scrivendo.
+    Con il BEGIN implicito il lock arriverebbe a metà transazione, dove SQLite può solo dare "database is locked".'''
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def record_cycle(conn, started, searches, hits):
+    with write_transaction(conn):
+        conn.execute(CYCLE_SQL, (int(started), int(t.time()), searches, hits))
+
+
+def chunks(seq, size=MAX_PARAMS):
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+def known_prices(conn, search, links):
+    '''Prezzo visto da search per ogni link che già conosce, con una query per pagina invece che una per annuncio'''
+    prices = {}
+    for part in chunks(list(links)):
+        placeholders = ",".join("?" * len(part))
+        for link, prezzo in conn.execute(
+                f"SELECT link, prezzo FROM annunci_ricerche WHERE ricerca = ? AND link IN ({placeholders})", [search] + part):
+            prices[link] = prezzo
+    return prices
+
+
+def missing_links(conn, search, links):
+    '''I link che search non ha (più) in annunci_ricerche'''
+    return set(links) - set(known_prices(conn, search, links))
+
+
+def touch(conn, search, links, stats=None):
+    '''Rinfresca ultimo_aggiornamento di una lista di link con un solo UPDATE (pagine identiche all'ultimo giro).
+    Ritorna la batch: in batch.lost i link che nel frattempo sono spariti dal DB.'''
+    batch = PageBatch(search)
+    for link in links:
+        batch.touch(link)
+    flush(conn, batch, stats)
+    return batch
+
+
+def flush(conn, batch, stats=None):
+    '''Scrive tutta la pagina in una sola transazione (un solo fsync).
+    Se qualcosa va storto si fa rollback e l'eccezione risale: le notifiche non partono.
+    Con stats (MarketStats) aggiorna anche gli aggregati di mercato nella stessa transazione.
+    Nuovi, ribassi e venduti finiscono anche in storico_prezzi, nuovi e ribassi anche in novita.'''
+    if batch.rows() == 0:
+        return 0
+
+    deltas = []
+    now = int(t.time())
+    search = text_key(batch.search)
+    with metrics.timed("db"), write_transaction(conn):
+        if stats is not None:
+            deltas = stats.stage(conn, batch)
+        # L'indice in memoria segue solo le cancellazioni di questo processo: un UPDATE che non trova la riga
+        # lascerebbe fuori l'annuncio per sempre. Il rowcount dice se ne manca qualcuno, e solo allora si va a
+        # vedere quali: tornano nuovi prima di storico e novità.
+        short = []
+        for part in chunks(batch.touched):
+            placeholders = ",".join("?" * len(part))
+            conn.execute(TOUCH_SQL.format(placeholders), part)
+            if conn.execute(MEMBER_TOUCH_SQL.format(placeholders), [batch.search] + part).rowcount < len(part):
+                short += part
+        if short:
+            relinked = batch.relink(missing_links(conn, batch.search, short))
+            if stats is not None:
+                # stage non li ha trovati tra i toccati: contano come i nuovi
+                deltas += [(batch.search, row[2], 1) for row in relinked]
+        history = [(search, text_key(r[0]), now, cents(r[2]), EVENT_NEW) for r in batch.new if r[2] is not None]
+        history += [(search, text_key(d[0]), now, cents(d[2]), EVENT_DROP) for d in batch.drops if d[2] is not None]
+        news = [(now, batch.search, link, title, price, None, location, EVENT_NEW) if link not in batch.reposts else
+                (now, batch.search, link, title, price, batch.reposts[link].price, location, EVENT_REPOST)
+                for link, title, price, _cat, location in batch.new]
+        news += [(now, batch.search, link, title, price, old, location, EVENT_DROP) for link, title, price, _cat, location, old in batch.drops]
+        gone = batch.sold + batch.retired
+        if gone:
+            sold = set(batch.sold)
+            for part in chunks(gone):
+                for ricerca, link, prezzo in conn.execute(
+                        f"SELECT ricerca, link, prezzo FROM annunci_ricerche WHERE link IN ({','.join('?' * len(part))})", part):
+                    batch.unlinked.append((ricerca, link))
+                    # Il venduto chiude la serie di ogni ricerca che lo seguiva, all'ultimo prezzo visto da lei.
+                    # Una copia ritirata no: non è stata venduta, è ricomparsa con un altro link
+                    if prezzo is not None and link in sold:
+                        history.append((text_key(ricerca), text_key(link), now, cents(prezzo), EVENT_SOLD))
+            conn.executemany(SOLD_SQL, ((link,) for link in gone))
+        if batch.new or batch.drops:
+            rows = batch.new + [d[:5] for d in batch.drops]
+            conn.executemany(UPSERT_SQL, rows)
+            conn.executemany(MEMBER_UPSERT_SQL, [(batch.search, r[0], r[2]) for r in rows])
+            conn.executemany(NEWS_SQL, news)
+        if history:
+            conn.executemany(HISTORY_SQL, history)
+        if batch.fresh or batch.reposts:
+            import reposts
+            reposts.add(conn, batch.fresh, now)
+            reposts.link(conn, batch.reposts, now)
+        if stats is not None:
+            stats.write(conn, deltas)
+
+    if stats is not None:
+        stats.apply(deltas)
+    metrics.inc("db_rows_written_total", batch.rows())
+    return batch.rows()
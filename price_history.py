@@ -0,0 +1,152 @@
+import time as t
+
+import numpy as np
+
+from link_index import text_key
+from persistence import EVENT_DROP, EVENT_SOLD
+
+# Analisi dello storico prezzi (storico_prezzi, scritto da persistence.flush) su tutte le ricerche insieme.
+# Lo storico si carica una volta in array NumPy a colonne e poi si legge solo la coda (è in append):
+# mediane mobili, tempi di vendita e frequenza dei ribassi escono da qualche sort e reduceat,
+# senza una query per categoria.
+
+DAY = 86400
+COLUMNS = ("ricerca", "annuncio", "ts", "prezzo", "evento")
+DTYPE = np.dtype([("ricerca", "i8"), ("annuncio", "i8"), ("ts", "i8"), ("prezzo", "i8"), ("evento", "i1")])
+
+
+def group_medians(groups, values):
+    '''Mediana di values per ogni gruppo, tutti i gruppi con un solo sort.
+    Con gruppi e valori interi piccoli (centesimi, secondi) gruppo e valore stanno in un int64
+    e basta un np.sort, molto più veloce di lexsort. Ritorna (gruppi, mediane, quanti valori per gruppo).'''
+    if len(groups) == 0:
+        return groups, np.empty(0), np.empty(0, dtype=np.int64)
+    if values.dtype.kind in "iu" and groups.max() < 2**31 and values.min() >= 0 and values.max() < 2**32:
+        packed = np.sort((groups.astype(np.int64) << 32) | values.astype(np.int64))
+        g, v = packed >> 32, packed & (2**32 - 1)
+    else:
+        order = np.lexsort((values, groups))
+        g, v = groups[order], values[order]
+    keys, start, counts = np.unique(g, return_index=True, return_counts=True)
+    return keys, (v[start + (counts - 1) // 2] + v[start + counts // 2]) / 2, counts
+
+
+def series_order(cat, annuncio, ts, evento):
+    '''Ordine delle righe per (ricerca, annuncio, ts, evento): ogni serie di fila, in ordine di tempo.
+    Come in group_medians, se ci sta tutto in un int64 basta un argsort.'''
+    _, listing = np.unique(annuncio, return_inverse=True)
+    pair = cat.astype(np.int64) * (int(listing.max()) + 1) + listing
+    span = (int(ts.max() - ts.min()) + 1) * 4
+    if int(pair.max()) < 2**62 // span:
+        return np.argsort((pair * span) + (ts - ts.min()) * 4 + evento)
+    return np.lexsort((evento, ts, pair))
+
+
+class PriceHistory:
+    '''Lo storico prezzi in memoria, a colonne'''
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = np.empty(0, dtype=DTYPE)
+        self.last_rowid = 0
+
+    def refresh(self):
+        '''Legge solo le righe arrivate dall'ultima volta. Se qualcuno ne ha cancellate
+        (--delete di una ricerca) ricarica tutto. Ritorna quante righe ha letto.'''
+        count, top = self.conn.execute("SELECT COUNT(*), COALESCE(MAX(rowid), 0) FROM storico_prezzi").fetchone()
+        if count < len(self.rows) or top < self.last_rowid:
+            self.rows, self.last_rowid = np.empty(0, dtype=DTYPE), 0
+        cursor = self.conn.cursor()
+        cursor.row_factory = None # tuple semplici: np.fromiter le prende così come sono
+        cursor.execute(f"SELECT {', '.join(COLUMNS)} FROM storico_prezzi WHERE rowid > ? AND rowid <= ? ORDER BY rowid",
+                       (self.last_rowid, top))
+        chunk = np.fromiter(cursor, dtype=DTYPE)
+        self.rows = np.concatenate([self.rows, chunk]) if len(self.rows) else chunk
+        self.last_rowid = top
+        return len(chunk)
+
+    def names(self):
+        '''hash -> nome delle ricerche che esistono ancora'''
+        return {text_key(r[0]): r[0] for r in self.conn.execute("SELECT nome FROM ricerche")}
+
+    def analyze(self, now=None, window_days=21, roll_days=7, days=30):
+        '''Statistiche di tutte le ricerche in un colpo. Per ogni ricerca:
+        rolling_median  mediana dei prezzi chiesti (nuovi e ribassi) negli ultimi roll_days giorni, per ognuno degli ultimi days giorni
+        listings        annunci con un prezzo visto nella finestra di window_days giorni
+        drop_rate       quota di quegli annunci con almeno un ribasso
+        drops_per_listing, median_drop_pct   quanti ribassi in media e di quanto (mediana, in %)
+        sold, median_days_to_sell   venduti nella finestra e giorni (mediana) dal primo avvistamento alla vendita
+        I prezzi sono in euro.'''
+        now = int(now if now is not None else t.time())
+        names = self.names()
+        rows = self.rows[np.isin(self.rows["ricerca"], np.fromiter(names, dtype=np.int64, count=len(names)))]
+        cats, cat = np.unique(rows["ricerca"], return_inverse=True)
+        n = len(cats)
+        ts, cents, evento = rows["ts"], rows["prezzo"], rows["evento"]
+        since = now - window_days * DAY
+        asking = evento != EVENT_SOLD
+
+        # Mediane mobili: ogni prezzo chiesto conta nel suo giorno e nei roll_days - 1 successivi.
+        # Il giorno d va da start + d giorni (escluso) a start + d + 1 giorni (incluso): l'ultimo finisce adesso.
+        rolling = np.full((n, days), np.nan)
+        start = now - days * DAY
+        recent = asking & (ts > start - (roll_days - 1) * DAY) & (ts <= now)
+        day = (ts[recent] - start - 1) // DAY
+        shifted = np.concatenate([day + k for k in range(roll_days)])
+        groups = np.tile(cat[recent], roll_days) * days + shifted
+        values = np.tile(cents[recent], roll_days)
+        keep = (shifted >= 0) & (shifted < days)
+        keys, medians, _ = group_medians(groups[keep], values[keep])
+        rolling[keys // days, keys % days] = medians / 100
+
+        # Serie di ogni (ricerca, annuncio), in ordine di tempo
+        order = series_order(cat, rows["annuncio"], ts, evento) if len(rows) else np.empty(0, dtype=np.int64)
+        s_cat, s_ann, s_ts, s_prezzo, s_ev = cat[order], rows["annuncio"][order], ts[order], cents[order], evento[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (s_cat[1:] != s_cat[:-1]) | (s_ann[1:] != s_ann[:-1])
+        starts = np.flatnonzero(first)
+        pair_cat = s_cat[starts]
+
+        # Tempo di vendita: dal primo evento della serie al venduto (se la serie non comincia già venduta)
+        sold_ts = np.maximum.reduceat(np.where(s_ev == EVENT_SOLD, s_ts, -1), starts) if len(starts) else np.empty(0, np.int64)
+        sold = (sold_ts >= since) & (s_ev[starts] != EVENT_SOLD)
+        sold_keys, sold_seconds, sold_counts = group_medians(pair_cat[sold], sold_ts[sold] - s_ts[starts][sold])
+
+        # Ribassi: rispetto al prezzo precedente della stessa serie
+        in_window = s_ts >= since
+        is_drop = (s_ev == EVENT_DROP) & in_window & ~first
+        prev = np.roll(s_prezzo, 1)
+        drop_pct = np.where(is_drop & (prev > 0), (1 - s_prezzo / np.where(prev > 0, prev, 1)) * 100, 0.0)
+        seen = np.add.reduceat((s_ev != EVENT_SOLD) & in_window, starts) > 0 if len(starts) else np.empty(0, bool)
+        dropped = np.add.reduceat(is_drop, starts) > 0 if len(starts) else np.empty(0, bool)
+        listings = np.bincount(pair_cat[seen], minlength=n)
+        with_drops = np.bincount(pair_cat[dropped], minlength=n)
+        drops = np.bincount(s_cat[is_drop], minlength=n)
+        pct_keys, pct_medians, _ = group_medians(s_cat[is_drop], drop_pct[is_drop])
+
+        report = {}
+        for i, key in enumerate(cats):
+            report[names[int(key)]] = {
+                "rolling_median": rolling[i],
+                "listings": int(listings[i]),
+                "drop_rate": float(with_drops[i] / listings[i]) if listings[i] else 0.0,
+                "drops_per_listing": float(drops[i] / listings[i]) if listings[i] else 0.0,
+                "median_drop_pct": None,
+                "sold": 0,
+                "median_days_to_sell": None,
+            }
+        for key, value in zip(pct_keys, pct_medians):
+            report[names[int(cats[key])]]["median_drop_pct"] = float(value)
+        for key, value, count in zip(sold_keys, sold_seconds, sold_counts):
+            entry = report[names[int(cats[key])]]
+            entry["median_days_to_sell"], entry["sold"] = float(value / DAY), int(count)
+        return report
+
+    def export(self, path):
+        '''Scrive lo storico in un .npz compresso (una colonna per array, più la tabella hash -> nome
+        delle ricerche) da aprire con np.load per le analisi offline'''
+        names = self.names()
+        np.savez_compressed(
+            path, **{c: self.rows[c] for c in COLUMNS},
+            ricerche_hash=np.fromiter(names, dtype=np.int64, count=len(names)),
+            ricerche_nome=np.array(list(names.values()), dtype=str))
@@ -0,0 +1,236 @@
+import random
+import re
+import unicodedata
+import zlib
+from collections import namedtuple
+from hashlib import blake2b
+
+import numpy as np
+
+from link_index import text_key
+import persistence
+
+# Ripubblicazioni: chi vende spesso cancella l'annuncio e lo rimette con un link nuovo, magari un po' più basso.
+# Per non trattarlo come un annuncio mai visto teniamo un indice LSH delle firme MinHash dei titoli:
+# titolo normalizzato (minuscole, niente accenti né parole da bancarella come "vendo" o "ribasso", parole in ordine)
+# -> trigrammi di caratteri -> NUM_HASHES minimi -> BANDS bande da ROWS. Ogni banda, insieme alla località
+# e ai numeri del titolo (un "13" contro un "14" cambia modello anche se il resto è uguale), dà un secchiello:
+# due annunci ci finiscono insieme solo se titolo quasi uguale, stessi numeri e stessa città.
+# Per un annuncio nuovo si leggono solo i suoi BANDS secchielli (niente confronto con tutto annunci),
+# e i pochi candidati si confermano con la somiglianza stimata dalle firme e la fascia di prezzo.
+# Le tabelle (firme, lsh_secchielli, ripubblicati) le crea la migrazione 8 e durano KEEP_DAYS,
+# più degli annunci stessi: l'originale di solito sparisce (venduto/cancellato) prima che arrivi la copia.
+
+NUM_HASHES = 32
+BANDS, ROWS = 8, 4       # soglia LSH ~ (1/BANDS)^(1/ROWS) = 0.59 di somiglianza
+SIMILARITY = 0.75        # somiglianza stimata (quota di minimi uguali) per dire "è lo stesso oggetto"
+PRICE_BAND = 0.3         # la copia costa al massimo il 30% in meno (o in più) dell'originale
+MIN_SHINGLES = 8         # titoli troppo corti ("Bici") si somigliano tutti: niente rilevamento
+SHINGLE = 3
+KEEP_DAYS = 30
+STOPWORDS = {"vendo", "vendesi", "ribasso", "ribassato", "affare", "occasione", "urgente",
+             "trattabile", "prezzo", "scontato", "sconto", "offerta", "nuovo", "prezzaccio"}
+
+# Moltiplica-somma-sposta (Dietzfelbinger): h(x) = (a*x + b) >> 32 sui 64 bit, con a dispari.
+# Seme fisso: le firme finiscono nel DB e devono venire uguali a ogni avvio.
+_rnd = random.Random(20240501)
+_A = np.array([_rnd.getrandbits(64) | 1 for _ in range(NUM_HASHES)], dtype=np.uint64)[:, None]
+_B = np.array([_rnd.getrandbits(64) for _ in range(NUM_HASHES)], dtype=np.uint64)[:, None]
+_WORD = re.compile(r"[a-z0-9]+")
+
+Repost = namedtuple("Repost", "original previous price similarity")
+# original: il primo annuncio della catena; previous: l'ultima copia vista (quella da ritirare); price: il suo prezzo
+
+
+def normalize(text):
+    text = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode("ascii").lower()
+    return " ".join(sorted({w for w in _WORD.findall(text) if w not in STOPWORDS}))
+
+
+def numbers_key(text):
+    '''Hash delle parole con cifre di un titolo normalizzato (modelli, tagli, anni): devono essere le stesse'''
+    return text_key(" ".join(w for w in text.split() if any(c.isdigit() for c in w)))
+
+
+def shingles(text):
+    '''Trigrammi di caratteri di un titolo già normalizzato'''
+    text = f" {text} "
+    return {text[i:i + SHINGLE] for i in range(len(text) - SHINGLE + 1)}
+
+
+def signature(title, text=None):
+    '''Firma MinHash (NUM_HASHES uint32) del titolo, None se è troppo corto per dire qualcosa'''
+    grams = shingles(text if text is not None else normalize(title))
+    if len(grams) < MIN_SHINGLES:
+        return None
+    x = np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+    return ((_A * x[None, :] + _B) >> np.uint64(32)).min(axis=1).astype(np.uint32)
+
+
+def band_keys(firma, location, numbers):
+    '''Un secchiello per banda: hash a 64 bit di (località, numbers_key, banda, valori della banda)'''
+    prefix = normalize(location).encode("utf-8") + b"|" + numbers.to_bytes(8, "little", signed=True)
+    rows = firma.reshape(BANDS, ROWS)
+    return [int.from_bytes(blake2b(prefix + bytes([b]) + rows[b].tobytes(), digest_size=8).digest(), "little", signed=True)
+            for b in range(BANDS)]
+
+
+def features(title, location):
+    '''(firma, numbers_key, secchielli) di un annuncio, None se il titolo è troppo corto'''
+    text = normalize(title)
+    firma = signature(title, text)
+    if firma is None:
+        return None
+    numbers = numbers_key(text)
+    return firma, numbers, band_keys(firma, location, numbers)
+
+
+def similarity(a, b):
+    return float(np.count_nonzero(a == b)) / NUM_HASHES
+
+
+def same_price_band(price, old_price):
+    if not price or not old_price:
+        return not price and not old_price # senza prezzo tutti e due, o niente
+    return abs(price - old_price) <= PRICE_BAND * old_price
+
+
+def index_rows(listings, now=None):
+    '''Righe per firme e lsh_secchielli di [(link, titolo, prezzo, località)], o (..., ts) senza now'''
+    firme, secchielli = [], []
+    for link, title, price, location, *ts in listings:
+        found = features(title, location)
+        if found is None:
+            continue
+        firma, numbers, keys = found
+        key = text_key(link)
+        firme.append((key, link, int(now if now is not None else ts[0]), price, numbers, firma.tobytes(),
+                      np.array(keys, dtype=np.int64).tobytes()))
+        secchielli.extend((k, key) for k in keys)
+    return firme, secchielli
+
+
+def add(conn, listings, now=None):
+    '''Mette in indice degli annunci (dentro la transazione del chiamante). Per tanti annunci insieme
+    (la migrazione) i secchielli si scrivono in ordine di chiave: la B-tree cresce in coda invece che a caso.'''
+    firme, secchielli = index_rows(listings, now)
+    if len(secchielli) > 1000:
+        secchielli.sort()
+    conn.executemany("INSERT OR IGNORE INTO firme (chiave, link, ts, prezzo, numeri, firma, secchielli) VALUES (?, ?, ?, ?, ?, ?, ?)", firme)
+    conn.executemany("INSERT OR IGNORE INTO lsh_secchielli (secchiello, chiave) VALUES (?, ?)", secchielli)
+
+
+def link(conn, reposts, now):
+    '''Registra le ripubblicazioni confermate: {link: Repost}'''
+    conn.executemany(
+        "INSERT OR IGNORE INTO ripubblicati (link, originale, precedente, prezzo_precedente, somiglianza, ts) VALUES (?, ?, ?, ?, ?, ?)",
+        [(l, r.original, r.previous, r.price, r.similarity, int(now)) for l, r in reposts.items()])
+
+
+def expire(conn, now):
+    '''Via le firme (e i loro secchielli) più vecchie di KEEP_DAYS, e i collegamenti altrettanto vecchi'''
+    cutoff = int(now) - KEEP_DAYS * 86400
+    old = conn.execute("SELECT chiave, secchielli FROM firme WHERE ts < ?", (cutoff,)).fetchall()
+    conn.executemany("DELETE FROM lsh_secchielli WHERE secchiello = ? AND chiave = ?",
+                     [(int(k), key) for key, blob in old for k in np.frombuffer(blob, dtype=np.int64)])
+    conn.execute("DELETE FROM firme WHERE ts < ?", (cutoff,))
+    conn.execute("DELETE FROM ripubblicati WHERE ts < ?", (cutoff,))
+    return len(old)
+
+
+def settle(conn):
+    '''Le ripubblicazioni il cui originale è ancora in annunci: l'annuncio "sparito" poteva stare su una pagina
+    dopo, o in un'altra ricerca. Per ognuna guarda le ricerche attive che lo tenevano:
+    - una l'ha rivisto dopo il collegamento: è vivo, il collegamento si toglie (la copia resta un nuovo qualsiasi)
+    - tutte sono girate dopo il collegamento senza vederlo: è sparito davvero, va ritirato dal mercato
+    - altrimenti si aspetta il giro dopo.
+    Ritorna (originali da ritirare, copie confermate, copie che non lo erano).'''
+    gone, confirmed, live = [], [], []
+    for l, previous, seen, ran in conn.execute("""
+            SELECT r.link, r.precedente,
+                   MAX(m.ultimo_aggiornamento >= datetime(r.ts, 'unixepoch')),
+                   MIN(CASE WHEN c.nome IS NULL THEN 1 ELSE COALESCE(c.ultima_esecuzione, '') >= datetime(r.ts, 'unixepoch') END)
+            FROM ripubblicati r
+            JOIN annunci a ON a.link = r.precedente
+            LEFT JOIN annunci_ricerche m ON m.link = r.precedente
+            LEFT JOIN ricerche c ON c.nome = m.ricerca AND c.attiva = 1
+            GROUP BY r.link
+        """).fetchall():
+        if seen:
+            live.append(l)
+        elif ran:
+            gone.append(previous)
+            confirmed.append(l)
+    if live:
+        conn.executemany("DELETE FROM ripubblicati WHERE link = ?", [(l,) for l in live])
+        conn.executemany("UPDATE novita SET tipo = ?, prezzo_vecchio = NULL WHERE link = ? AND tipo = ?",
+                         [(persistence.EVENT_NEW, l, persistence.EVENT_REPOST) for l in live])
+    return list(dict.fromkeys(gone)), confirmed, live
+
+
+def find(conn, listings, page_links=(), seen_since=None):
+    '''Per gli annunci nuovi di una pagina [(link, titolo, prezzo, località)] ritorna (ripubblicati, tornati):
+    ripubblicati  {link: Repost} anche quelli già riconosciuti da un'altra ricerca
+    tornati       link di originali che avevamo dato per ripubblicati e invece sono ancora lì
+    I candidati presenti sulla stessa pagina, o visti da seen_since (epoch, l'inizio del giro) in poi,
+    sono annunci vivi tutti e due, non una copia. Gli altri li conferma (o no) settle a fine giro.'''
+    links = [l[0] for l in listings]
+    if not links:
+        return {}, set()
+    reposts, returned, indexed = {}, set(), set()
+    for part in persistence.chunks(links):
+        placeholders = ",".join("?" * len(part))
+        indexed.update(r[0] for r in conn.execute(f"SELECT link FROM firme WHERE link IN ({placeholders})", part))
+        for l, original, previous, price, sim in conn.execute(
+                f"SELECT link, originale, precedente, prezzo_precedente, somiglianza FROM ripubblicati WHERE link IN ({placeholders})", part):
+            reposts[l] = Repost(original, previous, price, sim)
+        returned.update(r[0] for r in conn.execute(
+            f"SELECT DISTINCT precedente FROM ripubblicati WHERE precedente IN ({placeholders})", part))
+
+    # Solo gli annunci mai visti passano dall'LSH
+    fresh = []
+    for l, title, price, location in listings:
+        if l in indexed:
+            continue
+        found = features(title, location)
+        if found is not None:
+            fresh.append((l, price, *found))
+    if not fresh:
+        return reposts, returned
+
+    buckets = {}
+    all_keys = list({k for *_rest, keys in fresh for k in keys})
+    for part in persistence.chunks(all_keys):
+        for bucket, key in conn.execute(
+                f"SELECT secchiello, chiave FROM lsh_secchielli WHERE secchiello IN ({','.join('?' * len(part))})", part):
+            buckets.setdefault(bucket, []).append(key)
+    wanted = list({key for keys in buckets.values() for key in keys})
+    candidates = {}
+    for part in persistence.chunks(wanted):
+        for key, l, price, numbers, firma, ts in conn.execute(
+                f"SELECT chiave, link, prezzo, numeri, firma, ts FROM firme WHERE chiave IN ({','.join('?' * len(part))})", part):
+            candidates[key] = (l, price, numbers, np.frombuffer(firma, dtype=np.uint32), ts)
+
+    page = set(page_links)
+    if seen_since is not None:
+        live = [c[0] for c in candidates.values()]
+        for part in persistence.chunks(live):
+            page.update(r[0] for r in conn.execute(
+                f"SELECT link FROM annunci WHERE link IN ({','.join('?' * len(part))}) AND ultimo_aggiornamento >= datetime(?, 'unixepoch')",
+                part + [int(seen_since)]))
+    for l, price, firma, numbers, keys in fresh:
+        best = None
+        for key in {k for b in keys for k in buckets.get(b, ())}:
+            if key not in candidates:
+                continue
+            other, other_price, other_numbers, other_firma, ts = candidates[key]
+            if other == l or other in page or other_numbers != numbers or not same_price_band(price, other_price):
+                continue
+            sim = similarity(firma, other_firma)
+            if sim >= SIMILARITY and (best is None or (sim, ts) > (best[1], best[2])):
+                best = (other, sim, ts, other_price)
+        if best is not None:
+            other, sim, _ts, other_price = best
+            root = conn.execute("SELECT originale FROM ripubblicati WHERE link = ?", (other,)).fetchone()
+            reposts[l] = Repost(root[0] if root else other, other, other_price, round(sim, 3))
+    return reposts, returned
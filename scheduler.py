@@ -0,0 +1,71 @@
+import heapq
+
+# Con una novità all'ora una ricerca viene controllata ogni ora, con sei ogni dieci minuti:
+# l'intervallo punta a trovare circa HITS_PER_POLL novità a ogni giro, entro [min, max].
+HITS_PER_POLL = 1.0
+SMOOTHING = 0.3 # peso dell'ultima osservazione nella media mobile esponenziale
+
+
+class SearchScheduler:
+    '''Coda a priorità delle ricerche: ognuna ha il suo prossimo turno in base a quante novità produce'''
+
+    def __init__(self, min_interval, max_interval):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.heap = []       # (quando, nome), con voci scadute scartate al volo
+        self.due = {}        # nome -> quando tocca davvero
+        self.rate = {}       # nome -> novità (nuovi + ribassi) all'ora, media mobile
+        self.last_run = {}   # nome -> epoch dell'ultima esecuzione
+
+    def interval(self, name):
+        rate = self.rate.get(name, 0.0)
+        if rate <= 0:
+            return self.max_interval
+        return min(self.max_interval, max(self.min_interval, 3600 * HITS_PER_POLL / rate))
+
+    def schedule(self, name, when):
+        self.due[name] = when
+        heapq.heappush(self.heap, (when, name))
+
+    def sync(self, rows, now):
+        '''Allinea la coda alle ricerche attive: righe (nome, ultima esecuzione in epoch, tasso)'''
+        active = set()
+        for name, last_run, rate in rows:
+            active.add(name)
+            if name in self.due:
+                continue
+            self.rate[name] = rate or 0.0
+            self.last_run[name] = last_run
+            # Mai eseguita: subito. Altrimenti riprendiamo da dove eravamo rimasti.
+            self.schedule(name, now if last_run is None else last_run + self.interval(name))
+        for gone in set(self.due) - active:
+            del self.due[gone]
+            self.rate.pop(gone, None)
+            self.last_run.pop(gone, None)
+
+    def pop_due(self, now):
+        '''Le ricerche il cui turno è arrivato. Escono anche da due: le rimette in coda record,
+        o, se il giro va storto prima, la prossima sync dall'ultima esecuzione salvata nel DB.'''
+        ready = []
+        while self.heap and self.heap[0][0] <= now:
+            when, name = heapq.heappop(self.heap)
+            if self.due.get(name) == when:
+                del self.due[name]
+                ready.append(name)
+        return ready
+
+    def next_due(self):
+        while self.heap and self.due.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+    def record(self, name, hits, now):
+        '''Aggiorna il tasso dopo un giro e rimette la ricerca in coda. Ritorna il nuovo tasso.'''
+        last = self.last_run.get(name)
+        # Al primo giro è tutto "nuovo": non ci dice niente sul ritmo della ricerca
+        if last is not None and now > last:
+            sample = hits / ((now - last) / 3600)
+            self.rate[name] = (1 - SMOOTHING) * self.rate.get(name, 0.0) + SMOOTHING * sample
+        self.last_run[name] = now
+        self.schedule(name, now + self.interval(name))
+        return self.rate.get(name, 0.0)
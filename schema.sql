@@ -1,6 +1,8 @@
 -- ==========================================
 -- SCHEMA DATABASE PER IL BOT DI RESELLING
 -- ==========================================
+-- Questa è la versione 1 (la base). Le modifiche successive
+-- stanno in migrations.py: non toccare questo file, aggiungi una migrazione.
 
 -- 1. Tabella delle Ricerche (Sostituisce searches.tracked)
 -- Qui salviamo cosa deve cercare il bot
@@ -10,7 +12,9 @@ CREATE TABLE IF NOT EXISTS ricerche (
     prezzo_min REAL DEFAULT 0,
     prezzo_max REAL DEFAULT 99999,
     attiva INTEGER DEFAULT 1,            -- 1 = Attiva, 0 = Pausa
-    ultima_esecuzione DATETIME
+    ultima_esecuzione DATETIME,
+    profondita_max INTEGER DEFAULT 5,    -- Quante pagine di risultati scansionare al massimo
+    tasso_novita REAL DEFAULT 0          -- Novità (nuovi + ribassi) all'ora, per lo scheduler adattivo
 );
 
 -- 2. Tabella degli Annunci (La memoria storica)
@@ -0,0 +1,69 @@
+import numpy as np
+
+from link_index import text_key
+
+# Punteggio di una pagina di risultati a colonne.
+# La pagina si legge una volta sola (PageColumns) e la usano tutte le ricerche che l'hanno chiesta;
+# per ogni ricerca filtro prezzo, nuovo/ribasso/invariato, z-score e fascia sono operazioni NumPy
+# su tutta la pagina (score_page), e al codice che scrive e notifica arrivano solo le righe da lavorare.
+
+# Fasce di z-score, dalla più forte: (soglia, etichetta)
+TIERS = ((-2.0, "🚨 AFFARE IMPERDIBILE"), (-1.5, "🔥 VERO AFFARE"), (-1.0, "💰 BUON PREZZO"))
+
+
+class PageColumns:
+    '''Gli annunci di una pagina: link, titoli e località come liste, prezzo, venduto e hash dei link come array.
+    L'hash (text_key) si fa qui una volta per link: le ricerche del gruppo lo combinano col proprio (LinkIndex.prices_for_keys).'''
+
+    def __init__(self, parsed):
+        self.rows = parsed # (link, titolo, venduto, località, prezzo) di parse_item
+        self.links = [r[0] for r in parsed]
+        self.keys = np.fromiter((text_key(link) for link in self.links), dtype=np.int64, count=len(parsed))
+        self.price = np.fromiter((r[4] for r in parsed), dtype=np.float64, count=len(parsed))
+        self.sold = np.fromiter((bool(r[2]) for r in parsed), dtype=bool, count=len(parsed))
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class PageScore:
+    '''Cosa fare di ogni riga della pagina per una ricerca (indici in PageColumns, in ordine di pagina)'''
+
+    def __init__(self, sold, new, drops, touched, old, z, tier):
+        self.sold = sold        # venduti
+        self.new = new          # nuovi per questa ricerca
+        self.drops = drops      # ribassi
+        self.touched = touched  # già noti, prezzo uguale o più alto
+        self.old = old          # prezzo vecchio, NaN per i nuovi (array lungo quanto la pagina)
+        self.z = z              # z-score, 0 senza statistiche
+        self.tier = tier        # indice in TIERS, -1 se non è un affare
+
+
+def score_page(cols, low_bound, high_bound, old_prices, mu, sigma):
+    '''old_prices(indici) -> prezzi già visti dalla ricerca per quelle righe (None se nuove):
+    lo chiediamo solo per le righe che passano il filtro prezzo'''
+    n = len(cols)
+    in_range = ~cols.sold & (cols.price >= low_bound) & (cols.price <= high_bound)
+    candidates = np.flatnonzero(in_range)
+
+    old = np.full(n, np.nan)
+    if len(candidates):
+        # None diventa NaN
+        old[candidates] = np.array(old_prices(candidates), dtype=np.float64)
+    known = ~np.isnan(old)
+    new = in_range & ~known
+    # NaN < x è sempre falso: i nuovi non finiscono mai tra i ribassi
+    drops = in_range & (cols.price < old)
+
+    z = (cols.price - mu) / sigma if sigma > 0 else np.zeros(n)
+    tier = np.full(n, -1)
+    if mu != 0:
+        # Dalla fascia più debole alla più forte: vince l'ultima soglia superata
+        for level in range(len(TIERS) - 1, -1, -1):
+            tier[new & (z <= TIERS[level][0])] = level
+    return PageScore(
+        sold=np.flatnonzero(cols.sold),
+        new=np.flatnonzero(new),
+        drops=np.flatnonzero(drops),
+        touched=np.flatnonzero(in_range & known & ~drops),
+        old=old, z=z, tier=tier)
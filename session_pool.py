@@ -0,0 +1,93 @@
+import itertools
+import time as t
+
+import metrics
+
+# Un pool di sessioni curl_cffi persistenti: ognuna col suo profilo di impersonation (fingerprint TLS/HTTP2
+# e User-Agent), i suoi cookie, le sue connessioni keep-alive e, se ci sono, il suo proxy.
+# Ogni ricerca prende una sessione per tutte le sue pagine, come farebbe un browser; una sessione che
+# fallisce più volte di fila (blocchi, timeout, proxy morto) viene chiusa e rifatta col profilo successivo.
+
+PROFILES = ("chrome110", "chrome116", "chrome120", "chrome124", "edge101", "safari17_0")
+RETIRE_AFTER = 3  # fallimenti di fila prima di rifare la sessione
+PICKS = ("round_robin", "lru")
+
+
+class PooledSession:
+    '''Un posto del pool: la sessione vera cambia quando viene rifatta, il posto resta'''
+
+    def __init__(self, slot, profile, proxy, session):
+        self.slot = slot
+        self.profile, self.proxy = profile, proxy
+        self.session = session
+        self.failures = 0        # di fila
+        self.generation = 0      # quante volte è stata rifatta
+        self.last_used = 0.0
+        self.requests = 0
+
+    def label(self):
+        proxy = f" via {self.proxy.split('@')[-1]}" if self.proxy else ""
+        return f"#{self.slot} {self.profile}{proxy}"
+
+
+class SessionPool:
+    '''size sessioni create da factory(profile, proxy), assegnate a giro (round_robin) o alla meno usata di recente (lru).
+    close(session) chiude subito quelle ritirate; senza (sessioni async) restano in retired finché non le chiude drain().'''
+
+    def __init__(self, factory, size, profiles=None, proxies=None, pick="round_robin", retire_after=RETIRE_AFTER, close=None):
+        if pick not in PICKS:
+            raise ValueError(f"pick deve essere uno tra {', '.join(PICKS)}")
+        self.factory, self.close = factory, close
+        self.profiles, self.proxies = tuple(profiles or PROFILES), tuple(proxies or ())
+        self.pick, self.retire_after = pick, retire_after
+        self.retired = []
+        self.entries = []
+        for slot in range(max(1, size)):
+            profile = self.profiles[slot % len(self.profiles)]
+            proxy = self.proxies[slot % len(self.proxies)] if self.proxies else None
+            self.entries.append(PooledSession(slot, profile, proxy, factory(profile, proxy)))
+        self.turn = itertools.cycle(self.entries)
+
+    def acquire(self):
+        if self.pick == "lru":
+            entry = min(self.entries, key=lambda e: e.last_used)
+        else:
+            entry = next(self.turn)
+        entry.last_used = t.monotonic()
+        return entry
+
+    def succeeded(self, entry):
+        entry.failures = 0
+        entry.requests += 1
+
+    def failed(self, entry, reason):
+        '''Un fallimento in più: al retire_after-esimo di fila la sessione viene rifatta'''
+        entry.failures += 1
+        entry.requests += 1
+        if entry.failures >= self.retire_after:
+            self.rebuild(entry, f"{entry.failures} fallimenti di fila, l'ultimo {reason}")
+
+    def rebuild(self, entry, reason):
+        '''Cookie e connessioni nuove, e il profilo dopo: quello vecchio potrebbe essere bruciato'''
+        old, old_label = entry.session, entry.label()
+        entry.generation += 1
+        entry.profile = self.profiles[(entry.slot + entry.generation) % len(self.profiles)]
+        entry.session = self.factory(entry.profile, entry.proxy)
+        entry.failures = 0
+        if self.close is not None:
+            self.close(old)
+        else:
+            self.retired.append(old)
+        print(f"   🔁 Sessione {old_label} ritirata ({reason}): ora {entry.label()}")
+        metrics.inc("sessions_retired_total")
+
+    def drain(self):
+        '''Tutte le sessioni, attive e ritirate, da chiudere (il pool non va più usato)'''
+        sessions = [e.session for e in self.entries] + self.retired
+        self.entries, self.retired = [], []
+        return sessions
+
+    def status(self):
+        sessions = ", ".join(f"{e.label()} ({e.requests} rich.)" for e in self.entries)
+        rebuilt = sum(e.generation for e in self.entries)
+        return f"🔁 {len(self.entries)} sessioni: {sessions}" + (f", {rebuilt} rifatte" if rebuilt else "")
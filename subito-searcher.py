@@ -1,10 +1,6 @@
 #!/usr/bin/env python3.7
-import numpy as np
-import random
 import argparse
-from contextlib import nullcontext
-import requests
-from bs4 import BeautifulSoup, Tag
+from contextlib import asynccontextmanager
 import json
 import os
 import platform
@@ -12,7 +8,28 @@ import time as t
 import sqlite3
 import sys
 from datetime import datetime, time
-from curl_cffi import requests # <-- The Stealth Engine
+from urllib.parse import urlsplit
+import persistence
+import db
+import metrics
+from next_data import extract_items
+from link_index import LinkIndex, text_key
+import market_stats
+from scheduler import SearchScheduler
+from page_cache import PageFingerprints, page_content, page_fingerprint
+from throttle import Blocked, CircuitOpen, Throttle
+# curl_cffi, NumPy, asyncio, requests (notifiche) e i lease si caricano al primo uso:
+# --list, --short_list, --delete e compagnia partono senza tirarsi dietro lo stack di scraping
+
+def page_count(value):
+    '''--maxPages: un intero da 1 in su, controllato una volta qui per il salvataggio e per il primo giro'''
+    try:
+        pages = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a number of pages: {value!r}")
+    if pages < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {pages}")
+    return pages
 
 # Use a session to keep cookies/connection alive like a real browser
 parser = argparse.ArgumentParser()
@@ -33,6 +50,10 @@ parser.add_argument('--list', dest='list', action='store_true', help="print a li
 parser.set_defaults(list=False)
 parser.add_argument('--short_list', dest='short_list', action='store_true', help="print a more compact list")
 parser.set_defaults(short_list=False)
+parser.add_argument('--find', dest='find', help="full-text search of title and town of the saved listings (\"\" for all); filter with --minPrice, --maxPrice, --in, --max_age")
+parser.add_argument('--in', dest='find_in', help="with --find: only listings of this search (and the price it saw); with --replay: only this search")
+parser.add_argument('--max_age', dest='max_age', help="with --find: only listings discovered in the last N days")
+parser.add_argument('--limit', dest='limit', help="with --find: print at most N listings")
 parser.add_argument('--tgoff', dest='tgoff', action='store_true', help="turn off telegram messages")
 parser.set_defaults(tgoff=False)
 parser.add_argument('--notifyoff', dest='win_notifyoff', action='store_true', help="turn off windows notifications")
@@ -43,33 +64,106 @@ parser.add_argument('--ntfy_server', dest='ntfy_server', help="Set ntfy server U
 parser.add_argument('--ntfy_topic', dest='ntfy_topic', help="Set ntfy topic for notifications")
 parser.add_argument('--ntfyoff', dest='ntfyoff', action='store_true', help="Turn off ntfy notifications")
 parser.set_defaults(ntfyoff=False)
+parser.add_argument('--notify_workers', dest='notify_workers', help="background workers per notification channel (default 2)")
+parser.set_defaults(notify_workers=2)
+parser.add_argument('--concurrent', dest='concurrent', action='store_true', help="refresh all searches concurrently (async engine)")
+parser.set_defaults(concurrent=False)
+parser.add_argument('--concurrency', dest='concurrency', help="max requests in flight with --concurrent (default 8)")
+parser.set_defaults(concurrency=8)
+parser.add_argument('--per_host', dest='per_host', help="max requests in flight per host with --concurrent (default 4)")
+parser.set_defaults(per_host=4)
+parser.add_argument('--rate', dest='rate', help="starting requests per second to each host; it adapts between a floor and --max_rate (default 0.33, split between --workers)")
+parser.set_defaults(rate=0.33)
+parser.add_argument('--max_rate', dest='max_rate', help="ceiling for the adaptive request rate per host (default 1, 2 with --concurrent; split between --workers)")
+parser.set_defaults(max_rate=None)
+parser.add_argument('--sessions', dest='sessions', help="keep-alive sessions to Subito, each with its own browser profile and cookies (default 4)")
+parser.set_defaults(sessions=4)
+parser.add_argument('--profiles', dest='profiles', help="comma-separated curl_cffi impersonation profiles for the sessions (default chrome110,chrome116,chrome120,chrome124,edge101,safari17_0)")
+parser.set_defaults(profiles=None)
+parser.add_argument('--proxies', dest='proxies', help="comma-separated proxy URLs, one per session in turn (default none)")
+parser.set_defaults(proxies=None)
+parser.add_argument('--session_pick', dest='session_pick', choices=["round_robin", "lru"], help="how searches get a session: round_robin or lru (least recently used)")
+parser.set_defaults(session_pick="round_robin")
+parser.add_argument('--repostoff', dest='reposts_off', action='store_true', help="turn off repost detection (a deleted and re-listed item counts as new)")
+parser.set_defaults(reposts_off=False)
+parser.add_argument('--maxPages', dest='maxPages', type=page_count, help="maximum number of result pages to scan for the query (default 5)")
+parser.add_argument('--early_stop', dest='early_stop', action='store_true', help="stop paging as soon as a page brings nothing new")
+parser.set_defaults(early_stop=False)
+parser.add_argument('--stop_fraction', dest='stop_fraction', help="with --early_stop, fraction of already known listings that makes a page 'quiet' (default 1.0)")
+parser.set_defaults(stop_fraction=1.0)
+parser.add_argument('--adaptive', dest='adaptive', action='store_true', help="daemon: poll each search more or less often depending on how many new listings it finds")
+parser.set_defaults(adaptive=False)
+parser.add_argument('--min_interval', dest='min_interval', help="with --adaptive, shortest interval between two runs of a search (default 60 seconds)")
+parser.set_defaults(min_interval=60)
+parser.add_argument('--max_interval', dest='max_interval', help="with --adaptive, longest interval between two runs of a search (default 1800 seconds)")
+parser.set_defaults(max_interval=1800)
+parser.add_argument('--workers', dest='workers', help="daemon: start N worker processes that split the searches between them (default 1)")
+parser.set_defaults(workers=1)
+parser.add_argument('--shard', dest='shard', action='store_true', help="daemon: only run the searches leased to this process, so several daemons can share one database")
+parser.set_defaults(shard=False)
+parser.add_argument('--lease_ttl', dest='lease_ttl', help="with --shard, seconds after which the searches of a silent worker go to the others (default 300)")
+parser.set_defaults(lease_ttl=300)
+parser.add_argument('--metrics_port', dest='metrics_port', help="expose Prometheus metrics on http://127.0.0.1:PORT/metrics")
+parser.add_argument('--serve', dest='serve', help="serve a read-only JSON API over the database on http://HOST:PORT/api/ (alone, or next to --daemon)")
+parser.add_argument('--serve_host', dest='serve_host', help="address for --serve (default 127.0.0.1)")
+parser.set_defaults(serve_host="127.0.0.1")
+parser.add_argument('--api_readers', dest='api_readers', help="read-only DB connections (and query threads) for --serve (default 4)")
+parser.set_defaults(api_readers=4)
+parser.add_argument('--archive', dest='archive', help="keep the __NEXT_DATA__ of every fetched results page, compressed, in this folder (for --replay)")
+parser.add_argument('--archive_codec', dest='archive_codec', choices=["gzip", "zstd"], help="compression of the archive: gzip, or zstd (needs the zstandard package)")
+parser.set_defaults(archive_codec="gzip")
+parser.add_argument('--archive_keep_days', dest='archive_keep_days', help="delete archive segments older than N days, 0 keeps everything (default 30)")
+parser.set_defaults(archive_keep_days=30)
+parser.add_argument('--replay', dest='replay', help="feed the cycles archived in this folder through parsing, scoring and the database, with no network, sleeps or notifications")
+parser.add_argument('--since', dest='since', help="with --replay: only pages archived from this date (YYYY-MM-DD or 'YYYY-MM-DD HH:MM')")
+parser.add_argument('--until', dest='until', help="with --replay: only pages archived before this date")
+parser.add_argument('--log_json', dest='log_json', help="write structured JSON events (one per search and per cycle) to this file, '-' for stdout")
+parser.add_argument('--check_stats', dest='check_stats', action='store_true', help="compare the incremental market stats with the exact computation")
+parser.set_defaults(check_stats=False)
+parser.add_argument('--market_report', dest='market_report', action='store_true', help="print price trends, drop frequency and time-to-sell of every search from the price history")
+parser.set_defaults(market_report=False)
+parser.add_argument('--export_history', dest='export_history', help="export the price history to a compressed NumPy file (.npz) for offline analysis")
 
 args = parser.parse_args()
 
-session = requests.Session()
+pool = None # sessioni curl_cffi (session_pool.SessionPool), le crea il primo fetch (get_pool)
 apiCredentials = dict()
 ntfyConfig = dict()
 ntfyConfigFile = "ntfy_config"
 dbFile = "searches.tracked"
 telegramApiFile = "telegram_api_credentials"
 
+MAX_PAGES = 5 # profondità di default di una ricerca
+MIN_RATE = 0.05 # richieste al secondo sotto cui il throttle non scende (poi ci pensa l'interruttore)
+MAX_RATE = 1.0 # tetto di default del throttle per host
+CONCURRENT_MAX_RATE = 2.0 # con --concurrent: più richieste in volo servono a poco se il secchio ne fa passare una al secondo
+FETCH_RETRIES = 3 # tentativi per pagina se Subito ci blocca o non risponde
+
 conn=None
 cursor=None
 #database connection
+link_index=None # link -> prezzo in memoria, lo carica solo chi fa scraping
+market=None # aggregati di mercato incrementali (market_stats.MarketStats)
+fingerprints=PageFingerprints() # impronta dell'ultimo contenuto di ogni (ricerca, pagina)
+notifier=None # dispatcher delle notifiche, parte al primo messaggio
+leases=None # con --shard, le ricerche assegnate a questo processo
+throttle=None # ritmo e interruttore per host, condiviso da tutte le ricerche del processo
+archive=None # con --archive, dove finiscono le pagine scaricate (archive.Archive)
+cycle_started=None # epoch dell'inizio del giro in corso: chi è stato visto da lì in poi non è l'originale di una copia
+held_deals={} # link -> notifica d'affare trattenuta perché sembrava una ripubblicazione (reposts.settle decide)
 
 # Windows notifications
 if platform.system() == "Windows":
     from win10toast import ToastNotifier
     toaster = ToastNotifier()
 
-def connect_database():
+def connect_database(readonly=False):
     global conn, cursor # Dichiariamo le globali prima
     
     try:
-        # Proviamo a connetterci
-        conn = sqlite3.connect('annunci.db')
-        conn.execute("PRAGMA foreign_keys = ON;")
-        conn.row_factory = sqlite3.Row 
+        # Proviamo a connetterci: chi deve solo leggere (--list, --short_list) apre in sola lettura
+        # e così non disturba il demone che sta scrivendo
+        conn = db.open_reader() if readonly else db.open_writer()
         cursor = conn.cursor()
         # Test rapido per vedere se il DB risponde davvero
         conn.execute("SELECT 1")
@@ -83,6 +177,196 @@ def connect_database():
 
 
 
+def curl():
+    '''curl_cffi.requests, importato solo da chi scarica davvero'''
+    from curl_cffi import requests # <-- The Stealth Engine
+    return requests
+
+def comma_list(value):
+    return [v.strip() for v in value.split(",") if v.strip()] if value else None
+
+def new_pool(factory, close=None):
+    from session_pool import SessionPool
+    return SessionPool(factory, int(args.sessions), comma_list(args.profiles), comma_list(args.proxies),
+                       pick=args.session_pick, close=close)
+
+def get_pool():
+    '''Use sessions to keep cookies/connections alive like real browsers: quelle sincrone durano quanto il processo'''
+    global pool
+    if pool is None:
+        requests = curl()
+        pool = new_pool(lambda profile, proxy: requests.Session(impersonate=profile, proxy=proxy),
+                        close=lambda session: session.close())
+    return pool
+
+def async_pool():
+    '''Le sessioni async sono legate al loop del giro (refresh_async): le chiude lui alla fine'''
+    requests = curl()
+    return new_pool(lambda profile, proxy: requests.AsyncSession(impersonate=profile, proxy=proxy,
+                                                                 max_clients=int(args.per_host)))
+
+def rate_limits():
+    '''(--rate, --max_rate) di questo processo: il budget per host è del processo, non della macchina'''
+    if args.max_rate is not None:
+        max_rate = float(args.max_rate)
+    else:
+        max_rate = CONCURRENT_MAX_RATE if args.concurrent else MAX_RATE
+    return float(args.rate), max_rate
+
+def get_throttle():
+    global throttle
+    if throttle is None:
+        rate, max_rate = rate_limits()
+        throttle = Throttle(rate, MIN_RATE, max_rate)
+    return throttle
+
+def print_fetch_status():
+    '''Ritmo e interruttore per host, come stanno le sessioni (quelle async le stampa refresh_async) e l'archivio'''
+    if throttle is not None:
+        for line in throttle.status():
+            print(line)
+    if pool is not None:
+        print(pool.status())
+    if archive is not None:
+        print(archive.status())
+
+def open_archive():
+    global archive
+    from archive import Archive
+    try:
+        archive = Archive(args.archive, args.archive_codec, keep_days=int(args.archive_keep_days))
+    except ImportError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    print(f"🗄️ Archivio pagine ({args.archive_codec}) in {args.archive}")
+
+def archive_page(url, page, runs, response, items_list):
+    '''Con --archive: la pagina così com'è arrivata, per chi la lavora ancora (il replay rifà lo stesso giro)'''
+    if archive is not None:
+        archive.append(url, page, [run.name for run in runs if run.wants(page)], response.content, items_list)
+
+def record_response(sessions, entry, page_url, response, sent):
+    '''Passa la risposta al throttle e al pool: True se si può usare, False se era un blocco da ritentare'''
+    count_response(response)
+    usable = get_throttle().record(page_url, sent, response.status_code, response.headers, response.content)
+    if usable:
+        sessions.succeeded(entry)
+    else:
+        sessions.failed(entry, str(response.status_code))
+    return usable
+
+def record_error(sessions, entry, page_url, error, sent):
+    '''Timeout o connessione caduta: per il pool è un fallimento, per il throttle il timeout è un blocco
+    e la connessione caduta un errore dell'host (rallenta, e se era la richiesta di prova riapre l'interruttore)'''
+    reason = "timeout" if isinstance(error, curl().exceptions.Timeout) else "connessione"
+    if reason == "timeout":
+        get_throttle().record(page_url, sent, error=reason)
+    else:
+        get_throttle().failed(page_url, sent, reason)
+    sessions.failed(entry, reason)
+    return reason
+
+def fetch_page(entry, page_url):
+    '''Scarica una pagina con la sessione entry al ritmo del throttle. Sui blocchi (429/403/challenge), i timeout
+    e le connessioni cadute riprova; solleva Blocked finiti i tentativi, CircuitOpen se l'host ci ha chiuso fuori.'''
+    requests = curl()
+    reason = None
+    for _ in range(FETCH_RETRIES):
+        get_throttle().wait(page_url)
+        sent = t.monotonic()
+        try:
+            with metrics.timed("fetch"):
+                # entry.session e non una variabile: se viene rifatta, il tentativo dopo usa quella nuova
+                response = entry.session.get(page_url, headers=FETCH_HEADERS, timeout=20)
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            reason = record_error(get_pool(), entry, page_url, e, sent)
+            continue
+        if record_response(get_pool(), entry, page_url, response, sent):
+            response.raise_for_status()
+            return response
+        reason = str(response.status_code)
+    raise Blocked(f"pagina non scaricata dopo {FETCH_RETRIES} tentativi ({reason})")
+
+async def fetch_page_async(sessions, entry, limiter, page_url):
+    '''Come fetch_page: l'attesa del throttle è fuori dallo slot, mentre questa ricerca aspetta le altre usano la banda'''
+    requests = curl()
+    reason = None
+    for _ in range(FETCH_RETRIES):
+        await get_throttle().wait_async(page_url)
+        sent = t.monotonic()
+        try:
+            async with limiter.slot(page_url):
+                with metrics.timed("fetch"):
+                    response = await entry.session.get(page_url, headers=FETCH_HEADERS, timeout=20)
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            reason = record_error(sessions, entry, page_url, e, sent)
+            continue
+        if record_response(sessions, entry, page_url, response, sent):
+            response.raise_for_status()
+            return response
+        reason = str(response.status_code)
+    raise Blocked(f"pagina non scaricata dopo {FETCH_RETRIES} tentativi ({reason})")
+
+def load_link_index():
+    '''Carica una volta sola link e prezzi di annunci in memoria'''
+    global link_index
+    link_index = LinkIndex.load(conn)
+    print(f"🗂️ Indice annunci in memoria: {len(link_index)} link")
+
+def load_market_stats():
+    '''Carica gli aggregati di mercato (li ricostruisce da annunci la prima volta)'''
+    global market
+    market = market_stats.MarketStats(conn)
+
+def format_stats(stats):
+    if stats is None:
+        return "n/d"
+    return f"{stats['mu']:.2f}€ (σ:{stats['sigma']:.1f}, Q1:{stats['min_alert']:.0f})"
+
+def check_market_stats():
+    '''Controllo di coerenza: aggregati incrementali contro il calcolo esatto con NumPy'''
+    cursor.execute("SELECT nome FROM ricerche")
+    ricerche = cursor.fetchall()
+    broken = 0
+    for r in ricerche:
+        ok, fast, exact = market.check(r['nome'])
+        print(f"{'✅' if ok else '❌'} {r['nome']}: incrementale {format_stats(fast)} | esatto {format_stats(exact)}")
+        broken += not ok
+    if broken:
+        print(f"⚠️ {broken} categorie fuori tolleranza: ricostruisco gli aggregati.")
+        market.rebuild()
+
+def load_price_history():
+    '''Storico prezzi in memoria a colonne (NumPy si carica solo qui)'''
+    from price_history import PriceHistory
+    history = PriceHistory(conn)
+    start = t.perf_counter()
+    rows = history.refresh()
+    print(f"🗃️ Storico prezzi: {rows} righe caricate in {t.perf_counter() - start:.2f}s")
+    return history
+
+def print_market_report():
+    '''Andamento dei prezzi, ribassi e tempi di vendita di tutte le ricerche, calcolati in un passaggio solo'''
+    report = load_price_history().analyze()
+    if not report:
+        print("\n📭 Storico prezzi vuoto.")
+        return
+    for name, s in sorted(report.items()):
+        medians = [m for m in s['rolling_median'] if m == m] # via i giorni senza prezzi (NaN)
+        trend = f"{medians[-1]:.0f}€" if medians else "n/d"
+        if len(medians) > 7:
+            trend += f" ({(medians[-1] / medians[-8] - 1) * 100:+.1f}% in 7 giorni)"
+        drop = f", -{s['median_drop_pct']:.0f}% in mediana" if s['median_drop_pct'] is not None else ""
+        sell = f"{s['median_days_to_sell']:.1f} giorni ({s['sold']} venduti)" if s['sold'] else "n/d"
+        print(f"\n📊 {name}: mediana {trend}")
+        print(f"   annunci {s['listings']}, con ribasso {s['drop_rate'] * 100:.0f}% ({s['drops_per_listing']:.2f} ribassi/annuncio{drop})")
+        print(f"   tempo di vendita: {sell}")
+
+def export_price_history(path):
+    history = load_price_history()
+    history.export(path)
+    print(f"💾 Storico prezzi esportato in {path}")
+
 def load_api_credentials():
     '''A function to load the telegram api credentials from the json file'''
     global apiCredentials
@@ -104,38 +388,87 @@ def load_ntfy_config():
         ntfyConfig = json.load(file)
 
 def print_queries():
-    '''Una funzione per stampare le ricerche e i relativi annunci dal DB'''
-    # 1. Prendiamo tutte le ricerche salvate
-    cursor.execute("SELECT nome, url FROM ricerche")
-    ricerche = cursor.fetchall()
-
-    if not ricerche:
+    '''Una funzione per stampare le ricerche e i relativi annunci dal DB.
+    Una query sola, letta riga per riga dal cursore: la memoria non cresce con gli annunci'''
+    # Tutte le ricerche (anche quelle senza annunci, LEFT JOIN) con gli annunci collegati, anche quelli trovati pure da altre ricerche
+    rows = conn.execute("""
+        SELECT r.nome, r.url, a.titolo, m.prezzo, a.localita, a.link
+        FROM ricerche r
+            LEFT JOIN annunci_ricerche m ON m.ricerca = r.nome
+            LEFT JOIN annunci a ON a.link = m.link
+        ORDER BY r.rowid, m.link
+    """)
+
+    current = None
+    for row in rows:
+        if row['nome'] != current:
+            current = row['nome']
+            print(f"\nsearch: {row['nome']}")
+            print(f"query url: {row['url']}")
+            if row['link'] is None:
+                print("  (Nessun annuncio trovato per questa ricerca)")
+        if row['link'] is not None:
+            # Stampiamo i dati proprio come facevi prima
+            print(f"\n {row['titolo']} : {row['prezzo']} --> {row['localita']}")
+            print(f"  {row['link']}")
+
+    if current is None:
         print("\n📭 Nessuna ricerca tracciata nel database.")
-        return
 
-    for r in ricerche:
-        nome_ricerca = r['nome']
-        url_ricerca = r['url']
-        
-        print(f"\nsearch: {nome_ricerca}")
-        print(f"query url: {url_ricerca}")
-
-        # 2. Per ogni ricerca, prendiamo gli annunci collegati (JOIN mentale)
-        cursor.execute("""
-            SELECT titolo, prezzo, localita, link 
-            FROM annunci 
-            WHERE categoria = ?
-        """, (nome_ricerca,))
-        
-        annunci = cursor.fetchall()
-
-        if not annunci:
-            print("  (Nessun annuncio trovato per questa ricerca)")
-        else:
-            for a in annunci:
-                # Stampiamo i dati proprio come facevi prima
-                print(f"\n {a['titolo']} : {a['prezzo']} --> {a['localita']}")
-                print(f"  {a['link']}")
+def fts_query(text):
+    '''Il testo dell'utente come query FTS5: ogni parola deve esserci (tra virgolette, così "3080-ti" o "i7,"
+    non sono sintassi), e una parola che finisce con * vale come prefisso'''
+    terms = []
+    for word in text.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*")
+        if word:
+            terms.append('"' + word.replace('"', '""') + '"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+def find_listings(text, min_price=None, max_price=None, search=None, max_age=None, limit=None):
+    '''--find: annunci salvati che contengono le parole di text (nel titolo o nella località), con i filtri.
+    Le righe si stampano mentre arrivano dal cursore; con il testo in ordine di pertinenza, senza dal più recente.'''
+    query = fts_query(text or "")
+    # Con --in il prezzo è quello visto da quella ricerca
+    price = "m.prezzo" if search is not None else "a.prezzo"
+    sql = f"SELECT a.titolo, {price} AS prezzo, a.localita, a.link, a.categoria, a.data_scoperta FROM "
+    sql += "annunci_fts JOIN annunci a ON a.id = annunci_fts.rowid" if query else "annunci a"
+    where, params = [], []
+    if search is not None:
+        sql += " JOIN annunci_ricerche m ON m.link = a.link AND m.ricerca = ?"
+        params.append(search)
+    if query:
+        where.append("annunci_fts MATCH ?")
+        params.append(query)
+    low_bound, high_bound = price_bounds(min_price, max_price)
+    if low_bound > 0:
+        where.append(f"{price} >= ?")
+        params.append(low_bound)
+    if high_bound != float('inf'):
+        where.append(f"{price} <= ?")
+        params.append(high_bound)
+    if max_age is not None:
+        where.append("a.data_scoperta >= datetime('now', ?)")
+        params.append(f"-{int(max_age)} days")
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY annunci_fts.rank" if query else " ORDER BY a.id DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(int(limit))
+
+    found = 0
+    try:
+        for row in conn.execute(sql, params):
+            found += 1
+            print(f"\n [{row['categoria']}] {row['titolo']} : {row['prezzo']} --> {row['localita']} (dal {(row['data_scoperta'] or '?')[:10]})")
+            print(f"  {row['link']}")
+    except sqlite3.OperationalError as e:
+        print(f"❌ Ricerca non valida: {e}")
+        return 0
+    print(f"\n🔎 {found} annunci" + (f' per "{text}"' if text else ""))
+    return found
 
 
 # printing a compact list of trackings
@@ -171,40 +504,78 @@ def print_sitrep():
         
         print("\n")
 
+@metrics.instrument("cleanup")
 def cleanup_old_annunci():
     '''Removes ads older than 30 days to keep the DB light'''
     try:
-        # We target the 'ultimo_aggiornamento' column
-        cursor.execute("DELETE FROM annunci WHERE ultimo_aggiornamento < datetime('now', '-30 days')")
-        conn.commit()
+        # Prima togliamo dagli aggregati chi è uscito dalla finestra dei 21 giorni
+        if market is not None:
+            market.expire()
+
+        # We target the 'ultimo_aggiornamento' column: prima le ricerche che non vedono più un annuncio,
+        # poi gli annunci che non vede più nessuno
+        stale = []
+        with persistence.write_transaction(conn):
+            if link_index is not None:
+                cursor.execute("SELECT ricerca, link FROM annunci_ricerche WHERE ultimo_aggiornamento < datetime('now', '-30 days')")
+                stale = [(r['ricerca'], r['link']) for r in cursor.fetchall()]
+            # Il feed e i giri dell'API tengono 30 giorni anche loro
+            cursor.execute("DELETE FROM novita WHERE ts < CAST(strftime('%s', 'now', '-30 days') AS INTEGER)")
+            cursor.execute("DELETE FROM giri WHERE fine < CAST(strftime('%s', 'now', '-30 days') AS INTEGER)")
+            cursor.execute("DELETE FROM annunci_ricerche WHERE ultimo_aggiornamento < datetime('now', '-30 days')")
+            cursor.execute("DELETE FROM annunci WHERE ultimo_aggiornamento < datetime('now', '-30 days')")
+            removed = cursor.rowcount
+            if not args.reposts_off:
+                import reposts
+                reposts.expire(conn, t.time())
+
+        # L'indice in memoria va riallineato solo dopo il commit
+        for search, link in stale:
+            link_index.discard(search, link)
         
-        if cursor.rowcount > 0:
-            print(f"🧹 Cleanup: Rimossi {cursor.rowcount} vecchi annunci che prendevano polvere.")
+        if removed > 0:
+            print(f"🧹 Cleanup: Rimossi {removed} vecchi annunci che prendevano polvere.")
     except Exception as e:
         print(f"❌ Errore durante il cleanup: {str(e)}")
 
-def refresh(notify):
-    '''Sveglia il bot e gli fa controllare tutte le ricerche attive nel DB'''
+def active_searches():
+    '''Le ricerche che abbiamo segnato come 'attive' nel DB'''
+    cursor.execute("SELECT nome, url, prezzo_min, prezzo_max, profondita_max FROM ricerche WHERE attiva = 1")
+    return cursor.fetchall()
+
+def record_run(name):
+    '''Segna in ricerche quando è girata l'ultima volta'''
+    with persistence.write_transaction(conn):
+        cursor.execute("UPDATE ricerche SET ultima_esecuzione = CURRENT_TIMESTAMP WHERE nome = ?", (name,))
+
+@metrics.instrument("refresh")
+def refresh(notify, ricerche=None):
+    '''Sveglia il bot e gli fa controllare tutte le ricerche attive nel DB (o solo quelle passate).
+    Ritorna quante novità (nuovi + ribassi) ha trovato ogni ricerca.'''
+    global cycle_started
     cleanup_old_annunci()
+    started = cycle_started = t.time()
+    if archive is not None:
+        archive.begin_cycle(started)
+    hits = {}
+    requests = curl()
     try:
         # 1. Chiediamo al DB solo le ricerche che abbiamo segnato come 'attive'
-        cursor.execute("SELECT nome, url, prezzo_min, prezzo_max FROM ricerche WHERE attiva = 1")
-        ricerche = cursor.fetchall()
+        if ricerche is None:
+            ricerche = active_searches()
 
         if not ricerche:
             print(f"{datetime.now().strftime('%H:%M:%S')} - 💤 Nessuna ricerca attiva nel DB.")
-            return
-
-        # 2. Un unico ciclo per lanciarle tutte
-        for r in ricerche:
-            # Passiamo i dati alla funzione run_query (che abbiamo già adattato)
-            run_query(
-                url=r['url'], 
-                name=r['nome'], 
-                notify=notify, 
-                min_price=r['prezzo_min'], 
-                max_price=r['prezzo_max']
-            )
+            return hits
+
+        # 2. Un unico ciclo per lanciarle tutte (quelle con lo stesso URL insieme)
+        for url, runs in plan_fetches(ricerche):
+            found = run_shared(url, runs, notify)
+            hits.update(found)
+            for name in found:
+                record_run(name)
+        persistence.record_cycle(conn, started, len(hits), sum(hits.values()))
+        settle_reposts()
 
     except requests.exceptions.ConnectionError:
         print(f"{datetime.now().strftime('%Y-%m-%d, %H:%M:%S')} - 🌐 Errore di connessione (Check internet!)")
@@ -213,6 +584,7 @@ def refresh(notify):
     except Exception as e:
         # Usiamo str(e) perché a volte printare l'oggetto Exception direttamente dà errore
         print(f"{datetime.now().strftime('%Y-%m-%d, %H:%M:%S')} - 🔥 Errore imprevisto: {str(e)}")
+    return hits
 
 def delete(toDelete):
     '''Elimina una ricerca e tutti i suoi annunci dal DB in un colpo solo'''
@@ -220,10 +592,29 @@ def delete(toDelete):
         # 1. Eseguiamo il comando DELETE
         # Grazie a ON DELETE CASCADE, eliminando la ricerca cancelliamo 
         # automaticamente anche tutti gli annunci in 'annunci' legati a quel nome.
-        cursor.execute("DELETE FROM ricerche WHERE nome = ?", (toDelete,))
+        # Quelli che vede anche un'altra ricerca però restano: prima li passiamo a lei.
+        # Tutto in una transazione corta: se il demone sta scrivendo aspettiamo il nostro turno
+        cascaded = []
+        with persistence.write_transaction(conn):
+            if link_index is not None:
+                cursor.execute("SELECT link FROM annunci_ricerche WHERE ricerca = ?", (toDelete,))
+                cascaded = [r['link'] for r in cursor.fetchall()]
+            cursor.execute("""
+                UPDATE annunci SET categoria = (
+                    SELECT m.ricerca FROM annunci_ricerche m WHERE m.link = annunci.link AND m.ricerca != :nome LIMIT 1)
+                WHERE categoria = :nome
+                    AND EXISTS (SELECT 1 FROM annunci_ricerche m WHERE m.link = annunci.link AND m.ricerca != :nome)
+            """, {"nome": toDelete})
+            cursor.execute("DELETE FROM ricerche WHERE nome = ?", (toDelete,))
+            market_stats.forget_category(conn, toDelete)
+            conn.execute("DELETE FROM storico_prezzi WHERE ricerca = ?", (text_key(toDelete),))
         
-        # 2. Rendiamo la modifica permanente
-        conn.commit()
+        # 2. Commit fatto: riallineiamo la memoria
+        if market is not None:
+            market.forget(toDelete)
+        for link in cascaded:
+            link_index.discard(toDelete, link)
+        fingerprints.forget(toDelete)
 
         # 3. Controlliamo se abbiamo effettivamente segato qualcosa
         if cursor.rowcount > 0:
@@ -234,7 +625,7 @@ def delete(toDelete):
     except Exception as e:
         print(f"❌ Errore durante l'eliminazione di {toDelete}: {str(e)}")
 
-def add(url, name, minPrice, maxPrice):
+def add(url, name, minPrice, maxPrice, maxPages=None):
     '''Aggiunge o aggiorna una ricerca nel database SQL'''
     try:
         # 1. Pulizia dei prezzi (Sanitization)
@@ -249,25 +640,31 @@ def add(url, name, minPrice, maxPrice):
         except ValueError:
             MP = 99999.0
 
+        depth = maxPages if maxPages is not None else MAX_PAGES
+
         # 2. Il comando magico: INSERT OR REPLACE
         # Se 'name' esiste già, SQL sovrascrive la riga. Se non esiste, la crea.
         # È molto più veloce del vecchio queries.get(name) + delete(name)
-        cursor.execute("""
-            INSERT OR REPLACE INTO ricerche (nome, url, prezzo_min, prezzo_max, attiva)
-            VALUES (?, ?, ?, ?, 1)
-        """, (name, url, mP, MP))
-
-        # 3. Rendiamo il tutto permanente
-        conn.commit()
+        # 3. Transazione corta: il commit la rende permanente
+        with persistence.write_transaction(conn):
+            cursor.execute("""
+                INSERT OR REPLACE INTO ricerche (nome, url, prezzo_min, prezzo_max, attiva, profondita_max)
+                VALUES (?, ?, ?, ?, 1, ?)
+            """, (name, url, mP, MP, depth))
         
         print(f"✅ Ricerca '{name}' configurata! Il bot la monitorerà al prossimo refresh.")
 
     except Exception as e:
         print(f"❌ Errore durante l'aggiunta al database: {str(e)}")
+@metrics.instrument("market_stats")
 def get_market_int(category):
+    # Se gli aggregati incrementali sono caricati la risposta è O(1)
+    if market is not None:
+        return market.get(category)
+
     query="""
-        SELECT prezzo FROM annunci
-        WHERE categoria = ?
+        SELECT prezzo FROM annunci_ricerche
+        WHERE ricerca = ?
             AND ultimo_aggiornamento > datetime('now', '-21 days')
         ORDER BY ultimo_aggiornamento DESC;
 
@@ -276,6 +673,7 @@ def get_market_int(category):
     rows=cursor.fetchall()
     if len(rows)<20:
         return None
+    import numpy as np
     prezzi = np.sort(np.array([r['prezzo'] for r in rows]))
 
     #Quartile 
@@ -293,130 +691,633 @@ def get_market_int(category):
         "min_alert":q1,
     }
 
-def run_query(url, name, notify, min_price, max_price):
-    '''Versione Pro: Scansione multi-pagina (1-5) con logica Z-Score'''
-    timestamp = datetime.now().strftime('%H:%M:%S')
-    print(f" {timestamp} - 🕵️ Caccia aperta (5 pag) per: \"{name}\"")
+FETCH_HEADERS = {"Accept-Language": "it-IT,it;q=0.9", "Cache-Control": "no-cache"}
+
+def build_page_url(url, page):
+    '''Costruisce l'URL di una pagina di risultati con paginazione e cache-buster'''
+    connector = "&" if "?" in url else "?"
+    return f"{url}{connector}o={page}&t={int(t.time())}"
+
+def price_bounds(min_price, max_price):
+    '''Filtri di budget: "null" (o None) vuol dire nessun limite'''
+    low_bound = float(min_price) if min_price is not None and str(min_price).lower() != "null" else 0
+    high_bound = float(max_price) if max_price is not None and str(max_price).lower() != "null" else float('inf')
+    return low_bound, high_bound
+
+def load_market(name):
+    '''Analisi mercato: la facciamo una volta prima del giro pagine'''
+    stats = get_market_int(name)
+    mu = stats['mu'] if stats else 0
+    sigma = stats['sigma'] if stats else 0
+    status_stats = f"{mu:.2f}€ (σ:{sigma:.1f})" if mu > 0 else "Inizializzazione..."
+    print(f"   📊 Statistiche Mercato: {status_stats}")
+    return mu, sigma
+
+def parse_item(product):
+    '''Tira fuori i campi che ci servono da un annuncio del JSON di Subito'''
+    link = product.get('urls', {}).get('default', '')
+    title = product.get('subject', 'No Title')
+    is_sold = product.get('sold', False)
+    location = product.get('geo', {}).get('town', {}).get('value', 'Unknown')
 
-    msg = [] # Lista notifiche unica per tutte le pagine
+    try:
+        raw_p = product.get('features', {}).get('/price', {}).get('values', [{}])[0].get('key')
+        price = int(raw_p) if raw_p else 0
+    except: price = 0
+
+    return link, title, is_sold, location, price
+
+class SearchRun:
+    '''Una ricerca dentro un giro: filtri prezzo, mercato, notifiche e novità raccolte pagina per pagina'''
+
+    def __init__(self, name, min_price, max_price, max_pages=MAX_PAGES):
+        self.name = name
+        self.low_bound, self.high_bound = price_bounds(min_price, max_price)
+        self.max_pages = max_pages
+        self.mu = self.sigma = 0
+        self.msg = [] # Lista notifiche unica per tutte le pagine
+        self.hits = 0 # nuovi + ribassi, li usa lo scheduler adattivo
+        self.done = False # con --early_stop: ha già trovato una pagina tranquilla
+
+    @classmethod
+    def from_row(cls, r):
+        return cls(r['nome'], r['prezzo_min'], r['prezzo_max'], r['profondita_max'] or MAX_PAGES)
+
+    def wants(self, page):
+        return not self.done and page <= self.max_pages
+
+def plan_fetches(ricerche):
+    '''Raggruppa le ricerche con lo stesso URL: ogni pagina si scarica e si legge una volta sola
+    e poi passa a tutte, ognuna con i suoi filtri. Ritorna [(url, [SearchRun, ...])].'''
+    groups = {}
+    for r in ricerche:
+        groups.setdefault(r['url'].strip(), []).append(SearchRun.from_row(r))
+    shared = sum(len(runs) - 1 for runs in groups.values())
+    if shared:
+        print(f"🔗 {shared} ricerche hanno lo stesso URL di un'altra: le loro pagine le scarichiamo una volta sola")
+    return list(groups.items())
+
+def old_prices_for(name, cols):
+    '''Prezzi visti da una ricerca per delle righe della pagina: dall'indice in memoria se c'è
+    (con gli hash dei link già fatti da PageColumns), altrimenti una sola query per tutta la pagina'''
+    if link_index is not None:
+        return lambda rows: link_index.prices_for_keys(name, cols.keys[rows])
+    def from_db(rows):
+        links = [cols.links[i] for i in rows]
+        prices = persistence.known_prices(conn, name, links)
+        return [prices.get(link) for link in links]
+    return from_db
+
+def plain_price(value):
+    '''I prezzi dagli array sono float: 120.0 torna 120 come nei messaggi di sempre'''
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+def find_reposts(cols, rows):
+    '''I nuovi di una pagina che sono copie di annunci già visti (reposts.find), se il rilevamento è acceso.
+    Ritorna (ripubblicati, tornati, annunci da mettere in indice).'''
+    if args.reposts_off or not len(rows):
+        return {}, set(), []
+    import reposts
+    listings = [(cols.rows[i][0], cols.rows[i][1], cols.rows[i][4], cols.rows[i][3]) for i in rows]
+    with metrics.timed("reposts"):
+        found, returned = reposts.find(conn, listings, cols.links, cycle_started)
+    return found, returned, listings
+
+def process_items(cols, run):
+    '''Lavora gli annunci di una pagina (scoring.PageColumns) per una ricerca e scrive tutto in una transazione.
+    Filtro prezzo, nuovi, ribassi e z-score li calcola score_page su tutta la pagina insieme:
+    qui arrivano solo le righe da scrivere o notificare.
+    Le notifiche finiscono in run.msg solo se il commit è andato a buon fine.'''
+    from scoring import TIERS, score_page
+    name, mu = run.name, run.mu
+    batch = persistence.PageBatch(name)
+    scored = score_page(cols, run.low_bound, run.high_bound, old_prices_for(name, cols), mu, run.sigma)
+
+    # Gestione Venduti
+    for i in scored.sold:
+        batch.sell(cols.links[i])
+
+    # Ripubblicazioni: un "nuovo" che è la copia di uno già visto non è un affare nuovo
+    reposts, returned, batch.fresh = find_reposts(cols, scored.new)
+    held = {}
+
+    # Nuovi e ribassi in ordine di pagina, come arrivano le notifiche
+    drops = set(scored.drops.tolist())
+    for i in sorted(scored.new.tolist() + scored.drops.tolist()):
+        link, title, _is_sold, location, price = cols.rows[i]
+        if i in drops:
+            # --- GESTIONE RIBASSI ---
+            old_price = plain_price(scored.old[i])
+            if not batch.drop(link, title, price, name, location, old_price):
+                continue
+            batch.messages.append(f"📉 RIBASSO: {title}\n💰 {price}€ (Era: {old_price}€)\n🔗 {link}")
+            print(f"   📉 [DROP] {title}: {old_price}€ -> {price}€")
+            continue
+
+        z = float(scored.z[i])
+        notifica_testo = None
+        if mu != 0 and scored.tier[i] >= 0:
+            tag = TIERS[scored.tier[i]][1]
+            risparmio = mu - price
+            notifica_testo = f"{tag} (z:{z:.2f})\n📱 {title}\n💵 {price}€ (Media: {mu:.0f}€)\n📉 Sconto: {risparmio:.0f}€\n🔗 {link}"
+
+        repost = reposts.get(link)
+        if repost is not None:
+            # --- RIPUBBLICATO: si avvisa solo se è sceso di prezzo, come un ribasso ---
+            if not batch.repost(link, title, price, name, location, repost):
+                continue
+            metrics.inc("reposts_total", search=name)
+            if repost.price and price < repost.price:
+                batch.messages.append(f"♻️ RIPUBBLICATO PIÙ BASSO: {title}\n💰 {price}€ (Era: {plain_price(repost.price)}€)\n🔗 {link}")
+                print(f"   ♻️ [REPOST] {title}: {plain_price(repost.price)}€ -> {price}€")
+            else:
+                # L'affare si tiene da parte: se a fine giro l'originale risulta ancora vivo, parte lo stesso
+                if notifica_testo is not None:
+                    held[link] = notifica_testo
+                print(f"   ♻️ [REPOST] {title} - {price}€ (già visto: {repost.previous})")
+            continue
+        if link in returned:
+            # Avevamo preso un annuncio ancora vivo per la copia di un altro: rientra senza notifica
+            if batch.insert(link, title, price, name, location):
+                print(f"   ↩️ [TORNATO] {title} - {price}€")
+            continue
+
+        # --- NUOVO ELEMENTO (per questa ricerca) ---
+        if not batch.insert(link, title, price, name, location):
+            continue
+        if mu == 0:
+            print(f"   ✨ [FIRST SCAN] {title} - {price}€")
+        elif notifica_testo is not None:
+            batch.messages.append(notifica_testo) # <--- ORA LO CARICHIAMO SUL FURGONE
+            print(f"   🎯 [HIT] {title} - {price}€ (z:{z:.1f})")
+        else:
+            # Log opzionale per vedere cosa viene scartato (commentalo se troppi log)
+            print(f"   ☁️ [SAVE] {title} - {price}€ (z:{z:.2f})")
+
+    for i in scored.touched:
+        link, title, _is_sold, location, price = cols.rows[i]
+        batch.touch(link, (link, title, price, name, location))
+
+    # Un commit per pagina; se fallisce l'eccezione risale e le notifiche restano a terra
+    persistence.flush(conn, batch, market)
+    if link_index is not None:
+        link_index.apply(batch)
+    run.msg.extend(batch.messages)
+    held_deals.update(held)
+    return batch
+
+def settle_reposts(send=True):
+    '''Fine giro: ritira dal mercato gli originali delle ripubblicazioni che nessuna ricerca vede più,
+    e scollega (mandando l'affare trattenuto) le "copie" il cui originale è ancora vivo'''
+    if args.reposts_off:
+        return
+    import reposts
+    try:
+        with persistence.write_transaction(conn):
+            gone, confirmed, live = reposts.settle(conn)
+        batch = persistence.PageBatch("")
+        for link in gone:
+            batch.retire(link)
+        persistence.flush(conn, batch, market)
+        if link_index is not None:
+            link_index.apply(batch)
+    except Exception as e:
+        print(f"❌ Errore chiudendo le ripubblicazioni: {str(e)}")
+        return
+    if live:
+        print(f"↩️ {len(live)} ripubblicazioni annullate: l'originale è ancora online")
+    messages = [held_deals.pop(link) for link in live if link in held_deals]
+    for link in confirmed:
+        held_deals.pop(link, None)
+    if messages and send:
+        send_notifications(messages)
+
+def page_is_quiet(batch):
+    '''Con --early_stop: la pagina è "tranquilla" se (quasi) tutti gli annunci sono già noti a prezzo invariato.
+    Se il filtro prezzo ha scartato tutto non possiamo dirlo, quindi si va avanti.'''
+    if not args.early_stop:
+        return False
+    considered = len(batch.new) + len(batch.drops) + len(batch.touched)
+    if considered == 0:
+        return False
+    return len(batch.touched) / considered >= float(args.stop_fraction)
+
+
+def handle_page(run, page, content, cols):
+    '''Lavora una pagina di risultati per una ricerca, o la salta se è identica all'ultimo giro.
+    Ritorna (novità trovate, pagina tranquilla per --early_stop).'''
+    name = run.name
+    fingerprint = page_fingerprint(content, run.low_bound, run.high_bound)
+    links = fingerprints.unchanged(name, page, fingerprint)
+    # Se nel frattempo qualcuno ha tolto quei link dal DB (es. --delete) la rilavoriamo da capo
+    if links is not None and (link_index is None or all(link_index.get(name, l) is not None for l in links)):
+        print(f"   💤 [{name}] Pagina {page} identica all'ultimo giro: rinfresco solo i timestamp")
+        metrics.inc("pages_unchanged_total")
+        touched = persistence.touch(conn, name, links, market)
+        if not touched.lost:
+            return 0, args.early_stop
+        # Un altro processo ha cancellato delle righe che l'indice in memoria dava per buone: si rilavora
+        if link_index is not None:
+            link_index.apply(touched)
+        print(f"   🔁 [{name}] {len(touched.lost)} annunci spariti dal DB nel frattempo: rilavoro la pagina")
+
+    print(f"   📄 [{name}] Analizzando Pagina {page}...")
+    with metrics.timed("process"):
+        batch = process_items(cols, run)
+    fingerprints.store(name, page, fingerprint, batch)
+    metrics.inc("listings_total", len(batch.new), kind="new")
+    metrics.inc("listings_total", len(batch.drops), kind="dropped")
+    metrics.inc("listings_total", len(batch.sold), kind="sold")
+    return len(batch.new) + len(batch.drops), page_is_quiet(batch)
+
+def fan_out(runs, page, items_list):
+    '''Una pagina scaricata e letta una volta, lavorata da ogni ricerca del gruppo che la vuole ancora.
+    Ritorna True se almeno una vuole anche la pagina dopo.'''
+    from scoring import PageColumns
+    metrics.inc("listings_total", len(items_list), kind="seen")
+    cols = PageColumns([parse_item(w['item']) for w in items_list if w.get('item')])
+    content = page_content(items_list)
+    for run in runs:
+        if not run.wants(page):
+            continue
+        page_hits, quiet = handle_page(run, page, content, cols)
+        run.hits += page_hits
+        if quiet:
+            print(f"   ⏹️ [{run.name}] Pagina {page} senza novità: mi fermo qui")
+            run.done = True
+    return any(run.wants(page + 1) for run in runs)
+
+def count_response(response):
+    metrics.inc("pages_fetched_total")
+    metrics.inc("http_responses_total", code=response.status_code)
+
+def hunt_banner(runs, mode=""):
+    max_pages = max(run.max_pages for run in runs)
+    names = ", ".join(f'"{run.name}"' for run in runs)
+    print(f" {datetime.now().strftime('%H:%M:%S')} - 🕵️ Caccia aperta ({max_pages} pag{mode}) per: {names}")
+    return max_pages, names
+
+def finish_runs(runs, pages, started, finished):
+    '''Metriche per ricerca. Ritorna le novità solo se la paginazione è arrivata in fondo:
+    una ricerca saltata (interruttore aperto, errore) non conta come eseguita'''
+    for run in runs:
+        metrics.event("search", search=run.name, pages=pages, hits=run.hits, notifications=len(run.msg),
+                      seconds=round(t.perf_counter() - started, 3), shared=len(runs), finished=finished)
+    return {run.name: run.hits for run in runs} if finished else {}
+
+@metrics.instrument("run_query")
+def run_shared(url, runs, notify):
+    '''Versione Pro: Scansione multi-pagina (1-max_pages) con logica Z-Score, per una o più ricerche con lo stesso URL.
+    Ritorna le novità (nuovi + ribassi) di ogni ricerca, vuoto se non ha finito.'''
+    max_pages, names = hunt_banner(runs)
+    pages = 0
+    finished = False
+    started = t.perf_counter()
+    entry = get_pool().acquire() # una sessione per tutte le pagine, come un browser
 
     try:
         # 1. ANALISI MERCATO (Lo facciamo una volta prima del loop)
-        stats = get_market_int(name)
-        mu = stats['mu'] if stats else 0
-        sigma = stats['sigma'] if stats else 0
-        status_stats = f"{mu:.2f}€ (σ:{sigma:.1f})" if mu > 0 else "Inizializzazione..."
-        print(f"   📊 Statistiche Mercato: {status_stats}")
-
-        # 2. CICLO PAGINE (da 1 a 5)
-        for page in range(1, 6):
-            # Costruzione URL con paginazione
-            connector = "&" if "?" in url else "?"
-            page_url = f"{url}{connector}o={page}"
-            
-            # Jitter tra le pagine per non farsi sgamà
-            t.sleep(random.uniform(2, 4)) 
-            bust_url = f"{page_url}&t={int(t.time())}"
-
-            response = session.get(
-                bust_url, 
-                impersonate="chrome110",
-                headers={"Accept-Language": "it-IT,it;q=0.9", "Cache-Control": "no-cache"},
-                timeout=20
-            )
-            response.raise_for_status() 
-            
-            script_tag = BeautifulSoup(response.text, 'html.parser').find('script', id='__NEXT_DATA__')
-            if not script_tag: 
+        for run in runs:
+            run.mu, run.sigma = load_market(run.name)
+
+        # 2. CICLO PAGINE (da 1 a max_pages, o finché qualcuno del gruppo vuole ancora pagine)
+        for page in range(1, max_pages + 1):
+            # Il ritmo lo decide il throttle (con un po' di jitter per non farsi sgamà)
+            response = fetch_page(entry, build_page_url(url, page))
+            pages += 1
+
+            with metrics.timed("extract"):
+                items_list = extract_items(response.content)
+            if items_list is None: 
                 print(f"   ⚠️ Fine pagine disponibili alla {page}")
                 break # Esci dal ciclo se non c'è più nulla
+            if not items_list: break
+            archive_page(url, page, runs, response, items_list)
+
+            if not fan_out(runs, page, items_list):
+                break
+
+        # 3. INVIO NOTIFICHE (Tutto insieme alla fine delle pagine)
+        for run in runs:
+            if len(run.msg)>0:
+                send_notifications(run.msg)
+        finished = True
+            
+    except CircuitOpen as e:
+        print(f"   🔌 Salto {names} per questo giro: {e}")
+        metrics.inc("search_errors_total", reason="circuit_open")
+    except Exception as e:
+        print(f"   ❌ Errore critico {names}: {str(e)}")
+        metrics.inc("search_errors_total")
+    return finish_runs(runs, pages, started, finished)
+
+def run_query(url, name, notify, min_price, max_price, max_pages=MAX_PAGES):
+    '''Una ricerca sola (--add): ritorna le novità trovate'''
+    return run_shared(url, [SearchRun(name, min_price, max_price, max_pages)], notify).get(name, 0)
+
+class HostLimiter:
+    '''Tetto alle richieste in volo: uno globale e uno per ogni host'''
+
+    def __init__(self, global_limit, per_host_limit):
+        import asyncio
+        self.global_slots = asyncio.Semaphore(global_limit)
+        self.per_host_limit = per_host_limit
+        self.host_slots = {}
+
+    @asynccontextmanager
+    async def slot(self, url):
+        host = urlsplit(url).netloc
+        if host not in self.host_slots:
+            import asyncio
+            self.host_slots[host] = asyncio.Semaphore(self.per_host_limit)
+        async with self.global_slots, self.host_slots[host]:
+            yield
+
+@metrics.instrument("run_query")
+async def run_shared_async(sessions, limiter, url, runs, notify):
+    '''Come run_shared, ma le attese e le richieste non bloccano le altre ricerche'''
+    max_pages, names = hunt_banner(runs, ", async")
+    pages = 0
+    finished = False
+    started = t.perf_counter()
+    entry = sessions.acquire()
 
-            items_list = json.loads(script_tag.string)['props']['pageProps']['initialState']['items']['list']
+    try:
+        for run in runs:
+            run.mu, run.sigma = load_market(run.name)
+
+        for page in range(1, max_pages + 1):
+            response = await fetch_page_async(sessions, entry, limiter, build_page_url(url, page))
+            pages += 1
+
+            with metrics.timed("extract"):
+                items_list = extract_items(response.content)
+            if items_list is None:
+                print(f"   ⚠️ [{names}] Fine pagine disponibili alla {page}")
+                break
             if not items_list: break
+            archive_page(url, page, runs, response, items_list)
 
-            print(f"   📄 Analizzando Pagina {page}...")
+            # SQLite gira sul thread del loop: niente lock da gestire
+            if not fan_out(runs, page, items_list):
+                break
 
-            # Filtri di budget
-            low_bound = float(min_price) if str(min_price).lower() != "null" else 0
-            high_bound = float(max_price) if str(max_price).lower() != "null" else float('inf')
+        for run in runs:
+            if len(run.msg)>0:
+                send_notifications(run.msg)
+        finished = True
 
-            for item_wrapper in items_list:
-                product = item_wrapper.get('item')
-                if not product: continue
+    except CircuitOpen as e:
+        print(f"   🔌 Salto {names} per questo giro: {e}")
+        metrics.inc("search_errors_total", reason="circuit_open")
+    except Exception as e:
+        print(f"   ❌ Errore critico {names}: {str(e)}")
+        metrics.inc("search_errors_total")
+    return finish_runs(runs, pages, started, finished)
+
+@metrics.instrument("refresh")
+async def refresh_async(notify, ricerche=None):
+    '''Come refresh, ma lancia tutte le ricerche attive (o quelle passate) in parallelo, entro i limiti di concorrenza'''
+    global cycle_started
+    cleanup_old_annunci()
+    started = cycle_started = t.time()
+    if archive is not None:
+        archive.begin_cycle(started)
+    hits = {}
+    try:
+        if ricerche is None:
+            ricerche = active_searches()
 
-                link = product.get('urls', {}).get('default', '')
-                title = product.get('subject', 'No Title')
-                is_sold = product.get('sold', False)
-                location = product.get('geo', {}).get('town', {}).get('value', 'Unknown')
-                
-                try:
-                    raw_p = product.get('features', {}).get('/price', {}).get('values', [{}])[0].get('key')
-                    price = int(raw_p) if raw_p else 0
-                except: price = 0
-
-                # Gestione Venduti
-                if is_sold:
-                    cursor.execute("DELETE FROM annunci WHERE link = ?", (link,))
-                    conn.commit()
-                    continue
+        if not ricerche:
+            print(f"{datetime.now().strftime('%H:%M:%S')} - 💤 Nessuna ricerca attiva nel DB.")
+            return hits
+
+        import asyncio
+        limiter = HostLimiter(int(args.concurrency), int(args.per_host))
+        sessions = async_pool()
+        try:
+            results = await asyncio.gather(*(
+                run_shared_async(sessions, limiter, url, runs, notify)
+                for url, runs in plan_fetches(ricerche)
+            ))
+        finally:
+            print(sessions.status())
+            for session in sessions.drain():
+                await session.close()
+
+        for found in results:
+            hits.update(found)
+        for name in hits:
+            record_run(name)
+        persistence.record_cycle(conn, started, len(hits), sum(hits.values()))
+        settle_reposts()
 
-                # Filtro Range Prezzo
-                if price < low_bound or price > high_bound: continue
-
-                # Controllo DB
-                cursor.execute("SELECT prezzo FROM annunci WHERE link = ?", (link,))
-                row = cursor.fetchone()
-
-                if row is None:
-                    # --- NUOVO ELEMENTO ---
-                    cursor.execute("""
-                        INSERT INTO annunci (link, titolo, prezzo, categoria, localita, data_scoperta, ultimo_aggiornamento) 
-                        VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                    """, (link, title, price, name, location))
-                    conn.commit()
-
-                    if mu == 0:
-                        print(f"   ✨ [FIRST SCAN] {title} - {price}€")
-                    else:
-                        z = (price - mu) / sigma if sigma > 0 else 0
-                        
-                        if z <= -1.0:
-                            if z <= -2.0:
-                                tag = "🚨 AFFARE IMPERDIBILE"
-                            elif z <= -1.5:
-                                tag = "🔥 VERO AFFARE"
-                            else:
-                                tag = "💰 BUON PREZZO"
-                            
-                            risparmio = mu - price
-                            notifica_testo = f"{tag} (z:{z:.2f})\n📱 {title}\n💵 {price}€ (Media: {mu:.0f}€)\n📉 Sconto: {risparmio:.0f}€\n🔗 {link}"
-                            msg.append(notifica_testo) # <--- ORA LO CARICHIAMO SUL FURGONE
-                            print(f"   🎯 [HIT] {title} - {price}€ (z:{z:.1f})")
-                        else:
-                            # Log opzionale per vedere cosa viene scartato (commentalo se troppi log)
-                            print(f"   ☁️ [SAVE] {title} - {price}€ (z:{z:.2f})")
-                            pass
-                else:
-                    # --- GESTIONE RIBASSI O UPDATE ---
-                    old_price = row[0]
-                    if price < old_price:
-                        cursor.execute("""
-                            UPDATE annunci SET prezzo = ?, ultimo_aggiornamento = CURRENT_TIMESTAMP 
-                            WHERE link = ?
-                        """, (price, link))
-                        msg.append(f"📉 RIBASSO: {title}\n💰 {price}€ (Era: {old_price}€)\n🔗 {link}")
-                        print(f"   📉 [DROP] {title}: {old_price}€ -> {price}€")
-                    else:
-                        cursor.execute("UPDATE annunci SET ultimo_aggiornamento = CURRENT_TIMESTAMP WHERE link = ?", (link,))
-                    
-                    conn.commit()
-
-        # 3. INVIO NOTIFICHE (Tutto insieme alla fine delle 5 pagine)
-        if len(msg)>0:
-            send_telegram_messages(msg)
-            
     except Exception as e:
-        print(f"   ❌ Errore critico {name}: {str(e)}")
+        print(f"{datetime.now().strftime('%Y-%m-%d, %H:%M:%S')} - 🔥 Errore imprevisto: {str(e)}")
+    return hits
+
+def refresh_concurrent(notify, ricerche=None):
+    '''--concurrent: un giro di refresh_async nel suo event loop'''
+    import asyncio
+    return asyncio.run(refresh_async(notify, ricerche))
+
+def parse_date(value):
+    '''--since/--until: una data (o data e ora) locale, in epoch'''
+    return datetime.fromisoformat(value).timestamp() if value else None
+
+def replay(path, since=None, until=None, search=None):
+    '''--replay: rimanda i giri archiviati (--archive) dentro estrazione, scoring e scrittura come se arrivassero
+    dalla rete, alla velocità della CPU: niente throttle, niente sleep, niente notifiche.
+    URL e filtri delle ricerche sono quelli di adesso nel DB, le ricerche che non ci sono più si saltano.
+    Le righe scritte prendono l'ora di adesso, non quella dell'archivio.'''
+    global cycle_started
+    from itertools import groupby
+    from archive import Archive
+    from next_data import items_from_payload
+    source = Archive(path)
+    searches = {r['nome']: r for r in conn.execute("SELECT nome, url, prezzo_min, prezzo_max, profondita_max FROM ricerche")}
+    missing = set()
+    cycles = pages = notifications = errors = 0
+    started = t.perf_counter()
+    try:
+        for giro, archived in groupby(source.pages(since, until, search), key=lambda p: p.giro):
+            print(f" {datetime.fromtimestamp(giro).strftime('%Y-%m-%d %H:%M:%S')} - ⏪ Giro archiviato")
+            cycle_started = t.time()
+            runs, failed = {}, set()
+            for page in archived:
+                group = []
+                for name in page.searches:
+                    if name not in searches:
+                        missing.add(name)
+                        continue
+                    if name not in runs:
+                        runs[name] = SearchRun.from_row(searches[name])
+                        runs[name].mu, runs[name].sigma = load_market(name)
+                    group.append(runs[name])
+                if not group:
+                    continue
+                try:
+                    with metrics.timed("extract"):
+                        items_list = items_from_payload(page.payload)
+                    fan_out(group, page.page, items_list)
+                except Exception as e:
+                    print(f"   ❌ Pagina {page.page} di {page.url}: {str(e)}")
+                    failed.update(run.name for run in group)
+                    errors += 1
+                pages += 1
+            hits = {name: run.hits for name, run in runs.items() if name not in failed}
+            notifications += sum(len(run.msg) for run in runs.values())
+            persistence.record_cycle(conn, giro, len(hits), sum(hits.values()))
+            for name in hits:
+                record_run(name)
+            settle_reposts(send=False)
+            cycles += 1
+    finally:
+        source.close()
+
+    elapsed = t.perf_counter() - started
+    print(f"⏪ Replay: {cycles} giri, {pages} pagine in {elapsed:.1f}s ({pages / max(elapsed, 1e-9):.0f} pagine/s), "
+          f"{notifications} notifiche non spedite" + (f", {errors} pagine con errori" if errors else ""))
+    if missing:
+        print(f"⚠️ Ricerche non più nel DB, saltate: {', '.join(sorted(missing))}")
+    return pages
+
+def claim_searches():
+    '''Con --shard: rinnova i lease e ritorna i nomi delle ricerche di questo worker.
+    Per quelle appena prese carica link e statistiche che ha scritto il worker precedente.'''
+    owned, gained, lost = leases.claim()
+    for name in lost:
+        fingerprints.forget(name)
+    if gained and link_index is not None:
+        link_index.load_categories(conn, gained)
+    # Anche gli altri worker scrivono sui secchielli (expire nel cleanup): li rileggiamo a ogni giro
+    if market is not None:
+        market.reload(owned)
+    if gained or lost:
+        print(f"👷 Lease: {len(owned)} ricerche a questo worker (+{len(gained)} -{len(lost)})")
+    return owned
+
+def serve_api(background=False):
+    '''--serve: l'API JSON in sola lettura (api.py), da sola o in un thread accanto al demone'''
+    import api
+    options = (db.DB_FILE, args.serve_host, int(args.serve), int(args.api_readers))
+    if background:
+        return api.serve_in_thread(*options)
+    import asyncio
+    try:
+        asyncio.run(api.serve(*options))
+    except KeyboardInterrupt:
+        pass
+
+def without_option(argv, name):
+    '''argv senza l'opzione name (e il suo valore)'''
+    out, skip = [], False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == name:
+            skip = True
+        elif not arg.startswith(name + "="):
+            out.append(arg)
+    return out
+
+def run_workers(n):
+    '''--workers N: lancia N demoni --shard su questo stesso DB e li aspetta.
+    Se uno muore le sue ricerche passano agli altri alla scadenza del lease.
+    Ognuno ha il suo throttle: --rate e --max_rate si dividono per n, così all'host arriva lo stesso ritmo di un processo solo.'''
+    import subprocess
+    rate, max_rate = rate_limits()
+    procs = []
+    for i in range(n):
+        extra = ["--shard", "--workers", "1", "--rate", str(rate / n), "--max_rate", str(max_rate / n)]
+        if args.metrics_port is not None:
+            extra += ["--metrics_port", str(int(args.metrics_port) + i)] # una porta per worker
+        # L'API la serve il padre, una volta sola per tutti
+        argv = without_option(sys.argv[1:], "--serve")
+        procs.append(subprocess.Popen([sys.executable, os.path.abspath(__file__)] + argv + extra))
+    print(f"👷 {n} worker avviati (pid {', '.join(str(p.pid) for p in procs)})")
+    try:
+        for p in procs:
+            p.wait()
+    except KeyboardInterrupt:
+        # Il Ctrl-C arriva anche ai figli, che rilasciano i lease: aspettiamoli
+        for p in procs:
+            p.wait()
+    return max(p.returncode for p in procs)
+
+def daemon(cycles=None):
+    '''--daemon: refresh di tutte le ricerche ogni --delay secondi (all'infinito, o per cycles giri)'''
+    notify = False # Don't flood with notifications the first time
+    done = 0
+    while cycles is None or done < cycles:
+        if in_between(datetime.now().time(), time(int(args.activeHour)), time(int(args.pauseHour))):
+            started = t.perf_counter()
+            ricerche = None
+            if leases is not None:
+                owned = claim_searches()
+                ricerche = [r for r in active_searches() if r['nome'] in owned]
+            if args.concurrent:
+                hits = refresh_concurrent(notify, ricerche)
+            else:
+                hits = refresh(notify, ricerche)
+            metrics.event("cycle", searches=len(hits), hits=sum(hits.values()), seconds=round(t.perf_counter() - started, 3))
+            print_fetch_status()
+            notify = True
+            done += 1
+            print()
+            print(str(args.delay) + " seconds to next poll.")
+
+        t.sleep(int(args.delay))
+
+def scheduled_searches():
+    '''Ricerche attive con ultima esecuzione (epoch) e tasso di novità, per lo scheduler'''
+    cursor.execute("""
+        SELECT nome, CAST(strftime('%s', ultima_esecuzione) AS INTEGER) AS ultima, tasso_novita
+        FROM ricerche WHERE attiva = 1
+    """)
+    return [(r['nome'], r['ultima'], r['tasso_novita']) for r in cursor.fetchall()]
+
+def adaptive_daemon():
+    '''--daemon --adaptive: ogni ricerca ha il suo turno, più frequente per quelle che trovano novità'''
+    scheduler = SearchScheduler(int(args.min_interval), int(args.max_interval))
+    notify = False # Don't flood with notifications the first time
+    while True:
+        wait = int(args.delay)
+        if in_between(datetime.now().time(), time(int(args.activeHour)), time(int(args.pauseHour))):
+            rows = scheduled_searches()
+            if leases is not None:
+                owned = claim_searches()
+                rows = [r for r in rows if r[0] in owned]
+            scheduler.sync(rows, t.time())
+            ready = set(scheduler.pop_due(t.time()))
+            if ready:
+                ricerche = [r for r in active_searches() if r['nome'] in ready]
+                started = t.perf_counter()
+                if args.concurrent:
+                    hits = refresh_concurrent(notify, ricerche)
+                else:
+                    hits = refresh(notify, ricerche)
+                metrics.event("cycle", searches=len(hits), hits=sum(hits.values()), seconds=round(t.perf_counter() - started, 3))
+                print_fetch_status()
+                notify = True
+
+                now = t.time()
+                with persistence.write_transaction(conn):
+                    for name in ready:
+                        if name not in hits:
+                            # Non ha finito: il tasso resta quello, si riprova al prossimo turno
+                            scheduler.schedule(name, now + scheduler.interval(name))
+                            continue
+                        rate = scheduler.record(name, hits[name], now)
+                        cursor.execute("UPDATE ricerche SET tasso_novita = ? WHERE nome = ?", (rate, name))
+                        print(f"   ⏱️ {name}: {rate:.1f} novità/ora, prossimo giro tra {scheduler.interval(name):.0f}s")
+
+            next_due = scheduler.next_due()
+            if next_due is not None:
+                wait = max(1, min(next_due - t.time(), int(args.max_interval)))
+            print(f"{wait:.0f} seconds to next poll.")
+        t.sleep(wait)
 
 def save_api_credentials():
     '''A function to save the telegram api credentials into the telegramApiFile'''
@@ -428,15 +1329,6 @@ def save_ntfy_config():
     with open(ntfyConfigFile, 'w') as file:
         file.write(json.dumps(ntfyConfig))
 
-def send_ntfy_messages(messages):
-    for msg in messages:
-        if not args.ntfyoff and "ntfy_server" in ntfyConfig and "ntfy_topic" in ntfyConfig:
-            url = f"{ntfyConfig['ntfy_server'].rstrip('/')}/{ntfyConfig['ntfy_topic']}"
-            try:
-                requests.post(url, data=msg.encode('utf-8'))
-            except Exception as e:
-                print(f"Failed to send ntfy notification: {e}")
-
 def is_ntfy_active():
     '''A function to check if ntfy is active, i.e. if the ntfy config is present and not disabled'''
     return not args.ntfyoff and "ntfy_server" in ntfyConfig and "ntfy_topic" in ntfyConfig
@@ -451,40 +1343,27 @@ def is_telegram_active():
     '''
     return not args.tgoff and "chatid" in apiCredentials and "token" in apiCredentials
 
-def send_telegram_messages(messages):
-    '''Versione Pro: Blasts messages to multiple chat IDs'''
-    token = apiCredentials.get("token")
-    # We check if chatid is a list; if it's just a single string, we wrap it in a list
-    chat_ids = apiCredentials.get("chatid")
-    
-    if isinstance(chat_ids, str):
-        chat_ids = [chat_ids]
-    elif not chat_ids:
-        print("⚠️ No chat IDs found in config.")
-        return
-
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
-    print(f"\n📡 Broadcasting notifications to {len(chat_ids)} recipients...")
-
-    for msg in messages:
-        for cid in chat_ids:
-            payload = {
-                "chat_id": cid,
-                "text": msg,
-                "parse_mode": "Markdown",
-                "disable_web_page_preview": False
-            }
-
-            try:
-                response = requests.post(url, json=payload, timeout=10)
-                
-                if response.status_code != 200:
-                    print(f"  ⚠️ Error for ID {cid} ({response.status_code}): {response.text}")
-                else:
-                    print(f"  📨 Sent to {cid}")
-
-            except Exception as e:
-                print(f"  ❌ Critical failure for ID {cid}: {str(e)}")
+def get_notifier():
+    '''Crea al primo uso il dispatcher in background con tutte le destinazioni attive'''
+    global notifier
+    if notifier is None:
+        from notifier import Notifier, NtfySink, TelegramSink, pooled_session
+        workers = int(args.notify_workers)
+        session = pooled_session(workers * 2)
+        sinks = []
+        if is_telegram_active():
+            if apiCredentials.get("chatid"):
+                sinks.append(TelegramSink(session, workers, apiCredentials["token"], apiCredentials["chatid"]))
+            else:
+                print("⚠️ No chat IDs found in config.")
+        if is_ntfy_active():
+            sinks.append(NtfySink(session, workers, ntfyConfig["ntfy_server"], ntfyConfig["ntfy_topic"]))
+        notifier = Notifier(sinks)
+    return notifier
+
+def send_notifications(messages):
+    '''Mette in coda i messaggi per Telegram e ntfy e torna subito: lo scraping non aspetta gli invii'''
+    get_notifier().submit(messages)
 
 def in_between(now, start, end):
     '''A function to check if a time is in between two other times
@@ -513,9 +1392,36 @@ if __name__ == '__main__':
 
     ### Setup commands ###
 
+    if args.metrics_port is not None or args.log_json is not None:
+        metrics.enable(args.log_json)
+    if args.metrics_port is not None:
+        metrics.serve(int(args.metrics_port))
+        print(f"📈 Metriche su http://127.0.0.1:{args.metrics_port}/metrics")
+
+    if args.daemon and int(args.workers) > 1:
+        # Schema aggiornato qui, una volta sola, prima che partano lettori e worker
+        db.open_writer(verbose=False).close()
+        if args.serve is not None:
+            serve_api(background=True)
+        sys.exit(run_workers(int(args.workers)))
+
     load_api_credentials()
     load_ntfy_config()
-    connect_database()
+    # --list e --short_list da soli leggono e basta: connessione in sola lettura
+    writes = args.refresh or args.daemon or args.url is not None or args.delete is not None or args.check_stats or args.replay is not None
+    connect_database(readonly=not writes)
+    if args.refresh or args.daemon or args.replay is not None:
+        load_link_index()
+    if args.refresh or args.daemon or args.url is not None or args.check_stats or args.replay is not None:
+        load_market_stats()
+    if args.archive is not None and (args.refresh or args.daemon or args.url is not None):
+        open_archive()
+    if args.check_stats:
+        check_market_stats()
+    if args.market_report:
+        print_market_report()
+    if args.export_history is not None:
+        export_price_history(args.export_history)
     if args.list:
         print(datetime.now().strftime("%Y-%m-%d, %H:%M:%S") + " printing current status...")
         print_queries()
@@ -524,9 +1430,13 @@ if __name__ == '__main__':
         print(datetime.now().strftime("%Y-%m-%d, %H:%M:%S") + " printing quick sitrep...")
         print_sitrep()
 
+    if args.find is not None:
+        find_listings(args.find, args.minPrice, args.maxPrice, args.find_in, args.max_age, args.limit)
+
     if args.url is not None and args.name is not None:
-        add(args.url, args.name, args.minPrice if args.minPrice is not None else "null", args.maxPrice if args.maxPrice is not None else "null")
-        run_query(args.url, args.name, False, args.minPrice if args.minPrice is not None else "null", args.maxPrice if args.maxPrice is not None else "null",)
+        max_pages = args.maxPages if args.maxPages is not None else MAX_PAGES
+        add(args.url, args.name, args.minPrice if args.minPrice is not None else "null", args.maxPrice if args.maxPrice is not None else "null", max_pages)
+        run_query(args.url, args.name, False, args.minPrice if args.minPrice is not None else "null", args.maxPrice if args.maxPrice is not None else "null", max_pages)
         print(datetime.now().strftime("%Y-%m-%d, %H:%M:%S") + " Query added.")
 
     if args.delete is not None:
@@ -553,20 +1463,35 @@ if __name__ == '__main__':
 
     ### Run commands ###
 
+    if args.replay is not None:
+        replay(args.replay, parse_date(args.since), parse_date(args.until), args.find_in)
+
     if args.refresh:
-        refresh(True)
+        if args.concurrent:
+            refresh_concurrent(True)
+        else:
+            refresh(True)
 
 
 
+    if args.serve is not None:
+        serve_api(background=args.daemon)
+
+    if args.daemon and args.shard:
+        from leases import Leases
+        leases = Leases(ttl=int(args.lease_ttl)).start()
+        print(f"👷 Worker {leases.worker}: prendo la mia parte delle ricerche")
+
+    if args.daemon and args.adaptive:
+        adaptive_daemon()
+
     if args.daemon:
-        notify = False # Don't flood with notifications the first time
-        while True:
-            if in_between(datetime.now().time(), time(int(args.activeHour)), time(int(args.pauseHour))):
-                refresh(notify)
-                notify = True
-                print()
-                print(str(args.delay) + " seconds to next poll.")
+        daemon()
 
-            t.sleep(int(args.delay))
+    # --refresh e --add escono subito dopo: diamo tempo alle code di svuotarsi
+    if notifier is not None and not notifier.drain():
+        print(f"⚠️ {notifier.pending()} notifiche non consegnate in tempo.")
+    if archive is not None:
+        archive.close()
     conn.close()
     print("Database connection closed")
@@ -0,0 +1,226 @@
+import random
+import time as t
+from urllib.parse import urlsplit
+
+import metrics
+
+# Ritmo delle richieste verso ogni host: un token bucket la cui velocità segue l'AIMD.
+# Finché le risposte sono sane sale di un gradino a ogni pagina; un 429/403, una pagina di
+# challenge o un timeout la dimezzano (e Retry-After, se c'è, ferma l'host fino alla scadenza),
+# una latenza fuori scala, un 5xx o una connessione caduta la tagliano di meno.
+# Se i blocchi si ripetono scatta l'interruttore: niente richieste per un po' (che raddoppia a
+# ogni ricaduta), poi una sola richiesta di prova decide se si riparte o si richiude:
+# qualsiasi risposta che non sia sana (blocco, 5xx, connessione caduta) lo riapre.
+
+CLOSED, OPEN, HALF_OPEN = "chiuso", "aperto", "di prova"
+STATE_GAUGE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+BLOCK_FACTOR = 0.5    # 429/403/challenge/timeout: velocità dimezzata
+SLOW_FACTOR = 0.7     # latenza fuori scala o 5xx
+INCREASE_STEPS = 200  # da min a max in circa 200 risposte sane
+SPIKE_FACTOR = 3.0    # latenza oltre 3 volte la media mobile...
+SPIKE_FLOOR = 5.0     # ...e comunque oltre 5 secondi
+LATENCY_SMOOTHING = 0.2
+TRIP_AFTER = 3        # blocchi di fila prima di aprire l'interruttore
+OPEN_BASE = 60        # secondi di pausa alla prima apertura
+OPEN_MAX = 1800
+JITTER = 0.3          # fino al 30% di un intervallo in più, per non sembrare un metronomo
+
+# Pagine "sane" che in realtà sono una verifica anti-bot (se manca anche __NEXT_DATA__)
+CHALLENGE_MARKERS = (b"captcha-delivery.com", b"datadome", b"cf-chl-", b"challenge-platform")
+
+
+class CircuitOpen(Exception):
+    '''L'host ci sta bloccando (o ci ha chiesto di aspettare troppo): per questo giro niente richieste'''
+
+    def __init__(self, host, seconds):
+        super().__init__(f"{host} in pausa per altri {seconds:.0f}s")
+        self.host, self.seconds = host, seconds
+
+
+class Blocked(Exception):
+    '''Risposta di blocco anche dopo i tentativi: 429, 403 o challenge'''
+
+
+def retry_after(value, now=None):
+    '''Secondi di Retry-After, sia come numero che come data HTTP; None se manca o non si capisce'''
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    # email si porta dietro mezzo stdlib: serve solo se il server manda una data
+    from datetime import datetime, timezone
+    from email.utils import parsedate_to_datetime
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    now = now if now is not None else datetime.now(timezone.utc)
+    return max(0.0, (when - now).total_seconds())
+
+
+def is_challenge(body):
+    '''Un 200 che in realtà è la pagina del captcha: lo script anti-bot c'è anche nelle pagine vere, i dati no'''
+    if not body or b"__NEXT_DATA__" in body:
+        return False
+    head = body[:20000].lower()
+    return any(marker in head for marker in CHALLENGE_MARKERS)
+
+
+class HostPacer:
+    '''Token bucket, media della latenza e interruttore di un host'''
+
+    def __init__(self, host, rate, min_rate, max_rate):
+        self.host = host
+        self.rate, self.min_rate, self.max_rate = rate, min_rate, max_rate
+        self.tokens = 1.0
+        self.refilled = t.monotonic() # da qui il secchio si ricarica: dopo un Retry-After è nel futuro
+        self.last_cut = 0.0           # ultimo rallentamento: le risposte a richieste partite prima non contano
+        self.latency = None           # media mobile delle risposte sane
+        self.state = CLOSED
+        self.strikes = 0              # blocchi di fila
+        self.open_for = OPEN_BASE
+        self.open_until = 0.0
+        self.probing = False
+
+    def reserve(self, max_wait, now=None):
+        '''Prenota la prossima richiesta: ritorna quanti secondi aspettare prima di farla'''
+        now = now if now is not None else t.monotonic()
+        if self.state == OPEN:
+            if now < self.open_until:
+                raise CircuitOpen(self.host, self.open_until - now)
+            self.transition(HALF_OPEN, "provo una richiesta")
+        if self.state == HALF_OPEN and self.probing:
+            raise CircuitOpen(self.host, 0)
+        if self.refilled - now > max_wait:
+            raise CircuitOpen(self.host, self.refilled - now)
+
+        if now > self.refilled:
+            self.tokens = min(1.0, self.tokens + (now - self.refilled) * self.rate)
+            self.refilled = now
+        # Il gettone si spende subito: chi arriva dopo (async) si mette in coda dietro
+        self.tokens -= 1
+        self.probing = self.state == HALF_OPEN
+        return (self.refilled - now) + max(0.0, -self.tokens / self.rate) + random.uniform(0, JITTER / self.rate)
+
+    def healthy(self, latency, sent=None):
+        '''Risposta buona. Ritorna False se è arrivata troppo lenta (e allora rallentiamo).'''
+        spike = (self.latency is not None and latency > SPIKE_FACTOR * self.latency and latency > SPIKE_FLOOR)
+        self.latency = latency if self.latency is None else (
+            LATENCY_SMOOTHING * latency + (1 - LATENCY_SMOOTHING) * self.latency)
+        self.strikes = 0
+        if self.state == HALF_OPEN:
+            self.open_for = OPEN_BASE
+            self.transition(CLOSED, "l'host risponde di nuovo")
+        if spike:
+            self.slow_down(SLOW_FACTOR, f"latenza {latency:.1f}s", sent)
+            return False
+        self.rate = min(self.max_rate, self.rate + (self.max_rate - self.min_rate) / INCREASE_STEPS)
+        self.publish()
+        return True
+
+    def blocked(self, reason, wait=None, sent=None, now=None):
+        '''429/403/challenge/timeout: metà velocità, Retry-After e, se si ripete, interruttore aperto.
+        Le richieste già in volo quando abbiamo rallentato contano come un blocco solo.'''
+        now = now if now is not None else t.monotonic()
+        if wait:
+            self.refilled = max(self.refilled, now + wait)
+            self.tokens = min(self.tokens, 0.0)
+        if not self.slow_down(BLOCK_FACTOR, reason + (f", Retry-After {wait:.0f}s" if wait else ""), sent, now):
+            return
+        self.strikes += 1
+        if self.state == HALF_OPEN or self.strikes >= TRIP_AFTER:
+            self.trip(f"{self.strikes} blocchi di fila", wait, now)
+        self.probing = False
+
+    def failed(self, reason, sent=None, now=None):
+        '''5xx o connessione caduta: non è un blocco, si rallenta un po'. Se era la richiesta di prova
+        l'host non sta ancora bene: l'interruttore si riapre, con la pausa raddoppiata.'''
+        now = now if now is not None else t.monotonic()
+        if self.state == HALF_OPEN:
+            self.trip(f"prova fallita ({reason})", None, now)
+            return
+        self.slow_down(SLOW_FACTOR, reason, sent, now)
+
+    def trip(self, reason, wait, now):
+        '''Apre l'interruttore per open_for secondi (o il Retry-After, se è più lungo)'''
+        self.open_until = now + max(self.open_for, wait or 0)
+        self.transition(OPEN, f"{reason}, pausa di {self.open_until - now:.0f}s")
+        self.open_for = min(self.open_for * 2, OPEN_MAX)
+
+    def slow_down(self, factor, reason, sent=None, now=None):
+        '''Taglia la velocità, se la richiesta è partita dopo l'ultimo taglio. Ritorna True se ha tagliato.'''
+        if sent is not None and sent < self.last_cut:
+            return False
+        self.last_cut = now if now is not None else t.monotonic()
+        self.rate = max(self.min_rate, self.rate * factor)
+        self.tokens = min(self.tokens, 0.0)
+        print(f"   🚦 {self.host}: {reason} -> {self.rate:.2f} req/s")
+        metrics.inc("throttle_backoffs_total", host=self.host)
+        self.publish()
+        return True
+
+    def transition(self, state, reason):
+        self.state = state
+        self.probing = False
+        print(f"   🔌 {self.host}: interruttore {state} ({reason})")
+        metrics.inc("circuit_transitions_total", host=self.host, state=state)
+        self.publish()
+
+    def publish(self):
+        metrics.gauge("fetch_rate", round(self.rate, 4), host=self.host)
+        metrics.gauge("circuit_state", STATE_GAUGE[self.state], host=self.host)
+
+    def status(self):
+        latency = f", latenza {self.latency:.2f}s" if self.latency is not None else ""
+        return f"🚦 {self.host}: {self.rate:.2f} req/s, interruttore {self.state}{latency}"
+
+
+class Throttle:
+    '''Un HostPacer per host, creato al primo uso'''
+
+    def __init__(self, rate, min_rate, max_rate, max_wait=60):
+        self.rate, self.min_rate, self.max_rate = rate, min(min_rate, rate), max(max_rate, rate)
+        self.max_wait = max_wait
+        self.hosts = {}
+
+    def pacer(self, url):
+        host = urlsplit(url).netloc
+        if host not in self.hosts:
+            self.hosts[host] = HostPacer(host, self.rate, self.min_rate, self.max_rate)
+        return self.hosts[host]
+
+    def wait(self, url):
+        '''Aspetta il proprio turno (o solleva CircuitOpen)'''
+        delay = self.pacer(url).reserve(self.max_wait)
+        with metrics.timed("pacing"):
+            t.sleep(delay)
+
+    async def wait_async(self, url):
+        import asyncio
+        delay = self.pacer(url).reserve(self.max_wait)
+        await asyncio.sleep(delay)
+
+    def record(self, url, sent, status=None, headers=None, body=None, error=None):
+        '''Esito di una richiesta partita a sent (time.monotonic). True se la risposta si può usare, False se era un blocco.'''
+        pacer = self.pacer(url)
+        if error is not None:
+            pacer.blocked(error, sent=sent)
+            return False
+        if status in (403, 429) or is_challenge(body):
+            reason = "challenge" if status not in (403, 429) else str(status)
+            pacer.blocked(reason, retry_after((headers or {}).get("Retry-After")), sent)
+            return False
+        if status >= 500:
+            pacer.failed(str(status), sent)
+            return True
+        pacer.healthy(t.monotonic() - sent, sent)
+        return True
+
+    def failed(self, url, sent, reason):
+        '''Connessione caduta (o rifiutata) prima di una risposta'''
+        self.pacer(url).failed(reason, sent)
+
+    def status(self):
+        return [p.status() for p in self.hosts.values()]